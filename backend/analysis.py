@@ -0,0 +1,586 @@
+"""
+Deterministic run analysis.
+
+compute_base_analysis() derives the timeline, section times, issues and
+sensor metrics from a run's stored logs. It has no database or network
+access, so it can run in a worker process (see reanalyze.py).
+
+The analysis is a pipeline of independent stages (section timing,
+checkpoints, kinematics, ...) that all consume the same single pass over the
+logs. Each stage sees one log at a time in add() and writes its results into
+the analysis in finish(). A new metric is a new AnalysisStage subclass
+decorated with @register_stage; it doesn't need another pass over the logs.
+
+Every stored analysis is stamped with ANALYSIS_VERSION and a hash of the
+thresholds below, so runs whose analysis is already current can be skipped.
+An analysis saved with a mock critique (no OPENROUTER_API_KEY) is flagged
+`analysis_mock` and never counts as current.
+Bump ANALYSIS_VERSION whenever the analysis logic changes.
+"""
+import hashlib
+import json
+
+from decoders import SECTION_NAMES
+from downsample import ANALYSIS_SERIES, lttb
+from prompt import PROMPT_TOKEN_BUDGET, build_critique_prompt, prompt_hash
+from stuck import POSITION_THRESHOLD, SPEED_THRESHOLD, STUCK_THRESHOLD_MS, StuckDetector
+
+ANALYSIS_VERSION = 3
+
+LONG_SECTION_MS = 120000  # More than 2 minutes in one section
+LOW_CHECKPOINT_RATE = 60  # Percent
+JERK_THRESHOLD = 100  # |acceleration| counted as a sudden change
+OBSTACLE_DISTANCE_CM = 15
+HEATMAP_CELL_SIZE = 50  # Grid cell size in units
+EVENT_STUCK_SECTION_MS = 10000  # Event format: time in one section reported as stuck
+OSCILLATION_LIMIT = 2  # Event format: section back-and-forths before reporting
+SERIES_POINTS = 500  # Stored points per chart series (LTTB); responses can ask for fewer
+
+ANALYSIS_PARAMETERS = {
+    "long_section_ms": LONG_SECTION_MS,
+    "low_checkpoint_rate": LOW_CHECKPOINT_RATE,
+    "jerk_threshold": JERK_THRESHOLD,
+    "obstacle_distance_cm": OBSTACLE_DISTANCE_CM,
+    "heatmap_cell_size": HEATMAP_CELL_SIZE,
+    "event_stuck_section_ms": EVENT_STUCK_SECTION_MS,
+    "oscillation_limit": OSCILLATION_LIMIT,
+    "series_points": SERIES_POINTS,
+    "stuck_threshold_ms": STUCK_THRESHOLD_MS,
+    "position_threshold": POSITION_THRESHOLD,
+    "speed_threshold": SPEED_THRESHOLD,
+    "prompt_token_budget": PROMPT_TOKEN_BUDGET,
+}
+
+PARAMS_HASH = hashlib.sha256(json.dumps(ANALYSIS_PARAMETERS, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def current_analysis_query():
+    """MongoDB filter matching runs whose stored analysis is current."""
+    return {"analyzed": True, "analysis_version": ANALYSIS_VERSION, "analysis_params_hash": PARAMS_HASH,
+            "analysis_mock": {"$ne": True}}
+
+
+def is_analysis_current(run):
+    return (run.get("analyzed", False)
+            and run.get("analysis_version") == ANALYSIS_VERSION
+            and run.get("analysis_params_hash") == PARAMS_HASH
+            and not run.get("analysis_mock", False))
+
+
+# -----------------------------------------------------------------------------
+# Stages
+# -----------------------------------------------------------------------------
+class AnalysisStage:
+    """
+    One independent part of the analysis.
+
+    `formats` lists the log formats ("sensor", "event") the stage applies to.
+    add() is called for every log in order and may append {"time_ms", "event"}
+    entries to the shared timeline; finish() adds the stage's fields (and any
+    issues) to the analysis dict.
+    """
+    name = None
+    formats = ()
+
+    def add(self, log, timeline):
+        pass
+
+    def finish(self, analysis):
+        pass
+
+
+STAGES = []
+
+
+def register_stage(cls):
+    """
+    Class decorator adding a stage to the pipeline (stages run in registration
+    order). Stages for different formats may share a name.
+    """
+    STAGES.append(cls)
+    return cls
+
+
+@register_stage
+class SectionStage(AnalysisStage):
+    """Section sequence, time per section and section-change timeline events."""
+    name = "sections"
+    formats = ("sensor",)
+
+    def __init__(self):
+        self.sequence = []
+        self.times = {}
+        self.prev_id = None
+        self.current = None  # Section name the current stretch is timed against
+        self.current_start = 0
+        self.last_time = 0
+
+    def add(self, log, timeline):
+        timestamp_ms = log.get("timestamp_ms", 0)
+        section_id = log.get("section_id", 0)
+        section_name = log.get("section_name", "Unknown")
+
+        if section_id != self.prev_id:
+            if self.prev_id is not None:
+                timeline.append({"time_ms": timestamp_ms, "event": f"Entered {section_name}"})
+            self.sequence.append(section_name)
+            self.prev_id = section_id
+
+        if section_name != self.current:
+            if self.current is not None:
+                self.times[self.current] = self.times.get(self.current, 0) + (timestamp_ms - self.current_start)
+            self.current = section_name
+            self.current_start = timestamp_ms
+        self.last_time = timestamp_ms
+
+    def finish(self, analysis):
+        if self.current:
+            self.times[self.current] = self.times.get(self.current, 0) + (self.last_time - self.current_start)
+        analysis["section_sequence"] = self.sequence
+        analysis["section_times"] = self.times
+        for section, time_ms in self.times.items():
+            if time_ms > LONG_SECTION_MS:
+                analysis["issues"].append(f"Long time in {section}: {time_ms/1000:.1f}s")
+
+
+@register_stage
+class CheckpointStage(AnalysisStage):
+    name = "checkpoints"
+    formats = ("sensor",)
+
+    def __init__(self):
+        self.hits = 0
+        self.total = 0
+
+    def add(self, log, timeline):
+        self.total += 1
+        if log.get("checkpoint_success", 0) == 1:
+            self.hits += 1
+
+    def finish(self, analysis):
+        rate = (self.hits / self.total * 100) if self.total > 0 else 0
+        analysis["checkpoint_rate"] = rate
+        if rate < LOW_CHECKPOINT_RATE:
+            analysis["issues"].append(f"Low checkpoint success rate: {rate:.1f}%")
+
+
+@register_stage
+class ClawStage(AnalysisStage):
+    """Claw angle series and timeline events for picking up / dropping (claw crossing 90)."""
+    name = "claw"
+    formats = ("sensor",)
+
+    def __init__(self):
+        self.prev = None
+        self.series = []
+
+    def add(self, log, timeline):
+        claw = log.get("claw_status", 0)
+        self.series.append({"time_ms": log.get("timestamp_ms", 0), "angle": claw})
+        if self.prev is not None:
+            if self.prev < 90 and claw >= 90:
+                timeline.append({"time_ms": log.get("timestamp_ms", 0), "event": "Claw closed (picking up)"})
+            elif self.prev >= 90 and claw < 90:
+                timeline.append({"time_ms": log.get("timestamp_ms", 0), "event": "Claw opened (dropping)"})
+        self.prev = claw
+
+    def finish(self, analysis):
+        analysis["claw_over_time"] = lttb(self.series, SERIES_POINTS, y_key="angle")
+
+
+@register_stage
+class ObstacleStage(AnalysisStage):
+    """Ultrasonic distance series and average, and a timeline event when an obstacle comes into range."""
+    name = "obstacles"
+    formats = ("sensor",)
+
+    def __init__(self):
+        self.total = 0
+        self.count = 0
+        self.prev = None
+        self.series = []
+
+    def add(self, log, timeline):
+        ultrasonic = log.get("ultrasonic_distance", 0)
+        self.total += ultrasonic
+        self.count += 1
+        self.series.append({"time_ms": log.get("timestamp_ms", 0), "distance": ultrasonic})
+        if ultrasonic < OBSTACLE_DISTANCE_CM and (self.prev is None or self.prev >= OBSTACLE_DISTANCE_CM):
+            timeline.append({"time_ms": log.get("timestamp_ms", 0), "event": f"Obstacle detected ({ultrasonic}cm)"})
+        self.prev = log.get("ultrasonic_distance", 50)
+
+    def finish(self, analysis):
+        analysis["ultrasonic_avg"] = self.total / self.count if self.count else 0
+        analysis["ultrasonic_over_time"] = lttb(self.series, SERIES_POINTS, y_key="distance")
+
+
+@register_stage
+class KinematicsStage(AnalysisStage):
+    """Speed and acceleration series plus acceleration stats."""
+    name = "kinematics"
+    formats = ("sensor",)
+
+    def __init__(self):
+        self.prev = None  # (timestamp_ms, x, y)
+        self.prev_velocity = None
+        self.speed_over_time = []
+        self.accelerations = []
+
+    def add(self, log, timeline):
+        timestamp_ms = log.get("timestamp_ms", 0)
+        x = log.get("x", 0)
+        y = log.get("y", 0)
+        if self.prev is not None:
+            dt = (timestamp_ms - self.prev[0]) / 1000.0
+            if dt > 0:
+                velocity = ((x - self.prev[1]) ** 2 + (y - self.prev[2]) ** 2) ** 0.5 / dt
+                self.speed_over_time.append({"time_ms": timestamp_ms, "speed": round(velocity, 2)})
+                if self.prev_velocity is not None:
+                    accel = (velocity - self.prev_velocity) / dt
+                    self.accelerations.append({
+                        "time_ms": timestamp_ms,
+                        "acceleration": round(accel, 2),
+                        "x": x,
+                        "y": y
+                    })
+                self.prev_velocity = velocity
+        self.prev = (timestamp_ms, x, y)
+
+    def finish(self, analysis):
+        speeds, accelerations = self.speed_over_time, self.accelerations
+        analysis["speed_over_time"] = lttb(speeds, SERIES_POINTS, y_key="speed")
+        analysis["acceleration_data"] = lttb(accelerations, SERIES_POINTS, y_key="acceleration")
+        if accelerations:
+            values = [a["acceleration"] for a in accelerations]
+            analysis["acceleration_stats"] = {
+                "max": round(max(values), 2),
+                "min": round(min(values), 2),
+                "avg": round(sum(values) / len(values), 2),
+                "jerky_count": sum(1 for a in values if abs(a) > JERK_THRESHOLD)  # Count sudden changes
+            }
+
+
+@register_stage
+class StuckStage(AnalysisStage):
+    name = "stuck"
+    formats = ("sensor",)
+
+    def __init__(self):
+        self.detector = StuckDetector()
+
+    def add(self, log, timeline):
+        self.detector.update(log.get("timestamp_ms", 0), log.get("x", 0), log.get("y", 0),
+                             log.get("section_name", "Unknown"))
+
+    def finish(self, analysis):
+        # Stuck episodes lasting at least stuck_threshold_ms
+        episodes = self.detector.episodes
+        analysis["stuck_events"] = episodes
+        analysis["stuck_frequency"] = {
+            "total_stuck_events": len(episodes),
+            "total_stuck_time_ms": sum(s.get("duration_ms", 0) for s in episodes),
+            "stuck_locations": [{"x": s["x"], "y": s["y"], "section": s["section"], "duration_ms": s["duration_ms"]} for s in episodes]
+        }
+
+
+@register_stage
+class HeatmapStage(AnalysisStage):
+    """Grid-based position frequency for the run heatmap."""
+    name = "heatmap"
+    formats = ("sensor",)
+
+    def __init__(self):
+        self.cells = {}  # {(grid_x, grid_y): count}
+
+    def add(self, log, timeline):
+        key = (int(log.get("x", 0) // HEATMAP_CELL_SIZE), int(log.get("y", 0) // HEATMAP_CELL_SIZE))
+        self.cells[key] = self.cells.get(key, 0) + 1
+
+    def finish(self, analysis):
+        size = HEATMAP_CELL_SIZE
+        cells = [{
+            "grid_x": gx,
+            "grid_y": gy,
+            "x": gx * size + size // 2,
+            "y": gy * size + size // 2,
+            "count": count
+        } for (gx, gy), count in self.cells.items()]
+        analysis["heatmap_data"] = sorted(cells, key=lambda h: h["count"], reverse=True)
+        analysis["heatmap_max_count"] = max(h["count"] for h in cells) if cells else 1
+
+
+def completed_section(log):
+    """Event format: name of the section a SectionComplete event closes, else None."""
+    if log.get("event_name") != "SectionComplete":
+        return None
+    section_id = (log.get("raw") or {}).get("section_id")
+    if section_id is None:
+        return log.get("zone_name", "Unknown")
+    return SECTION_NAMES.get(section_id, f"Section {section_id}")
+
+
+@register_stage
+class EventSectionStage(AnalysisStage):
+    """
+    Event format: section sequence and time per section. Sections are delimited
+    by SectionComplete events; a section's time runs from the previous one.
+    """
+    name = "sections"
+    formats = ("event",)
+
+    def __init__(self):
+        self.sequence = []
+        self.times = {}
+        self.section_start = None
+
+    def add(self, log, timeline):
+        timestamp_ms = log.get("timestamp_ms", 0)
+        if self.section_start is None:
+            self.section_start = timestamp_ms
+        section = completed_section(log)
+        if section is None:
+            return
+        self.sequence.append(section)
+        self.times[section] = self.times.get(section, 0) + (timestamp_ms - self.section_start)
+        self.section_start = timestamp_ms
+        timeline.append({"time_ms": timestamp_ms, "event": f"Completed {section}"})
+
+    def finish(self, analysis):
+        analysis["section_sequence"] = self.sequence
+        analysis["section_times"] = self.times
+        for section, time_ms in self.times.items():
+            if time_ms > EVENT_STUCK_SECTION_MS:
+                analysis["issues"].append(f"Stuck in {section}: {time_ms/1000:.1f}s")
+
+
+@register_stage
+class EventCountStage(AnalysisStage):
+    name = "event_counts"
+    formats = ("event",)
+
+    def __init__(self):
+        self.counts = {}
+
+    def add(self, log, timeline):
+        event_name = log.get("event_name", "Unknown")
+        self.counts[event_name] = self.counts.get(event_name, 0) + 1
+
+    def finish(self, analysis):
+        analysis["event_counts"] = self.counts
+
+
+@register_stage
+class OscillationStage(AnalysisStage):
+    """Event format: back-and-forth between two sections (A -> B -> A)."""
+    name = "oscillation"
+    formats = ("event",)
+
+    def __init__(self):
+        self.recent = []  # Last two distinct sections
+        self.oscillations = 0
+
+    def add(self, log, timeline):
+        section = completed_section(log)
+        if section is None or (self.recent and self.recent[-1] == section):
+            return
+        if len(self.recent) == 2 and self.recent[0] == section:
+            self.oscillations += 1
+        self.recent = (self.recent + [section])[-2:]
+
+    def finish(self, analysis):
+        analysis["oscillations"] = self.oscillations
+        if self.oscillations > OSCILLATION_LIMIT:
+            analysis["issues"].append(f"Oscillation detected: {self.oscillations} times")
+
+
+# -----------------------------------------------------------------------------
+# Pipeline
+# -----------------------------------------------------------------------------
+def detect_format(logs):
+    return "sensor" if logs and "section_id" in logs[0] else "event"
+
+
+def compute_base_analysis(logs, stages=None):
+    """
+    Timeline, section stats, issues and kinematics for a list of stored logs.
+    `stages` optionally limits the analysis to the named stages; stages that
+    don't apply to the run's log format are skipped. Raises ValueError for an
+    unknown stage name.
+    """
+    unknown = set(stages or ()) - {cls.name for cls in STAGES}
+    if unknown:
+        raise ValueError(f"Unknown analysis stage(s): {', '.join(sorted(unknown))}")
+
+    log_format = detect_format(logs)
+    pipeline = [
+        cls() for cls in STAGES
+        if log_format in cls.formats and (stages is None or cls.name in stages)
+    ]
+
+    timeline = []
+    for log in logs:
+        for stage in pipeline:
+            stage.add(log, timeline)
+
+    analysis = {"timeline": timeline, "issues": []}
+    for stage in pipeline:
+        stage.finish(analysis)
+
+    if log_format == "sensor" and logs:
+        # Add start and end milestones
+        timeline.insert(0, {"time_ms": 0, "event": "Run started"})
+        timeline.append({"time_ms": logs[-1].get("timestamp_ms", 0), "event": "Run completed"})
+    timeline.sort(key=lambda x: x["time_ms"])
+    return analysis
+
+
+def precompute_analysis(logs):
+    """Base metrics stamped with the analysis version, as the bridge's edge mode uploads them."""
+    base_analysis = compute_base_analysis(logs)
+    base_analysis["analysis_version"] = ANALYSIS_VERSION
+    base_analysis["params_hash"] = PARAMS_HASH
+    return base_analysis
+
+
+def prepare_analysis(logs, base_analysis=None):
+    """
+    Everything about an analysis that doesn't need the LLM: the base metrics
+    plus the critique prompt (its hash and size are recorded on the analysis).
+    A verified precomputed `base_analysis` is used instead of recomputing.
+    Returns (base_analysis, prompt).
+    """
+    base_analysis = dict(base_analysis) if base_analysis else precompute_analysis(logs)
+    prompt, prompt_tokens = build_critique_prompt(logs, base_analysis)
+    base_analysis["prompt_hash"] = prompt_hash(prompt)
+    base_analysis["prompt_tokens_estimate"] = prompt_tokens
+    return base_analysis, prompt
+
+
+# -----------------------------------------------------------------------------
+# Precomputed (edge) analyses
+# -----------------------------------------------------------------------------
+
+def precomputed_base(run):
+    """The run's verified precomputed base analysis, if it matches the current analysis code."""
+    analysis = run.get("precomputed_analysis")
+    if (analysis and analysis.get("analysis_version") == ANALYSIS_VERSION
+            and analysis.get("params_hash") == PARAMS_HASH):
+        return analysis
+    return None
+
+
+# Fields compute_base_analysis() produces for each log format (acceleration_stats needs 3+ moving samples)
+BASE_FIELDS = {
+    "sensor": frozenset({
+        "timeline", "issues", "section_sequence", "section_times", "checkpoint_rate", "claw_over_time",
+        "ultrasonic_avg", "ultrasonic_over_time", "speed_over_time", "acceleration_data", "acceleration_stats",
+        "stuck_events", "stuck_frequency", "heatmap_data", "heatmap_max_count",
+    }),
+    "event": frozenset({"timeline", "issues", "section_sequence", "section_times", "event_counts", "oscillations"}),
+}
+OPTIONAL_FIELDS = frozenset({"acceleration_stats"})
+VERSION_FIELDS = frozenset({"analysis_version", "params_hash"})
+
+# Stages cheap enough for /ingest to rerun; their fields, and with them every issue, must match exactly
+RECOMPUTED_STAGES = ("sections", "checkpoints", "stuck", "event_counts", "oscillation")
+
+# The other list fields: (number keys, string keys) of each element
+ELEMENT_FIELDS = {
+    "timeline": (("time_ms",), ("event",)),
+    "claw_over_time": (("time_ms", "angle"), ()),
+    "ultrasonic_over_time": (("time_ms", "distance"), ()),
+    "speed_over_time": (("time_ms", "speed"), ()),
+    "acceleration_data": (("time_ms", "acceleration", "x", "y"), ()),
+    "heatmap_data": (("grid_x", "grid_y", "x", "y", "count"), ()),
+}
+NUMBER_FIELDS = ("ultrasonic_avg", "heatmap_max_count")
+ACCELERATION_STATS = ("max", "min", "avg", "jerky_count")
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def schema_error(analysis):
+    """Why the fields of `analysis` that aren't recomputed are malformed, or None."""
+    for key, (numbers, strings) in ELEMENT_FIELDS.items():
+        if key not in analysis:
+            continue
+        items = analysis[key]
+        if not isinstance(items, list):
+            return f"{key} must be a list"
+        if key in ANALYSIS_SERIES and len(items) > SERIES_POINTS:
+            return f"{key} has more than {SERIES_POINTS} points"
+        for item in items:
+            if not (isinstance(item, dict) and all(is_number(item.get(k)) for k in numbers)
+                    and all(isinstance(item.get(k), str) for k in strings)):
+                return f"malformed {key} entry"
+    for key in NUMBER_FIELDS:
+        if key in analysis and not is_number(analysis[key]):
+            return f"{key} must be a number"
+    stats = analysis.get("acceleration_stats")
+    if stats is not None and not (isinstance(stats, dict) and all(is_number(stats.get(k)) for k in ACCELERATION_STATS)):
+        return "malformed acceleration_stats"
+    return None
+
+
+class PrecomputedCheck:
+    """
+    Verification of a base analysis computed by the uploader. /ingest feeds
+    the logs it decodes anyway to add(), which runs only the cheap stages
+    (RECOMPUTED_STAGES: section times, checkpoints, stuck episodes, event
+    counts, oscillations). check() then requires the analysis to have
+    exactly the fields of the run's format and its version stamp, the
+    recomputed fields and issues to be equal, every other field to be well
+    formed and the timeline to end with the run.
+    """
+
+    def __init__(self):
+        self.log_format = None
+        self.stages = []
+        self.last_ms = 0
+
+    def _start(self, log_format):
+        self.log_format = log_format
+        self.stages = [cls() for cls in STAGES if log_format in cls.formats and cls.name in RECOMPUTED_STAGES]
+
+    def add(self, logs):
+        if logs and self.log_format is None:
+            self._start(detect_format(logs))
+        timeline = []  # The recomputed stages' timeline entries aren't checked
+        for log in logs:
+            self.last_ms = log.get("timestamp_ms", 0)
+            for stage in self.stages:
+                stage.add(log, timeline)
+        return self
+
+    def check(self, analysis):
+        """None if `analysis` is consistent with the logs, else the reason it isn't. Call once, after every add()."""
+        if self.log_format is None:
+            self._start(detect_format([]))
+        if not isinstance(analysis, dict) or not isinstance(analysis.get("timeline"), list):
+            return "not an analysis"
+        fields = BASE_FIELDS[self.log_format]
+        unknown = set(analysis) - fields - VERSION_FIELDS
+        if unknown:
+            return f"unexpected fields: {', '.join(sorted(unknown))}"
+        missing = fields - OPTIONAL_FIELDS - set(analysis)
+        if missing:
+            return f"missing fields: {', '.join(sorted(missing))}"
+        if precomputed_base({"precomputed_analysis": analysis}) is None:
+            return "analysis version or parameters differ from the server's"
+
+        expected = {"issues": []}
+        for stage in self.stages:
+            stage.finish(expected)
+        for key, value in expected.items():
+            if analysis[key] != value:
+                return f"{key} does not match the logs"
+
+        error = schema_error(analysis)
+        if error:
+            return error
+        if self.log_format == "sensor" and not any(
+                event["event"] == "Run completed" and event["time_ms"] == self.last_ms for event in analysis["timeline"]):
+            return "run end does not match the logs"
+        return None
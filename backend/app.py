@@ -1,18 +1,40 @@
 import os
+import threading
 from datetime import datetime
 
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
-from pymongo import MongoClient
 from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
 from dotenv import load_dotenv
 import requests
 
+from analysis import PrecomputedCheck, compute_base_analysis, is_analysis_current, precomputed_base, prepare_analysis
+from clients import HttpClient, Mongo
+from compression import PayloadTooLarge, UnsupportedEncoding, decoded_body_stream, get_json_body
+from decoders import detect_decoder
+from export import FORMATS, TABLES, ExportUnavailable, export_rows, stream_export
+from downsample import MIN_POINTS, downsample_analysis
+from heatmap import DEFAULT_ZOOM, ZOOM_CELL_SIZES, FleetHeatmap, count_cells
+from json_stream import StreamingJSONObject
+from live_runs import LiveRunStats, reading_section, reading_to_log
+from reanalyze import (DEFAULT_LLM_RATE, DEFAULT_LLM_WORKERS, claim_job, create_job, find_stale_runs, job_status,
+                        new_owner, run_job)
+from playback import MAX_CHUNKS_PER_REQUEST, PREFETCH_CHUNKS, PlaybackStore, chunk_summary
+from response_cache import RESPONSE_CACHE_URL, ResponseCache, shared_store
+from retention import CLEAR, RETENTION, PurgeJob, create_purge_job, parse_policy, purge_job_status
+from run_summary import SUMMARY_FIELDS, RunSummaries, parse_run_filters, parse_score, run_summary
+from sketches import GROUP_BY, METRICS, SKETCH_RELATIVE_ACCURACY, SensorSketches
+from spatial_index import SpatialIndex
+from static_assets import StaticAssets
+from stuck import STUCK_ENDED, STUCK_STARTED, StuckDetector
+
 load_dotenv()
 
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 FRONTEND_DIR = os.path.abspath(os.path.join(BASE_DIR, "..", "frontend"))
 DIST_DIR = os.path.join(FRONTEND_DIR, "dist")  # Vite production build output
+static_assets = StaticAssets(DIST_DIR)
 
 # Create Flask app (API + optional static serving)
 app = Flask(__name__)
@@ -22,45 +44,38 @@ CORS(app)
 # MongoDB Configuration
 # -----------------------------------------------------------------------------
 MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017/utra_da")
-client = MongoClient(MONGODB_URI)
-
-# If URI explicitly includes a DB, get_default_database() can work.
-# Otherwise, fall back to a known DB name.
-try:
-    db = client.get_default_database()
-except Exception:
-    db = client["utra_da"]
-
-runs_collection = db["runs"]
-telemetry_collection = db["telemetry"]
+# Connects on first use in each process (see clients.py)
+mongo = Mongo(MONGODB_URI)
+
+runs_collection = mongo.collection("runs")
+telemetry_collection = mongo.collection("telemetry")
+heatmap_collection = mongo.collection("heatmap_cells")
+position_index_collection = mongo.collection("position_index")
+live_events_collection = mongo.collection("live_events")
+live_stuck_collection = mongo.collection("live_stuck_state")
+playback_collection = mongo.collection("playback_chunks")
+analysis_jobs_collection = mongo.collection("analysis_jobs")
+purge_jobs_collection = mongo.collection("purge_jobs")
+sketches_collection = mongo.collection("sensor_sketches")
+
+fleet_heatmap = FleetHeatmap(heatmap_collection)
+spatial_index = SpatialIndex(position_index_collection)
+playback_store = PlaybackStore(playback_collection)
+response_cache = ResponseCache(shared=shared_store(RESPONSE_CACHE_URL))
+run_summaries = RunSummaries(runs_collection)
+sensor_sketches = SensorSketches(sketches_collection)
+
+# Number of processed log entries written to MongoDB per batch during /ingest
+INGEST_CHUNK_SIZE = int(os.getenv("INGEST_CHUNK_SIZE", 5000))
+# Malformed log entries listed individually in the /ingest response
+MAX_REPORTED_ERRORS = 100
 
 # -----------------------------------------------------------------------------
 # OpenRouter Configuration
 # -----------------------------------------------------------------------------
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
 OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
-
-# Event code mappings (from Arduino EEPROM)
-EVENT_CODES = {
-    1: "Start",
-    2: "SectionComplete",
-    3: "Checkpoint",
-    4: "UltrasonicDodge",
-    5: "IRToggle",
-    6: "ServoStateChange",
-    7: "Stop",
-    8: "Error"
-}
-
-# Section IDs for the track
-SECTION_NAMES = {
-    0: "Start Zone",
-    1: "Red Path",
-    2: "Ramp",
-    3: "Green Path",
-    4: "Obstacle Zone",
-    5: "Target Zone"
-}
+http_client = HttpClient()
 
 # Servo states
 SERVO_STATES = {
@@ -68,22 +83,24 @@ SERVO_STATES = {
     1: "Grabbed Box"
 }
 
-# Legacy zone names (kept for compatibility)
-ZONE_NAMES = {
-    0: "Start",
-    1: "Red Zone",
-    2: "Blue Zone",
-    3: "Green Zone",
-    4: "Center",
-    5: "Unknown"
-}
 
-# Section names for new sensor data format
-SECTION_NAMES = {
-    1: "Red Path",
-    2: "Ramp",
-    3: "Green Path"
-}
+def body_error_status(error):
+    """HTTP status for a request body that could not be read."""
+    if isinstance(error, PayloadTooLarge):
+        return 413
+    if isinstance(error, UnsupportedEncoding):
+        return 415
+    return 400
+
+
+def get_points_param():
+    """Optional ?points= chart budget. Raises ValueError when it isn't an integer >= MIN_POINTS."""
+    if not request.args.get("points"):
+        return None
+    points = int(request.args["points"])
+    if points < MIN_POINTS:
+        raise ValueError(f"points must be at least {MIN_POINTS}")
+    return points
 
 
 def serialize_doc(doc):
@@ -95,6 +112,8 @@ def serialize_doc(doc):
         doc["created_at"] = doc["created_at"].isoformat()
     if "analyzed_at" in doc and doc["analyzed_at"]:
         doc["analyzed_at"] = doc["analyzed_at"].isoformat()
+    if "completed_at" in doc and doc["completed_at"]:
+        doc["completed_at"] = doc["completed_at"].isoformat()
     return doc
 
 
@@ -106,6 +125,67 @@ def health_check():
     return jsonify({"status": "healthy", "timestamp": datetime.utcnow().isoformat()})
 
 
+@app.route("/ready", methods=["GET"])
+def readiness_check():
+    """
+    GET /ready - whether this worker can serve requests: pings MongoDB through
+    its connection pool (creating it if needed). 503 until it answers.
+    """
+    checks = {
+        "mongodb": mongo.check(),
+        "openrouter": {"ok": True, "configured": bool(OPENROUTER_API_KEY), "session": http_client.created},
+    }
+    ready = all(check["ok"] for check in checks.values())
+    return jsonify({"ready": ready, "pid": os.getpid(), "checks": checks}), 200 if ready else 503
+
+
+@app.route("/cache/stats", methods=["GET"])
+def cache_stats():
+    """GET /cache/stats - size and hit rate of this worker's response cache."""
+    return jsonify(response_cache.stats())
+
+
+def cached_run_response(kind, run_id, variant, build):
+    """
+    Serve a run's JSON response through response_cache. Only the run's
+    cache_version is read up front; on a miss build(object_id) returns
+    (payload, status) and 200 responses are stored for that version.
+    """
+    object_id = ObjectId(run_id)
+    stamp = runs_collection.find_one({"_id": object_id}, {"cache_version": 1})
+    if stamp is None:
+        return jsonify({"error": "Run not found"}), 404
+    key = response_cache.key(kind, run_id, stamp.get("cache_version", 0), variant)
+    body = response_cache.get(key)
+    if body is None:
+        payload, status = build(object_id)
+        if status != 200:
+            return jsonify(payload), status
+        body = f"{app.json.dumps(payload)}\n".encode("utf-8")
+        response_cache.put(key, body)
+    return Response(body, mimetype="application/json")
+
+
+def write_logs_chunk(run_id, chunk, created_at):
+    """
+    Append a chunk of processed logs to a run, creating the run on the first
+    chunk. The run is marked `ingesting` (and left out of listings) until
+    ingest_data finishes it.
+    """
+    if run_id is None:
+        result = runs_collection.insert_one({
+            "logs": chunk,
+            "created_at": created_at,
+            "analyzed": False,
+            "analysis": None,
+            "ingesting": True
+        })
+        return result.inserted_id
+    if chunk:
+        runs_collection.update_one({"_id": run_id}, {"$push": {"logs": {"$each": chunk}}})
+    return run_id
+
+
 @app.route("/ingest", methods=["POST"])
 def ingest_data():
     """
@@ -115,120 +195,172 @@ def ingest_data():
     - Path format: includes x,y positions, segments, and events
     - Sensor format: section_id based
     - Event format: Arduino EEPROM events
+
+    The body is read incrementally and `logs` is decoded in batches of
+    INGEST_CHUNK_SIZE by the format decoder detected from a sample of the
+    first batch (see decoders.py), so memory use does not grow with the size
+    of the dump. Malformed entries are skipped and reported by index.
+    gzip/zstd Content-Encoding is accepted.
     """
+    run_id = None
+    created_at = datetime.utcnow()
     try:
-        data = request.get_json()
-
-        if not data:
+        body = StreamingJSONObject(decoded_body_stream(request))
+        if body.is_empty():
             return jsonify({"error": "No data provided"}), 400
 
-        if "logs" not in data:
+        data = {}
+        has_logs = False
+        decoder = None
+        logs_count = 0
+        rejected = []
+        rejected_count = 0
+        batch = []
+        batch_start = 0
+        heatmap_counts = {}
+        positions = spatial_index.tracker()
+        playback = playback_store.builder()
+        sketches = sensor_sketches.builder()
+        precomputed_check = PrecomputedCheck()
+
+        for key, value in body.items(stream_keys=("logs",)):
+            if key != "logs":
+                data[key] = value
+                continue
+
+            has_logs = True
+            for index, record in enumerate(value):
+                batch.append(record)
+                if len(batch) < INGEST_CHUNK_SIZE:
+                    continue
+                # Detect format from a sample of the first batch
+                if decoder is None:
+                    decoder = detect_decoder(batch)
+                logs, errors = decoder.decode_batch(batch, batch_start)
+                if logs:
+                    run_id = write_logs_chunk(run_id, logs, created_at)
+                count_cells(logs, heatmap_counts)
+                positions.add(logs)
+                playback.add(logs)
+                sketches.add(logs)
+                precomputed_check.add(logs)
+                logs_count += len(logs)
+                rejected_count += len(errors)
+                rejected.extend(errors[:MAX_REPORTED_ERRORS - len(rejected)])
+                batch = []
+                batch_start = index + 1
+
+        if not has_logs:
+            if not data:
+                return jsonify({"error": "No data provided"}), 400
             return jsonify({"error": "Missing 'logs' field"}), 400
 
-        processed_logs = []
-        raw_logs = data.get("logs", [])
-
-        # Detect format based on first log entry
-        has_position = raw_logs and "x" in raw_logs[0] and "y" in raw_logs[0]
-        is_sensor_format = raw_logs and "section_id" in raw_logs[0]
-
-        # Determine data format
-        if has_position:
-            data_format = "path"
-        elif is_sensor_format:
-            data_format = "sensor"
-        else:
-            data_format = "event"
-
-        for log in raw_logs:
-            if has_position:
-                # New path format with x,y positions
-                section_id = log.get("section_id", 0)
-                processed_logs.append({
-                    "x": log.get("x", 0),
-                    "y": log.get("y", 0),
-                    "segment_id": log.get("segment_id", ""),
-                    "segment_index": log.get("segment_index", 0),
-                    "section_id": section_id,
-                    "section_name": SECTION_NAMES.get(section_id, "Unknown"),
-                    "timestamp_ms": log.get("timestamp", 0),
-                    "checkpoint_success": log.get("checkpoint_success", 0),
-                    "ultrasonic_distance": log.get("ultrasonic_distance", 0),
-                    "claw_status": log.get("claw_status", 0),
-                })
-            elif is_sensor_format:
-                # Sensor data format
-                section_id = log.get("section_id", 0)
-                processed_logs.append({
-                    "section_id": section_id,
-                    "section_name": SECTION_NAMES.get(section_id, "Unknown"),
-                    "timestamp_ms": log.get("timestamp", 0),
-                    "checkpoint_success": log.get("checkpoint_success", 0),
-                    "ultrasonic_distance": log.get("ultrasonic_distance", 0),
-                    "claw_status": log.get("claw_status", 0),
-                    "raw": log
-                })
-            else:
-                # Old event-based format from Arduino EEPROM
-                event_code = log.get("event", 0)
-                zone_id = log.get("data", 0)
-                processed_logs.append({
-                    "event_code": event_code,
-                    "event_name": EVENT_CODES.get(event_code, "Unknown"),
-                    "zone_id": zone_id,
-                    "zone_name": ZONE_NAMES.get(zone_id, "Unknown"),
-                    "timestamp_ms": log.get("timestamp", 0),
-                    "raw": log
-                })
-
-        run_doc = {
-            "robot_id": data.get("robot_id", "unknown"),
+        if decoder is None:
+            decoder = detect_decoder(batch)
+        logs, errors = decoder.decode_batch(batch, batch_start)
+        count_cells(logs, heatmap_counts)
+        positions.add(logs)
+        playback.add(logs)
+        sketches.add(logs)
+        precomputed_check.add(logs)
+        logs_count += len(logs)
+        rejected_count += len(errors)
+        rejected.extend(errors[:MAX_REPORTED_ERRORS - len(rejected)])
+
+        if rejected_count and not logs_count:
+            return jsonify({
+                "error": "No valid log entries",
+                "data_format": decoder.name,
+                "rejected_count": rejected_count,
+                "rejected": rejected
+            }), 400
+
+        run_id = write_logs_chunk(run_id, logs, created_at)
+        robot_id = data.get("robot_id", "unknown")
+        fields = {
+            "robot_id": robot_id,
             "run_number": data.get("run_number", 0),
-            "logs": processed_logs,
             "events": data.get("events", []),  # Store events separately
             "segments": data.get("segments", []),  # Store segment data
             "metadata": data.get("metadata", {}),
-            "data_format": data_format,
-            "created_at": datetime.utcnow(),
-            "analyzed": False,
-            "analysis": None
+            "data_format": decoder.name,
         }
+        # Base analysis computed by the uploader (bridge edge mode), kept if consistent with the logs
+        precomputed_error = None
+        if "precomputed_analysis" in data:
+            precomputed_error = precomputed_check.check(data["precomputed_analysis"])
+            if precomputed_error is None:
+                fields["precomputed_analysis"] = data["precomputed_analysis"]
+        runs_collection.update_one({"_id": run_id}, {
+            "$set": fields, "$unset": {"ingesting": ""}, "$inc": {"cache_version": 1}
+        })
+        response_cache.invalidate(run_id)
+        fleet_heatmap.add_counts(robot_id, created_at, heatmap_counts)
+        spatial_index.add_run(run_id, robot_id, created_at, positions.finish())
+        playback_store.add_run(run_id, playback.finish())
+        sensor_sketches.add_run(robot_id, created_at, sketches.finish())
 
-        result = runs_collection.insert_one(run_doc)
-
-        return jsonify({
+        response = {
             "success": True,
-            "run_id": str(result.inserted_id),
-            "logs_count": len(processed_logs),
+            "run_id": str(run_id),
+            "data_format": decoder.name,
+            "logs_count": logs_count,
             "events_count": len(data.get("events", [])),
-            "segments_count": len(data.get("segments", []))
-        }), 201
-
+            "segments_count": len(data.get("segments", [])),
+            "rejected_count": rejected_count,
+            "rejected": rejected
+        }
+        if "precomputed_analysis" in data:
+            response["precomputed"] = "rejected" if precomputed_error else "accepted"
+            if precomputed_error:
+                response["precomputed_error"] = precomputed_error
+        return jsonify(response), 201
+
+    except (ValueError, PayloadTooLarge, UnsupportedEncoding) as e:
+        if run_id is not None:
+            runs_collection.delete_one({"_id": run_id})
+        return jsonify({"error": str(e)}), body_error_status(e)
     except Exception as e:
         import traceback
         print(f"INGEST ERROR: {e}")
         traceback.print_exc()
+        if run_id is not None:
+            runs_collection.delete_one({"_id": run_id})
         return jsonify({"error": str(e)}), 500
 
 
 @app.route("/runs", methods=["GET"])
 def get_runs():
-    """GET /runs - list runs (supports pagination and robot_id filter)."""
+    """
+    GET /runs - list runs (paginated). Filters: robot_id, and ranges on the
+    analysis summary fields (min_score, max_score, min_checkpoint_rate,
+    max_duration_ms, min_stuck_time_ms, ...). sort=field or -field
+    (comma-separated) orders by summary fields, created_at or run_number;
+    the default is newest first.
+    """
     try:
         robot_id = request.args.get("robot_id")
         limit = int(request.args.get("limit", 50))
         skip = int(request.args.get("skip", 0))
+        query, sort = parse_run_filters(request.args)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid query parameter: {e}"}), 400
 
-        query = {}
+    try:
         if robot_id:
             query["robot_id"] = robot_id
-
-        runs = list(
-            runs_collection.find(query)
-            .sort("created_at", -1)
-            .skip(skip)
-            .limit(limit)
-        )
+        query["ingesting"] = {"$ne": True}  # Still being uploaded
+        run_summaries.ensure_indexes()
+
+        # Logs and analyses are only counted or summarized here; keep them in the database
+        runs = list(runs_collection.aggregate([
+            {"$match": query},
+            {"$sort": dict(sort)},
+            {"$skip": skip},
+            {"$limit": limit},
+            {"$addFields": {"logs_count": {"$size": {"$ifNull": ["$logs", []]}}}},
+            {"$project": {"logs": 0, "analysis": 0, "precomputed_analysis": 0}}
+        ]))
 
         serialized_runs = []
         for run in runs:
@@ -236,10 +368,13 @@ def get_runs():
                 "_id": str(run["_id"]),
                 "robot_id": run.get("robot_id"),
                 "run_number": run.get("run_number"),
-                "logs_count": len(run.get("logs", [])),
+                "logs_count": run["logs_count"],
                 "created_at": run.get("created_at").isoformat() if run.get("created_at") else None,
                 "analyzed": run.get("analyzed", False),
-                "metadata": run.get("metadata", {})
+                "analysis_current": is_analysis_current(run),
+                "live": run.get("live", False),
+                "metadata": run.get("metadata", {}),
+                **{field: run.get(field) for field in SUMMARY_FIELDS}
             })
 
         total_count = runs_collection.count_documents(query)
@@ -255,36 +390,215 @@ def get_runs():
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/runs/summary/rebuild", methods=["POST"])
+def rebuild_run_summaries():
+    """POST /runs/summary/rebuild - recompute the summary fields of analyzed runs from their analyses."""
+    try:
+        return jsonify({"success": True, "runs": run_summaries.rebuild()})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+def runs_deleted(run_ids):
+    """Drop derived data of deleted runs (the fleet heatmap and sensor sketches keep their aggregates)."""
+    spatial_index.delete_runs(run_ids)
+    playback_store.delete_runs(run_ids)
+    for run_id in run_ids:
+        response_cache.invalidate(run_id)
+
+
+def runs_cleared(up_to_id):
+    """After a clear: rebuild the aggregates from the runs uploaded while it ran (_id > up_to_id)."""
+    response_cache.clear()
+    fleet_heatmap.clear()
+    sensor_sketches.clear()
+    # Runs still being ingested add themselves when they finish
+    newer = {"ingesting": {"$ne": True}}
+    if up_to_id is not None:
+        newer["_id"] = {"$gt": up_to_id}
+    projection = {"robot_id": 1, "created_at": 1, "live": 1, "logs.x": 1, "logs.y": 1, "logs.section_id": 1,
+                  "logs.timestamp_ms": 1, "logs.ultrasonic_distance": 1}
+    for run in runs_collection.find(newer, projection):
+        if not run.get("live"):  # Open live runs are added when they close
+            fleet_heatmap.add_run(run)
+            sensor_sketches.add_stored_run(run)
+
+
+def purge_job(job_id, chunk_size=None, pause=None, on_progress=None):
+    options = {key: value for key, value in (("chunk_size", chunk_size), ("pause", pause)) if value is not None}
+    job = PurgeJob(job_id, purge_jobs_collection, runs_collection, telemetry_collection,
+                   runs_deleted, runs_cleared, on_progress=on_progress, **options)
+    return job.run()
+
+
+def run_purge_job(job_id):
+    try:
+        purge_job(job_id)
+    except Exception as e:
+        print(f"Purge job {job_id} failed: {e}")
+
+
+def start_purge_job(kind, policy):
+    job_id = create_purge_job(purge_jobs_collection, kind, policy, runs_collection)
+    threading.Thread(target=run_purge_job, args=(job_id,), daemon=True).start()
+    return jsonify({"success": True, "job_id": str(job_id), "status_url": f"/maintenance/jobs/{job_id}"}), 202
+
+
 @app.route("/runs/clear", methods=["DELETE"])
 def clear_all_runs():
-    """DELETE /runs/clear - delete all runs from the database."""
+    """
+    DELETE /runs/clear?archive=true
+    Start a background job that deletes every run in chunks (archiving them
+    first with archive=true). Returns 202 with the job id.
+    """
     try:
-        result = runs_collection.delete_many({})
-        return jsonify({
-            "success": True,
-            "deleted_count": result.deleted_count
-        })
+        try:
+            policy = parse_policy({"archive": request.args.get("archive", "").lower() in ("1", "true")})
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        return start_purge_job(CLEAR, {"archive_dir": policy["archive_dir"]})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/maintenance/retention", methods=["POST"])
+def apply_retention():
+    """
+    POST /maintenance/retention
+    Start a background job applying the retention policy: keep the newest
+    `keep_runs_per_robot` runs of each robot and delete telemetry older than
+    `telemetry_days`. Body fields override the configured policy; null
+    disables a rule, `archive` toggles archiving. Returns 202 with the job id.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        try:
+            policy = parse_policy(data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        if policy["keep_runs_per_robot"] is None and policy["telemetry_days"] is None:
+            return jsonify({"error": "No retention rule configured"}), 400
+        return start_purge_job(RETENTION, policy)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/maintenance/jobs/<job_id>", methods=["GET"])
+def get_purge_job(job_id):
+    """
+    GET /maintenance/jobs/<job_id>
+    Progress of a clear or retention job.
+    """
+    try:
+        job = purge_jobs_collection.find_one({"_id": ObjectId(job_id)})
+        if not job:
+            return jsonify({"error": "Job not found"}), 404
+        return jsonify(purge_job_status(job))
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
 @app.route("/runs/<run_id>", methods=["GET"])
 def get_run_detail(run_id):
+    """GET /runs/<run_id>?points= - run with its analysis; points caps each chart series."""
     try:
-        run = runs_collection.find_one({"_id": ObjectId(run_id)})
+        points = get_points_param()
+    except ValueError as e:
+        return jsonify({"error": f"Invalid query parameter: {e}"}), 400
+
+    def build(object_id):
+        run = runs_collection.find_one({"_id": object_id})
         if not run:
-            return jsonify({"error": "Run not found"}), 404
-        return jsonify(serialize_doc(run))
+            return {"error": "Run not found"}, 404
+        run["analysis_current"] = is_analysis_current(run)
+        for key in ("analysis", "precomputed_analysis"):
+            if run.get(key):
+                run[key] = downsample_analysis(run[key], points)
+        return serialize_doc(run), 200
+
+    try:
+        return cached_run_response("run", run_id, points or "", build)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+def critique_request(prompt):
+    """(payload, headers) of the OpenRouter request critiquing `prompt` (also timed by benchmarks.py)."""
+    headers = {
+        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+        "Content-Type": "application/json",
+        "HTTP-Referer": "https://utra-da.local",
+        "X-Title": "UTRA Data Analysis"
+    }
+    payload = {
+        "model": "google/gemini-2.0-flash-001",
+        "messages": [
+            {"role": "system", "content": "You are an expert robotics competition coach."},
+            {"role": "user", "content": prompt}
+        ],
+        "max_tokens": 1000
+    }
+    return payload, headers
+
+
+def request_critique(prompt):
+    """Ask the LLM to critique a run. Returns the critique fields of the analysis."""
+    if not OPENROUTER_API_KEY:
+        return {
+            "summary": "OPENROUTER_API_KEY not configured. This is a mock analysis.",
+            "recommendations": ["Configure OPENROUTER_API_KEY in .env for real AI analysis."],
+            "score": 0,
+            "mock": True,
+        }
+
+    payload, headers = critique_request(prompt)
+    response = http_client.session.post(OPENROUTER_URL, json=payload, headers=headers)
+    response.raise_for_status()
+
+    ai_response = response.json()
+    raw_content = ai_response["choices"][0]["message"]["content"]
+
+    return {
+        "summary": raw_content,
+        "raw_response": raw_content,
+        "score": parse_score(raw_content),
+        "model_used": ai_response.get("model", "unknown"),
+        "usage": ai_response.get("usage", {}),
+    }
+
+
+def save_analysis(run_id, analysis):
+    run_summaries.ensure_indexes()
+    runs_collection.update_one(
+        {"_id": ObjectId(run_id)},
+        {"$set": {
+            "analyzed": True,
+            "analysis": analysis,
+            "analyzed_at": datetime.utcnow(),
+            "analysis_version": analysis["analysis_version"],
+            "analysis_params_hash": analysis["params_hash"],
+            "analysis_mock": analysis.get("mock", False),
+            **run_summary(analysis)
+        }, "$inc": {"cache_version": 1}}
+    )
+    response_cache.invalidate(run_id)
+
+
 @app.route("/analyze", methods=["POST"])
 def analyze_run():
     """
     POST /analyze
-    Send run data to OpenRouter and return AI critique.
+    Send run data to OpenRouter and return AI critique. A stored run whose
+    analysis is already current is returned as-is unless `force` is set.
+    With `stages` (e.g. ["sections", "stuck"]) only those analysis stages are
+    computed and returned, without a critique and without storing anything.
+    ?points= caps each chart series in the response (the full analysis is stored).
     """
+    try:
+        points = get_points_param()
+    except ValueError as e:
+        return jsonify({"error": f"Invalid query parameter: {e}"}), 400
+
     try:
         data = request.get_json()
         if not data:
@@ -294,350 +608,283 @@ def analyze_run():
             run = runs_collection.find_one({"_id": ObjectId(data["run_id"])})
             if not run:
                 return jsonify({"error": "Run not found"}), 404
+            if is_analysis_current(run) and not data.get("force") and not data.get("stages"):
+                return jsonify({"success": True, "analysis": downsample_analysis(run["analysis"], points), "cached": True})
             logs = run.get("logs", [])
             metadata = run.get("metadata", {})
             run_id = data["run_id"]
+            precomputed = None if data.get("force") else precomputed_base(run)
         else:
             logs = data.get("logs", [])
             metadata = data.get("metadata", {})
             run_id = None
+            precomputed = None
 
         if not logs:
             return jsonify({"error": "No logs to analyze"}), 400
 
-        # Detect data format
-        is_sensor_format = "section_id" in logs[0] if logs else False
-
-        timeline = []
-        issues = []
-        section_times = {}
-        section_sequence = []
-
-        if is_sensor_format:
-            # Analyze sensor format data
-            prev_section = None
-            prev_claw = None
-            checkpoint_hits = 0
-            checkpoint_misses = 0
-            ultrasonic_readings = []
-
-            # New: Calculate velocity and acceleration data
-            velocities = []
-            accelerations = []
-            speed_over_time = []  # For charting
-
-            # New: Stuck detection
-            stuck_events = []
-            stuck_threshold_ms = 500  # Consider stuck if no movement for 500ms
-            position_threshold = 3  # Consider stuck if moved less than 3 units
-
-            # New: Heatmap data (grid-based position frequency)
-            heatmap_grid_size = 50  # Grid cell size in units
-            heatmap_data = {}  # {(grid_x, grid_y): count}
-
-            prev_x, prev_y, prev_time = None, None, None
-
-            for i, log in enumerate(logs):
-                timestamp_ms = log.get("timestamp_ms", 0)
-                section_id = log.get("section_id", 0)
-                section_name = log.get("section_name", "Unknown")
-                checkpoint = log.get("checkpoint_success", 0)
-                ultrasonic = log.get("ultrasonic_distance", 0)
-                claw = log.get("claw_status", 0)
-                x = log.get("x", 0)
-                y = log.get("y", 0)
-
-                ultrasonic_readings.append(ultrasonic)
-
-                # Heatmap: Add position to grid
-                grid_x = int(x // heatmap_grid_size)
-                grid_y = int(y // heatmap_grid_size)
-                grid_key = f"{grid_x},{grid_y}"
-                heatmap_data[grid_key] = heatmap_data.get(grid_key, 0) + 1
-
-                # Velocity and acceleration calculation
-                if prev_x is not None and prev_time is not None:
-                    dt = (timestamp_ms - prev_time) / 1000.0  # Convert to seconds
-                    if dt > 0:
-                        dx = x - prev_x
-                        dy = y - prev_y
-                        distance = (dx**2 + dy**2)**0.5
-                        velocity = distance / dt  # units per second
-
-                        velocities.append(velocity)
-                        speed_over_time.append({
-                            "time_ms": timestamp_ms,
-                            "speed": round(velocity, 2)
-                        })
-
-                        # Acceleration (change in velocity)
-                        if len(velocities) >= 2:
-                            prev_velocity = velocities[-2]
-                            accel = (velocity - prev_velocity) / dt
-                            accelerations.append({
-                                "time_ms": timestamp_ms,
-                                "acceleration": round(accel, 2),
-                                "x": x,
-                                "y": y
-                            })
-
-                        # Stuck detection: low velocity for extended period
-                        if velocity < 5:  # Very low speed threshold
-                            if stuck_events and stuck_events[-1].get("end_time") is None:
-                                # Continue existing stuck event
-                                stuck_events[-1]["duration_ms"] = timestamp_ms - stuck_events[-1]["start_time"]
-                            else:
-                                # Start new stuck event
-                                stuck_events.append({
-                                    "start_time": timestamp_ms,
-                                    "end_time": None,
-                                    "duration_ms": 0,
-                                    "x": x,
-                                    "y": y,
-                                    "section": section_name
-                                })
-                        else:
-                            # End stuck event if moving again
-                            if stuck_events and stuck_events[-1].get("end_time") is None:
-                                stuck_events[-1]["end_time"] = timestamp_ms
-
-                prev_x, prev_y, prev_time = x, y, timestamp_ms
-
-                # Track checkpoint hits/misses
-                if checkpoint == 1:
-                    checkpoint_hits += 1
-                else:
-                    checkpoint_misses += 1
-
-                # Detect section changes
-                if section_id != prev_section:
-                    if prev_section is not None:
-                        timeline.append({
-                            "time_ms": timestamp_ms,
-                            "event": f"Entered {section_name}"
-                        })
-                    section_sequence.append(section_name)
-                    prev_section = section_id
-
-                # Detect claw movements (picking up / dropping)
-                if prev_claw is not None:
-                    if prev_claw < 90 and claw >= 90:
-                        timeline.append({
-                            "time_ms": timestamp_ms,
-                            "event": "Claw closed (picking up)"
-                        })
-                    elif prev_claw >= 90 and claw < 90:
-                        timeline.append({
-                            "time_ms": timestamp_ms,
-                            "event": "Claw opened (dropping)"
-                        })
-                prev_claw = claw
-
-                # Detect obstacles (ultrasonic < 15cm)
-                if ultrasonic < 15 and (i == 0 or logs[i-1].get("ultrasonic_distance", 50) >= 15):
-                    timeline.append({
-                        "time_ms": timestamp_ms,
-                        "event": f"Obstacle detected ({ultrasonic}cm)"
-                    })
-
-            # Add start and end milestones
-            if logs:
-                timeline.insert(0, {"time_ms": 0, "event": "Run started"})
-                timeline.append({"time_ms": logs[-1].get("timestamp_ms", 0), "event": "Run completed"})
-
-            # Sort timeline by time
-            timeline.sort(key=lambda x: x["time_ms"])
-
-            # Calculate section times
-            current_section = None
-            section_start = 0
-            for log in logs:
-                section_name = log.get("section_name", "Unknown")
-                timestamp_ms = log.get("timestamp_ms", 0)
-                if section_name != current_section:
-                    if current_section is not None:
-                        section_times[current_section] = section_times.get(current_section, 0) + (timestamp_ms - section_start)
-                    current_section = section_name
-                    section_start = timestamp_ms
-            # Add final section time
-            if current_section and logs:
-                section_times[current_section] = section_times.get(current_section, 0) + (logs[-1].get("timestamp_ms", 0) - section_start)
-
-            # Calculate metrics
-            total_checkpoints = checkpoint_hits + checkpoint_misses
-            checkpoint_rate = (checkpoint_hits / total_checkpoints * 100) if total_checkpoints > 0 else 0
-            ultrasonic_avg = sum(ultrasonic_readings) / len(ultrasonic_readings) if ultrasonic_readings else 0
-
-            # Detect issues
-            for section, time_ms in section_times.items():
-                if time_ms > 120000:  # More than 2 minutes in one section
-                    issues.append(f"Long time in {section}: {time_ms/1000:.1f}s")
-
-            if checkpoint_rate < 60:
-                issues.append(f"Low checkpoint success rate: {checkpoint_rate:.1f}%")
+        if data.get("stages"):
+            try:
+                partial = compute_base_analysis(logs, data["stages"])
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            return jsonify({"success": True, "analysis": downsample_analysis(partial, points), "partial": True})
 
-        else:
-            # Original event-based format analysis
-            zone_sequence = [log["zone_name"] for log in logs if log.get("event_name") == "ZoneChange"]
-            event_summary = {}
-            for log in logs:
-                event_name = log.get("event_name", "Unknown")
-                event_summary[event_name] = event_summary.get(event_name, 0) + 1
-
-            for i, log in enumerate(logs):
-                if log.get("event_name") == "ZoneChange":
-                    zone = log["zone_name"]
-                    start_time = log["timestamp_ms"]
-                    end_time = logs[i + 1]["timestamp_ms"] if i + 1 < len(logs) else start_time
-                    section_times[zone] = section_times.get(zone, 0) + (end_time - start_time)
-
-            for zone, time_ms in section_times.items():
-                if time_ms > 10000:
-                    issues.append(f"Stuck in {zone}: {time_ms/1000:.1f}s")
-
-            oscillations = 0
-            for i in range(2, len(zone_sequence)):
-                if zone_sequence[i] == zone_sequence[i - 2] and zone_sequence[i] != zone_sequence[i - 1]:
-                    oscillations += 1
-            if oscillations > 2:
-                issues.append(f"Oscillation detected: {oscillations} times")
-
-            section_sequence = zone_sequence
-            checkpoint_rate = None
-            ultrasonic_avg = None
-
-        prompt = f"""You are an expert robotics coach analyzing a competition run.
-Analyze this robot's performance and provide actionable feedback.
-
-Run Summary:
-- Total Events: {len(logs)}
-- Section Sequence: {' -> '.join(section_sequence) if section_sequence else 'No section changes recorded'}
-- Time in Sections (ms): {section_times}
-- Detected Issues: {issues if issues else 'None detected'}
-
-Full Event Log (first 50):
-{logs[:50]}
-
-Please provide:
-1. A brief performance summary
-2. Identified issues (e.g., oscillation, stuck behavior, inefficient pathing)
-3. Specific recommendations with actionable fixes
-4. An overall score out of 10
-"""
-
-        # Build base analysis with timeline and metrics
-        base_analysis = {
-            "timeline": timeline,
-            "section_sequence": section_sequence,
-            "section_times": section_times,
-            "issues": issues,
-        }
+        base_analysis, prompt = prepare_analysis(logs, precomputed)
+        analysis = {**base_analysis, **request_critique(prompt)}
 
-        # Add sensor-specific metrics if available
-        if is_sensor_format:
-            base_analysis["checkpoint_rate"] = checkpoint_rate
-            base_analysis["ultrasonic_avg"] = ultrasonic_avg
-
-            # Add velocity/acceleration data (sample every 10th point to reduce size)
-            base_analysis["speed_over_time"] = speed_over_time[::10] if len(speed_over_time) > 100 else speed_over_time
-            base_analysis["acceleration_data"] = accelerations[::10] if len(accelerations) > 100 else accelerations
-
-            # Calculate acceleration stats
-            if accelerations:
-                accel_values = [a["acceleration"] for a in accelerations]
-                base_analysis["acceleration_stats"] = {
-                    "max": round(max(accel_values), 2),
-                    "min": round(min(accel_values), 2),
-                    "avg": round(sum(accel_values) / len(accel_values), 2),
-                    "jerky_count": sum(1 for a in accel_values if abs(a) > 100)  # Count sudden changes
-                }
-
-            # Filter stuck events (only those lasting > 300ms are significant)
-            significant_stuck = [s for s in stuck_events if s.get("duration_ms", 0) > 300]
-            base_analysis["stuck_events"] = significant_stuck
-            base_analysis["stuck_frequency"] = {
-                "total_stuck_events": len(significant_stuck),
-                "total_stuck_time_ms": sum(s.get("duration_ms", 0) for s in significant_stuck),
-                "stuck_locations": [{"x": s["x"], "y": s["y"], "section": s["section"], "duration_ms": s["duration_ms"]} for s in significant_stuck]
-            }
+        if run_id:
+            save_analysis(run_id, analysis)
 
-            # Convert heatmap to list format for frontend
-            heatmap_list = []
-            for key, count in heatmap_data.items():
-                gx, gy = map(int, key.split(","))
-                heatmap_list.append({
-                    "grid_x": gx,
-                    "grid_y": gy,
-                    "x": gx * heatmap_grid_size + heatmap_grid_size // 2,
-                    "y": gy * heatmap_grid_size + heatmap_grid_size // 2,
-                    "count": count
-                })
-            base_analysis["heatmap_data"] = sorted(heatmap_list, key=lambda h: h["count"], reverse=True)
-            base_analysis["heatmap_max_count"] = max(h["count"] for h in heatmap_list) if heatmap_list else 1
-
-        if not OPENROUTER_API_KEY:
-            analysis = {
-                **base_analysis,
-                "summary": "OPENROUTER_API_KEY not configured. This is a mock analysis.",
-                "recommendations": ["Configure OPENROUTER_API_KEY in .env for real AI analysis."],
-                "score": 0,
-            }
-        else:
-            headers = {
-                "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-                "Content-Type": "application/json",
-                "HTTP-Referer": "https://utra-da.local",
-                "X-Title": "UTRA Data Analysis"
-            }
-            payload = {
-                "model": "google/gemini-2.0-flash-001",
-                "messages": [
-                    {"role": "system", "content": "You are an expert robotics competition coach."},
-                    {"role": "user", "content": prompt}
-                ],
-                "max_tokens": 1000
-            }
+        return jsonify({"success": True, "analysis": downsample_analysis(analysis, points)})
 
-            response = requests.post(OPENROUTER_URL, json=payload, headers=headers)
-            response.raise_for_status()
+    except requests.RequestException as e:
+        return jsonify({"error": f"OpenRouter API error: {str(e)}"}), 502
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-            ai_response = response.json()
-            raw_content = ai_response["choices"][0]["message"]["content"]
 
-            analysis = {
-                **base_analysis,
-                "summary": raw_content,
-                "raw_response": raw_content,
-                "model_used": ai_response.get("model", "unknown"),
-                "usage": ai_response.get("usage", {}),
-            }
+def run_analysis_job(job_id, workers, owner):
+    try:
+        run_job(job_id, runs_collection, analysis_jobs_collection, request_critique, save_analysis,
+                workers, DEFAULT_LLM_WORKERS, DEFAULT_LLM_RATE, owner=owner)
+    except Exception as e:
+        print(f"Analysis job {job_id} failed: {e}")
 
-        if run_id:
-            runs_collection.update_one(
-                {"_id": ObjectId(run_id)},
-                {"$set": {"analyzed": True, "analysis": analysis, "analyzed_at": datetime.utcnow()}}
-            )
 
-        return jsonify({"success": True, "analysis": analysis})
+@app.route("/analyze/batch", methods=["POST"])
+def analyze_batch():
+    """
+    POST /analyze/batch
+    Start a background job that analyzes every run without a current
+    analysis (and, with `since`, every run analyzed before that ISO date).
+    Pass `job_id` to resume an interrupted job instead (409 while another
+    worker holds its lease). Returns 202 with the job id.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        workers = data.get("workers")
 
-    except requests.RequestException as e:
-        return jsonify({"error": f"OpenRouter API error: {str(e)}"}), 502
+        if data.get("job_id"):
+            job_id = ObjectId(data["job_id"])
+            if not analysis_jobs_collection.find_one({"_id": job_id}, {"_id": 1}):
+                return jsonify({"error": "Job not found"}), 404
+        else:
+            try:
+                since = datetime.fromisoformat(data["since"]) if data.get("since") else None
+            except ValueError:
+                return jsonify({"error": "since must be an ISO date"}), 400
+            run_ids = find_stale_runs(runs_collection, since)
+            if not run_ids:
+                return jsonify({"success": True, "job_id": None, "total": 0})
+            job_id = create_job(analysis_jobs_collection, run_ids, {"since": since})
+
+        owner = new_owner()
+        job = claim_job(analysis_jobs_collection, job_id, owner)
+        if job is None:
+            return jsonify({"error": "Job is already running"}), 409
+        threading.Thread(target=run_analysis_job, args=(job_id, workers, owner), daemon=True).start()
+        return jsonify({"success": True, "job_id": str(job_id), "total": len(job["run_ids"])}), 202
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/analyze/batch/<job_id>", methods=["GET"])
+def get_analysis_job(job_id):
+    """
+    GET /analyze/batch/<job_id>
+    Progress of a batch analysis job with per-run results.
+    """
+    try:
+        job = analysis_jobs_collection.find_one({"_id": ObjectId(job_id)})
+        if not job:
+            return jsonify({"error": "Job not found"}), 404
+        return jsonify(job_status(job))
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+# Attempts at a versioned read-modify-write of live state before giving up on a reading
+LIVE_STATE_RETRIES = 5
+
+
+def detect_live_stuck(robot_id, sensors, received_at):
+    """
+    Feed a telemetry reading to the robot's stuck detector and store stuck
+    episodes as live events as soon as they start and end. Readings without
+    a position (sensors.x / sensors.y) are skipped. Returns True while stuck.
+
+    The detector's state lives in `live_stuck_state`, one document per robot,
+    and is written back only if its version is unchanged, so every worker
+    continues from the same state and readings are never applied twice.
+    """
+    x = sensors.get("x")
+    y = sensors.get("y")
+    if x is None or y is None:
+        return False
+    # Prefer the robot's own clock; fall back to arrival time
+    timestamp_ms = sensors.get("timestamp", int(received_at.timestamp() * 1000))
+    _, section = reading_section(sensors)  # Named as in the run's logs
+
+    for _ in range(LIVE_STATE_RETRIES):
+        doc = live_stuck_collection.find_one({"_id": robot_id}) or {"version": 0}
+        detector = StuckDetector.from_state(doc.get("state"))
+        transition = detector.update(timestamp_ms, x, y, section)
+        try:
+            result = live_stuck_collection.update_one(
+                {"_id": robot_id, "version": doc["version"]},
+                {"$set": {"state": detector.live_state(), "updated_at": received_at}, "$inc": {"version": 1}},
+                upsert=doc["version"] == 0
+            )
+        except DuplicateKeyError:
+            continue  # Another worker stored the robot's first reading
+        if result.matched_count or result.upserted_id is not None:
+            break
+    else:
+        print(f"Live stuck detection skipped a reading of {robot_id}: state kept changing")
+        return False
+
+    if transition is not None:
+        kind, episode = transition
+        if kind == STUCK_STARTED:
+            live_events_collection.insert_one({
+                "robot_id": robot_id,
+                "event_type": "stuck",
+                "message": "Robot got stuck",
+                **episode,
+                "detected_at": received_at
+            })
+        elif kind == STUCK_ENDED:
+            live_events_collection.update_one(
+                {"robot_id": robot_id, "event_type": "stuck", "start_time": episode["start_time"], "end_time": None},
+                {"$set": {"end_time": episode["end_time"], "duration_ms": episode["duration_ms"]}}
+            )
+    return detector.is_stuck
+
+
+live_run_index_ready = False
+
+
+def get_open_live_run(robot_id):
+    """The robot's open live run (without its logs), or None."""
+    global live_run_index_ready
+    if not live_run_index_ready:
+        runs_collection.create_index([("robot_id", 1), ("live", 1)])
+        live_run_index_ready = True
+    return runs_collection.find_one({"robot_id": robot_id, "live": True}, {"logs": 0})
+
+
+def close_live_run(robot_id, received_at):
+    """
+    Close the robot's open live run, if any, add it to the fleet heatmap,
+    spatial index and sensor sketches as ingest does, and return its id.
+    """
+    run = runs_collection.find_one_and_update(
+        {"robot_id": robot_id, "live": True},
+        {"$set": {"live": False, "completed_at": received_at}, "$inc": {"cache_version": 1}},
+        projection={"robot_id": 1, "created_at": 1, "logs.x": 1, "logs.y": 1, "logs.section_id": 1,
+                    "logs.timestamp_ms": 1, "logs.ultrasonic_distance": 1}
+    )
+    if run is None:
+        return None
+    response_cache.invalidate(run["_id"])
+    # Readings can no longer be appended once live is False, so these are the run's final logs
+    logs = run.get("logs", [])
+    fleet_heatmap.add_run(run)
+    spatial_index.add_run(run["_id"], run.get("robot_id", "unknown"), run.get("created_at"),
+                          spatial_index.tracker().add(logs).finish())
+    sensor_sketches.add_stored_run(run)
+    return run["_id"]
+
+
+def track_live_run(robot_id, data, sensors, received_at):
+    """
+    Group telemetry into live runs. A reading with "marker": "start" opens a
+    new run for the robot (closing any open one), "stop" closes it, and every
+    reading in between is appended to the run with its live_analysis updated
+    incrementally. Returns the run_id the reading belongs to, if any.
+
+    The open run is looked up in MongoDB for every reading and written back
+    only if its live_version is unchanged (retrying otherwise), so readings
+    handled by different workers are neither lost nor applied twice.
+    """
+    marker = data.get("marker")
+    if marker == "start":
+        close_live_run(robot_id, received_at)
+        runs_collection.insert_one({
+            "robot_id": robot_id,
+            "run_number": data.get("run_number", 0),
+            "logs": [],
+            "events": [],
+            "segments": [],
+            "metadata": data.get("metadata", {}),
+            "data_format": "sensor",
+            "live": True,
+            "live_analysis": LiveRunStats().state,
+            "live_version": 0,
+            "created_at": received_at,
+            "analyzed": False,
+            "analysis": None
+        })
+
+    for _ in range(LIVE_STATE_RETRIES):
+        run = get_open_live_run(robot_id)
+        if run is None:
+            return None
+        run_id = run["_id"]
+        if not sensors:
+            break
+        # Prefer the robot's own clock; fall back to time since the run started
+        elapsed_ms = int((received_at - run["created_at"]).total_seconds() * 1000)
+        log = reading_to_log(sensors, sensors.get("timestamp", elapsed_ms))
+        stats = LiveRunStats(run.get("live_analysis"))
+        result = runs_collection.update_one(
+            {"_id": run_id, "live": True, "live_version": run.get("live_version")},
+            {
+                "$push": {"logs": log},
+                "$set": {"live_analysis": stats.add(log)},
+                "$inc": {"cache_version": 1, "live_version": 1}
+            }
+        )
+        if result.matched_count:
+            response_cache.invalidate(run_id)
+            break
+    else:
+        print(f"Live run {run_id} kept changing; dropped a reading of {robot_id}")
+
+    if marker == "stop":
+        close_live_run(robot_id, received_at)
+    return run_id
+
+
 @app.route("/telemetry", methods=["POST"])
 def ingest_telemetry():
-    """POST /telemetry - ingest live telemetry."""
+    """POST /telemetry - ingest live telemetry (optionally gzip/zstd compressed)."""
+    try:
+        data = get_json_body(request) or {}
+        if not isinstance(data, dict):
+            raise ValueError("Telemetry must be a JSON object")
+    except (ValueError, PayloadTooLarge, UnsupportedEncoding) as e:
+        return jsonify({"error": str(e)}), body_error_status(e)
+
     try:
-        data = request.get_json() or {}
+        robot_id = data.get("robot_id", "unknown")
+        sensors = data.get("sensors", {})
+        received_at = datetime.utcnow()
+        run_id = track_live_run(robot_id, data, sensors, received_at)
         telemetry_doc = {
-            "robot_id": data.get("robot_id", "unknown"),
-            "sensors": data.get("sensors", {}),
-            "timestamp": datetime.utcnow()
+            "robot_id": robot_id,
+            "sensors": sensors,
+            "run_id": run_id,
+            "timestamp": received_at
         }
         telemetry_collection.insert_one(telemetry_doc)
-        return jsonify({"success": True}), 201
+        stuck = detect_live_stuck(robot_id, sensors, received_at)
+        return jsonify({
+            "success": True,
+            "run_id": str(run_id) if run_id else None,
+            "stuck": stuck
+        }), 201
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -653,6 +900,8 @@ def get_latest_telemetry():
         if telemetry:
             telemetry["_id"] = str(telemetry["_id"])
             telemetry["timestamp"] = telemetry["timestamp"].isoformat()
+            if telemetry.get("run_id"):
+                telemetry["run_id"] = str(telemetry["run_id"])
             return jsonify(telemetry)
         return jsonify({"message": "No telemetry data found"}), 404
 
@@ -660,6 +909,25 @@ def get_latest_telemetry():
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/telemetry/events", methods=["GET"])
+def get_live_events():
+    """GET /telemetry/events - events detected live from telemetry (e.g. stuck episodes)."""
+    try:
+        robot_id = request.args.get("robot_id")
+        limit = int(request.args.get("limit", 50))
+        query = {"robot_id": robot_id} if robot_id else {}
+
+        events = []
+        for event in live_events_collection.find(query).sort("detected_at", -1).limit(limit):
+            event["_id"] = str(event["_id"])
+            event["detected_at"] = event["detected_at"].isoformat()
+            events.append(event)
+        return jsonify({"events": events})
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
 def get_default_segments():
     """Returns the default path segments for animation."""
     return [
@@ -698,6 +966,138 @@ def get_path():
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/api/heatmap", methods=["GET"])
+def get_fleet_heatmap():
+    """
+    GET /api/heatmap?zoom=&bbox=min_x,min_y,max_x,max_y&robot_id=&from=&to=
+    Fleet-wide position heatmap across all runs. Only cells inside bbox are
+    returned; from/to are ISO dates (inclusive).
+    """
+    try:
+        zoom = int(request.args.get("zoom", DEFAULT_ZOOM))
+        if zoom not in ZOOM_CELL_SIZES:
+            return jsonify({"error": f"zoom must be one of {sorted(ZOOM_CELL_SIZES)}"}), 400
+
+        bbox = None
+        if request.args.get("bbox"):
+            bbox = [float(v) for v in request.args["bbox"].split(",")]
+            if len(bbox) != 4:
+                return jsonify({"error": "bbox must be min_x,min_y,max_x,max_y"}), 400
+
+        date_from = datetime.fromisoformat(request.args["from"]) if request.args.get("from") else None
+        date_to = datetime.fromisoformat(request.args["to"]) if request.args.get("to") else None
+    except ValueError as e:
+        return jsonify({"error": f"Invalid query parameter: {e}"}), 400
+
+    try:
+        cells = fleet_heatmap.query(zoom, bbox, request.args.get("robot_id"), date_from, date_to)
+        return jsonify({
+            "zoom": zoom,
+            "cell_size": ZOOM_CELL_SIZES[zoom],
+            "heatmap_data": cells,
+            "heatmap_max_count": cells[0]["count"] if cells else 1
+        })
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/api/distributions", methods=["GET"])
+def get_distributions():
+    """
+    GET /api/distributions?metric=&robot_id=&section_id=&from=&to=&group_by=robot|section&q=0.05,0.5,0.95
+    Fleet-wide quantiles of ultrasonic_distance, speed or section_duration_ms,
+    merged from the per robot/section/day sketches updated at ingest.
+    """
+    try:
+        metric = request.args.get("metric", "")
+        if metric not in METRICS:
+            return jsonify({"error": f"metric must be one of {', '.join(METRICS)}"}), 400
+        group_by = request.args.get("group_by") or None
+        if group_by is not None and group_by not in GROUP_BY:
+            return jsonify({"error": f"group_by must be one of {', '.join(GROUP_BY)}"}), 400
+
+        section_id = int(request.args["section_id"]) if request.args.get("section_id") else None
+        quantiles = [float(q) for q in request.args.get("q", "0.05,0.5,0.95").split(",")]
+        if not all(0 <= q <= 1 for q in quantiles):
+            return jsonify({"error": "q values must be between 0 and 1"}), 400
+        date_from = datetime.fromisoformat(request.args["from"]) if request.args.get("from") else None
+        date_to = datetime.fromisoformat(request.args["to"]) if request.args.get("to") else None
+    except ValueError as e:
+        return jsonify({"error": f"Invalid query parameter: {e}"}), 400
+
+    try:
+        groups = sensor_sketches.query(metric, request.args.get("robot_id"), section_id, date_from, date_to,
+                                       group_by, quantiles)
+        return jsonify({
+            "metric": metric,
+            "relative_accuracy": SKETCH_RELATIVE_ACCURACY,
+            "group_by": group_by,
+            "groups": groups
+        })
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/api/distributions/rebuild", methods=["POST"])
+def rebuild_distributions():
+    """POST /api/distributions/rebuild - recompute the sensor sketches from all stored runs."""
+    try:
+        return jsonify({"success": True, "runs": sensor_sketches.rebuild(runs_collection)})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/search/region", methods=["GET"])
+def search_region():
+    """
+    GET /search/region?bbox=min_x,min_y,max_x,max_y&from=&to=&robot_id=&min_duration_ms=
+    Runs that passed through a region of the course and the time windows
+    they spent there. from/to are ISO dates filtering on run creation time;
+    min_duration_ms keeps only long visits (e.g. to find robots stuck there).
+    """
+    try:
+        if not request.args.get("bbox"):
+            return jsonify({"error": "bbox is required"}), 400
+        bbox = [float(v) for v in request.args["bbox"].split(",")]
+        if len(bbox) != 4:
+            return jsonify({"error": "bbox must be min_x,min_y,max_x,max_y"}), 400
+
+        date_from = datetime.fromisoformat(request.args["from"]) if request.args.get("from") else None
+        date_to = datetime.fromisoformat(request.args["to"]) if request.args.get("to") else None
+        min_duration_ms = int(request.args.get("min_duration_ms", 0))
+    except ValueError as e:
+        return jsonify({"error": f"Invalid query parameter: {e}"}), 400
+
+    try:
+        runs = spatial_index.query(bbox, date_from, date_to, request.args.get("robot_id"), min_duration_ms)
+        return jsonify({
+            "bbox": bbox,
+            "cell_size": spatial_index.cell_size,
+            "runs": runs,
+            "total": len(runs)
+        })
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/search/region/rebuild", methods=["POST"])
+def rebuild_spatial_index():
+    """POST /search/region/rebuild - re-index positions of all stored runs."""
+    try:
+        return jsonify({"success": True, "runs": spatial_index.rebuild(runs_collection)})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/api/heatmap/rebuild", methods=["POST"])
+def rebuild_fleet_heatmap():
+    """POST /api/heatmap/rebuild - recompute the fleet heatmap from all stored runs."""
+    try:
+        return jsonify({"success": True, "runs": fleet_heatmap.rebuild(runs_collection)})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
 ACTION_EMOJIS = {
     "pickup_box": "📦",
     "drop_box": "📦",
@@ -772,10 +1172,10 @@ def generate_segments_from_run(run):
 @app.route("/api/path/<run_id>", methods=["GET"])
 def get_path_for_run(run_id):
     """GET /api/path/<run_id> - returns path segments for a specific run."""
-    try:
-        run = runs_collection.find_one({"_id": ObjectId(run_id)})
+    def build(object_id):
+        run = runs_collection.find_one({"_id": object_id})
         if not run:
-            return jsonify({"error": "Run not found"}), 404
+            return {"error": "Run not found"}, 404
 
         # Check if run has segment data
         if run.get("segments") or run.get("data_format") == "path":
@@ -783,16 +1183,122 @@ def get_path_for_run(run_id):
             if segments:
                 # Also return events for timeline display
                 events = run.get("events", [])
-                return jsonify({
+                return {
                     "segments": segments,
                     "events": events,
                     "metadata": run.get("metadata", {}),
                     "duration_ms": run.get("metadata", {}).get("duration_ms", 0)
-                })
+                }, 200
 
         # Fallback to default segments
         segments = get_default_segments()
-        return jsonify({"segments": segments})
+        return {"segments": segments}, 200
+
+    try:
+        return cached_run_response("path", run_id, "", build)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/api/playback/<run_id>", methods=["GET"])
+def get_playback(run_id):
+    """
+    GET /api/playback/<run_id>?t=ms | ?from=ms&to=ms
+    Trajectory of a run in time chunks of chunk_ms (see playback.py). Without
+    parameters returns the keyframe index (one entry per chunk) to seek with;
+    with t returns the chunk containing t and its neighbours; with from/to
+    returns the chunks overlapping that window (at most MAX_CHUNKS_PER_REQUEST;
+    next_from is set when the window was cut short).
+    """
+    try:
+        t = float(request.args["t"]) if request.args.get("t") else None
+        window_from = float(request.args["from"]) if request.args.get("from") else None
+        window_to = float(request.args["to"]) if request.args.get("to") else None
+        if (window_from is None) != (window_to is None) or (window_to is not None and window_to < window_from):
+            raise ValueError("from and to must be given together, with from <= to")
+    except ValueError as e:
+        return jsonify({"error": f"Invalid query parameter: {e}"}), 400
+
+    try:
+        run = runs_collection.find_one({"_id": ObjectId(run_id)}, {"live": 1, "completed_at": 1})
+        if not run:
+            return jsonify({"error": "Run not found"}), 404
+
+        live_chunks = None
+        if run.get("live") and not run.get("completed_at"):
+            # Open live run: still growing, so chunk it on the fly instead of storing
+            logs = runs_collection.find_one({"_id": run["_id"]}, {"logs": 1}).get("logs", [])
+            live_chunks = playback_store.builder().add(logs).finish()
+        else:
+            playback_store.ensure_run(run["_id"], runs_collection)
+
+        chunk_ms = playback_store.chunk_ms
+        result = {"run_id": run_id, "chunk_ms": chunk_ms}
+        if t is None and window_from is None:
+            if live_chunks is not None:
+                keyframes = [chunk_summary(c) for c in live_chunks]
+            else:
+                keyframes = playback_store.keyframes(run["_id"])
+            result["keyframes"] = keyframes
+            result["duration_ms"] = max((k["last_ms"] for k in keyframes), default=0)
+            return jsonify(result)
+
+        if t is not None:
+            first = int(t // chunk_ms) - PREFETCH_CHUNKS
+            last = int(t // chunk_ms) + PREFETCH_CHUNKS
+        else:
+            first = int(window_from // chunk_ms)
+            last = int(window_to // chunk_ms)
+            if last - first + 1 > MAX_CHUNKS_PER_REQUEST:
+                # Window capped: the client continues from next_from
+                last = first + MAX_CHUNKS_PER_REQUEST - 1
+                result["next_from"] = (last + 1) * chunk_ms
+
+        if live_chunks is not None:
+            result["chunks"] = [c for c in live_chunks if first <= c["index"] <= last]
+        else:
+            result["chunks"] = playback_store.chunks(run["_id"], first, last)
+        return jsonify(result)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/api/playback/rebuild", methods=["POST"])
+def rebuild_playback():
+    """POST /api/playback/rebuild - re-chunk the trajectories of all stored runs."""
+    try:
+        return jsonify({"success": True, "runs": playback_store.rebuild(runs_collection)})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/export/<table>", methods=["GET"])
+def export_table(table):
+    """
+    GET /export/<logs|events|segments|telemetry>?format=parquet|arrow&robot_id=&from=&to=
+    Stream a columnar export (see export.py). from/to are ISO dates (inclusive)
+    and filter runs by created_at and telemetry by timestamp.
+    """
+    try:
+        if table not in TABLES:
+            return jsonify({"error": f"table must be one of {', '.join(TABLES)}"}), 404
+        fmt = request.args.get("format", "parquet")
+        if fmt not in FORMATS:
+            return jsonify({"error": f"format must be one of {', '.join(sorted(FORMATS))}"}), 400
+        date_from = datetime.fromisoformat(request.args["from"]) if request.args.get("from") else None
+        date_to = datetime.fromisoformat(request.args["to"]) if request.args.get("to") else None
+    except ValueError as e:
+        return jsonify({"error": f"Invalid query parameter: {e}"}), 400
+
+    try:
+        rows = export_rows(table, runs_collection, telemetry_collection, request.args.get("robot_id"), date_from, date_to)
+        chunks = stream_export(table, rows, fmt)
+        extension = "parquet" if fmt == "parquet" else "arrows"
+        return Response(stream_with_context(chunks), mimetype=FORMATS[fmt], headers={
+            "Content-Disposition": f"attachment; filename={table}.{extension}"
+        })
+    except ExportUnavailable as e:
+        return jsonify({"error": str(e)}), 501
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -804,13 +1310,12 @@ def get_path_for_run(run_id):
 @app.route("/<path:path>")
 def serve_frontend(path):
     """
-    Serve the built React frontend (frontend/dist).
+    Serve the built React frontend (frontend/dist) from the static asset index.
     If dist does not exist, return a helpful message.
     """
-    if os.path.isdir(DIST_DIR):
-        if path != "" and os.path.exists(os.path.join(DIST_DIR, path)):
-            return send_from_directory(DIST_DIR, path)
-        return send_from_directory(DIST_DIR, "index.html")
+    response = static_assets.response(path, request)
+    if response is not None:
+        return response
 
     return jsonify({
         "message": "Frontend build not found. Run `npm run build` in frontend/ to create dist/.",
@@ -818,7 +1323,30 @@ def serve_frontend(path):
     }), 404
 
 
+def create_app(config=None):
+    """
+    Configure the app for this process and return it, e.g.
+    `gunicorn --preload "app:create_app()"`. Nothing connects here or at
+    import: MongoDB and OpenRouter clients are created on first use in each
+    worker, so workers forked from a preloaded master start without
+    inherited sockets. `config` may override MONGODB_URI and
+    OPENROUTER_API_KEY, plus any Flask setting.
+
+    Routes stay registered on the module-level `app`, which the CLI tools
+    import for its collections, so this configures that app rather than
+    building a second one.
+    """
+    global OPENROUTER_API_KEY
+    config = dict(config or {})
+    if "MONGODB_URI" in config:
+        mongo.configure(config.pop("MONGODB_URI"))
+    if "OPENROUTER_API_KEY" in config:
+        OPENROUTER_API_KEY = config.pop("OPENROUTER_API_KEY")
+    app.config.update(config)
+    return app
+
+
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 5001))
     debug = os.getenv("FLASK_ENV") == "development"
-    app.run(host="0.0.0.0", port=port, debug=debug)
+    create_app().run(host="0.0.0.0", port=port, debug=debug)
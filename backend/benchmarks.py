@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Offline benchmarks for the backend.
+Run from the backend/ directory; no server or database is needed.
+"""
+import gzip
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+import test_data
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def bench_compression():
+    """Bytes saved by compressing realistic /ingest uploads, as the bridge does."""
+    random.seed(42)
+    print(f"{'Payload':28} {'Raw':>10} {'gzip':>10} {'zstd':>10} {'Saved':>7}")
+    print("-" * 70)
+
+    total_raw = total_best = 0
+    for profile in ["excellent", "good", "poor"]:
+        run = test_data.generate_realistic_run("Alpha", 1, profile)
+        body = json.dumps(run, separators=(",", ":")).encode("utf-8")
+
+        start = time.perf_counter()
+        gz = gzip.compress(body, compresslevel=6)
+        gz_ms = (time.perf_counter() - start) * 1000
+
+        zs = None
+        zs_ms = 0.0
+        if zstandard is not None:
+            start = time.perf_counter()
+            zs = zstandard.ZstdCompressor(level=3).compress(body)
+            zs_ms = (time.perf_counter() - start) * 1000
+
+        best = min(len(gz), len(zs)) if zs is not None else len(gz)
+        total_raw += len(body)
+        total_best += best
+        label = f"{profile} ({len(run['logs'])} logs)"
+        zs_size = f"{len(zs):,}" if zs is not None else "n/a"
+        print(f"{label:28} {len(body):>10,} {len(gz):>10,} {zs_size:>10} {1 - best / len(body):>6.1%}")
+        print(f"{'  compress time (ms)':28} {'':>10} {gz_ms:>10.1f} {zs_ms:>10.1f}")
+
+    print("-" * 70)
+    print(f"Total: {total_raw:,} -> {total_best:,} bytes ({1 - total_best / total_raw:.1%} saved)")
+
+
+def legacy_prompt(logs, analysis):
+    """The critique prompt as it was built before prompt.py (for comparison)."""
+    section_sequence = analysis["section_sequence"]
+    issues = analysis["issues"]
+    return f"""You are an expert robotics coach analyzing a competition run.
+Analyze this robot's performance and provide actionable feedback.
+
+Run Summary:
+- Total Events: {len(logs)}
+- Section Sequence: {' -> '.join(section_sequence) if section_sequence else 'No section changes recorded'}
+- Time in Sections (ms): {analysis["section_times"]}
+- Detected Issues: {issues if issues else 'None detected'}
+
+Full Event Log (first 50):
+{logs[:50]}
+
+Please provide:
+1. A brief performance summary
+2. Identified issues (e.g., oscillation, stuck behavior, inefficient pathing)
+3. Specific recommendations with actionable fixes
+4. An overall score out of 10
+"""
+
+
+def time_critique(prompt):
+    """Send a prompt to OpenRouter the way /analyze does and return latency in ms."""
+    import requests
+    import app
+
+    payload, headers = app.critique_request(prompt)
+    start = time.perf_counter()
+    response = requests.post(app.OPENROUTER_URL, headers=headers, json=payload)
+    response.raise_for_status()
+    return (time.perf_counter() - start) * 1000
+
+
+def bench_prompt():
+    """Critique prompt size before/after the compact builder (add --live to time real LLM calls)."""
+    import app
+    from decoders import get_decoder
+    from prompt import build_critique_prompt, estimate_tokens
+
+    live = "--live" in sys.argv and app.OPENROUTER_API_KEY
+    api_key, app.OPENROUTER_API_KEY = app.OPENROUTER_API_KEY, None
+    client = app.app.test_client()
+
+    random.seed(42)
+    print(f"{'Run':12} {'Old chars':>10} {'Old tok':>8} {'New chars':>10} {'New tok':>8} {'Build ms':>9}")
+    print("-" * 62)
+    prompts = []
+    for profile in ["excellent", "good", "poor"]:
+        run = test_data.generate_realistic_run("Alpha", 1, profile)
+        logs, _ = get_decoder("path").decode_batch(run["logs"])
+        analysis = client.post("/analyze", json={"logs": logs}).get_json()["analysis"]
+
+        old = legacy_prompt(logs, analysis)
+        start = time.perf_counter()
+        new, new_tokens = build_critique_prompt(logs, analysis)
+        build_ms = (time.perf_counter() - start) * 1000
+        assert new == build_critique_prompt(logs, analysis)[0], "prompt is not deterministic"
+
+        prompts.append((profile, old, new))
+        print(f"{profile:12} {len(old):>10,} {estimate_tokens(old):>8,} {len(new):>10,} {new_tokens:>8,} {build_ms:>9.2f}")
+
+    app.OPENROUTER_API_KEY = api_key
+    if not live:
+        print("\nRun with --live (and OPENROUTER_API_KEY set) to compare critique latency.")
+        return
+    print(f"\n{'Run':12} {'Old ms':>10} {'New ms':>10}")
+    for profile, old, new in prompts:
+        print(f"{profile:12} {time_critique(old):>10.0f} {time_critique(new):>10.0f}")
+
+
+STARTUP_SAMPLES = 5
+# A forked worker should be serving within this
+WORKER_START_BUDGET_MS = 50
+
+
+def forked_worker_ms(app):
+    """Fork like a preloading Gunicorn master; the child times its first request and client setup."""
+    read_end, write_end = os.pipe()
+    forked_at = time.perf_counter()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_end)
+        status = app.app.test_client().get("/health").status_code
+        first_request = time.perf_counter()
+        app.mongo.get_collection("runs")  # Builds this process's (not yet connected) client
+        app.http_client.session
+        clients = time.perf_counter()
+        os.write(write_end, json.dumps({
+            "status": status,
+            "first_request_ms": (first_request - forked_at) * 1000,
+            "clients_ms": (clients - first_request) * 1000,
+        }).encode())
+        os._exit(0)
+    os.close(write_end)
+    with os.fdopen(read_end) as f:
+        result = json.loads(f.read())
+    os.waitpid(pid, 0)
+    return result
+
+
+def bench_startup():
+    """Worker cold start: app import, create_app(), and a preloaded worker's first request after fork."""
+    code = "import time; t = time.perf_counter(); import app; print((time.perf_counter() - t) * 1000)"
+    imports = []
+    for _ in range(STARTUP_SAMPLES):
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+        imports.append(float(output.strip().splitlines()[-1]))
+
+    import app
+    start = time.perf_counter()
+    app.create_app()
+    factory_ms = (time.perf_counter() - start) * 1000
+    # The master may have used its clients before forking; workers must not inherit them
+    app.mongo.get_collection("runs")
+    app.http_client.session
+
+    workers = [forked_worker_ms(app) for _ in range(STARTUP_SAMPLES)]
+    first_request = statistics.median(w["first_request_ms"] for w in workers)
+    clients = statistics.median(w["clients_ms"] for w in workers)
+
+    print(f"{'Step':40} {'Median ms':>10} {'Max ms':>8}")
+    print("-" * 60)
+    print(f"{'import app (fresh interpreter)':40} {statistics.median(imports):>10.1f} {max(imports):>8.1f}")
+    print(f"{'create_app()':40} {factory_ms:>10.2f} {'':>8}")
+    print(f"{'forked worker: first /health':40} {first_request:>10.2f} {max(w['first_request_ms'] for w in workers):>8.2f}")
+    print(f"{'forked worker: own Mongo + HTTP clients':40} {clients:>10.2f} {max(w['clients_ms'] for w in workers):>8.2f}")
+    print("-" * 60)
+    total = first_request + clients
+    verdict = "within" if total <= WORKER_START_BUDGET_MS else "OVER"
+    print(f"Worker cold start {total:.1f} ms ({verdict} the {WORKER_START_BUDGET_MS} ms budget)")
+    if any(w["status"] != 200 for w in workers):
+        print("Warning: /health failed in a forked worker")
+
+
+def bench_archive():
+    """Retention archive round trip: stored run -> archive line -> bulk_load, with the same logs and playback."""
+    from datetime import datetime
+
+    from bson import ObjectId
+
+    from bulk_load import parse_batch
+    from decoders import get_decoder
+    from playback import ChunkBuilder
+    from retention import json_default, run_record
+
+    random.seed(42)
+    raw = test_data.generate_realistic_run("Alpha", 1, "good")["logs"]
+    dumps = {
+        "path": raw,
+        "sensor": [{key: value for key, value in record.items() if key not in ("x", "y")} for record in raw],
+        "event": [{"event": 1 + i % 8, "data": i % 5, "timestamp": record["timestamp"]} for i, record in enumerate(raw)],
+    }
+
+    print(f"{'Format':8} {'Logs':>7} {'Line bytes':>11} {'Load ms':>8}  Round trip")
+    print("-" * 50)
+    for name, records in dumps.items():
+        logs, _ = get_decoder(name).decode_batch(records)
+        run = {
+            "_id": ObjectId(), "robot_id": "Alpha", "run_number": 1, "logs": logs, "events": [], "segments": [],
+            "metadata": {}, "created_at": datetime(2024, 1, 1, 12, 0), "data_format": name
+        }
+        line = json.dumps(run_record(run), default=json_default).encode("utf-8")
+
+        start = time.perf_counter()
+        loaded, failures = parse_batch([(0, line)], datetime.utcnow(), "runs-job.ndjson")
+        load_ms = (time.perf_counter() - start) * 1000
+        assert not failures, f"{name} archive line failed to load: {failures}"
+
+        doc, _, _, chunks, _, rejected = loaded[0]
+        same = (doc["_id"] == run["_id"] and doc["logs"] == logs and doc["data_format"] == name
+                and doc["created_at"] == run["created_at"] and not rejected
+                and chunks == ChunkBuilder().add(logs).finish())
+        print(f"{name:8} {len(logs):>7,} {len(line):>11,} {load_ms:>8.2f}  {'same' if same else 'CHANGED'}")
+        assert same, f"{name} run changed in the archive round trip"
+
+
+BENCHMARKS = {
+    "archive": bench_archive,
+    "compression": bench_compression,
+    "prompt": bench_prompt,
+    "startup": bench_startup,
+}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        print("Usage:")
+        for name, func in BENCHMARKS.items():
+            print(f"  python benchmarks.py {name:12} - {func.__doc__.splitlines()[0]}")
+        sys.exit(1)
+
+    BENCHMARKS[sys.argv[1]]()
@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""
+Bulk loader for NDJSON run archives.
+
+Each line of the archive is one run in the /ingest body format
+({"robot_id", "run_number", "logs", "events", "segments", "metadata"}, plus
+an optional ISO "created_at" to keep the original date). Runs archived by
+retention.py have stored logs, already normalized (with "timestamp_ms"), and
+their "data_format"; those logs are loaded as they are. Plain and gzip (.gz)
+archives are supported.
+
+Lines are read in batches and parsed and normalized in worker processes with
+the same decoders /ingest uses; the heatmap, spatial index, playback
+chunks and sensor sketches are prepared there too. The main process writes each batch with an
+unordered insert_many and then updates the indexes. Batches are committed in
+file order, so after a failure the printed byte offset (of the uncompressed
+stream) is safe to resume from with --offset.
+
+Loading is idempotent: a run's _id is the archive's run_id if the line has
+one (retention archives do), else derived from the archive's file name
+(without .gz) and the line's byte offset. Runs already in the database are skipped, along with
+their index updates, so reloading a file or resuming from an earlier offset
+doesn't duplicate anything. Runs are inserted with `indexes_pending` set
+until their batch's index updates are done; if a load stopped in between,
+the next load finds such runs among the skipped ones and rebuilds the
+heatmap, spatial index, playback chunks and sketches when it finishes.
+
+Usage:
+  python bulk_load.py runs.ndjson.gz
+  python bulk_load.py runs.ndjson --workers 8 --offset 104857600
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+from decoders import DECODERS, detect_decoder
+from heatmap import count_cells
+from playback import ChunkBuilder
+from sketches import SketchBuilder
+from spatial_index import WindowTracker
+
+BATCH_RUNS = int(os.getenv("BULK_LOAD_BATCH_RUNS", 50))
+REPORT_INTERVAL_S = 5.0
+DUPLICATE_KEY = 11000
+
+
+def open_archive(path):
+    """Binary line reader for a plain or gzip-compressed archive."""
+    with open(path, "rb") as f:
+        magic = f.read(2)
+    if magic == b"\x1f\x8b":
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def read_batches(f, offset=0, batch_runs=BATCH_RUNS):
+    """
+    Yield (lines, end_offset) batches of non-empty lines as (offset, line)
+    pairs, starting at byte `offset` (which must be a line
+    boundary) of the uncompressed stream.
+    """
+    if offset:
+        f.seek(offset)  # A GzipFile decompresses and discards up to offset
+    position = offset
+    lines = []
+    for line in f:
+        if line.strip():
+            lines.append((position, line))
+        position += len(line)
+        if len(lines) >= batch_runs:
+            yield lines, position
+            lines = []
+    if lines:
+        yield lines, position
+
+
+def run_object_id(data, source, offset):
+    """The line's run_id if it is an ObjectId, else one derived from the archive name and line offset."""
+    run_id = data.get("run_id")
+    if isinstance(run_id, str) and ObjectId.is_valid(run_id):
+        return ObjectId(run_id)
+    return ObjectId(hashlib.sha256(f"{source}:{offset}".encode("utf-8")).digest()[:12])
+
+
+def is_normalized(records):
+    """Whether `records` are stored logs (e.g. from a retention archive) rather than raw dump records."""
+    return bool(records) and all(isinstance(record, dict) and "timestamp_ms" in record for record in records)
+
+
+def stored_format(data, logs):
+    """Format name of already normalized logs: the archived data_format, else guessed from their fields."""
+    name = data.get("data_format")
+    if name in {decoder.name for decoder in DECODERS}:
+        return name
+    if "event_code" in logs[0]:
+        return "event"
+    return "path" if "x" in logs[0] else "sensor"
+
+
+def normalize_run(data, created_at, run_id):
+    """
+    Turn one /ingest-format run into a run document plus what the indexes
+    need. Returns (doc, heatmap_counts, spatial_cells, playback_chunks, sketches, rejected_count).
+    """
+    records = data.get("logs")
+    if not isinstance(records, list):
+        raise ValueError("Missing 'logs' field")
+    if is_normalized(records):
+        logs, errors, format_name = records, [], stored_format(data, records)
+    else:
+        decoder = detect_decoder(records)
+        logs, errors = decoder.decode_batch(records)
+        format_name = decoder.name
+    if errors and not logs:
+        raise ValueError("No valid log entries")
+
+    if data.get("created_at"):
+        created_at = datetime.fromisoformat(data["created_at"])
+    doc = {
+        "_id": run_id,
+        "logs": logs,
+        "created_at": created_at,
+        "analyzed": False,
+        "analysis": None,
+        "robot_id": data.get("robot_id", "unknown"),
+        "run_number": data.get("run_number", 0),
+        "events": data.get("events", []),
+        "segments": data.get("segments", []),
+        "metadata": data.get("metadata", {}),
+        "data_format": format_name,
+        "indexes_pending": True,
+    }
+    return (doc, count_cells(logs), WindowTracker().add(logs).finish(),
+            ChunkBuilder().add(logs).finish(), SketchBuilder().add(logs).finish(), len(errors))
+
+
+def parse_batch(lines, created_at, source):
+    """Worker: parse and normalize a batch of (offset, line) pairs. Returns (runs, failures)."""
+    runs = []
+    failures = []
+    for offset, line in lines:
+        try:
+            data = json.loads(line)
+            if not isinstance(data, dict):
+                raise ValueError("expected a JSON object")
+            runs.append(normalize_run(data, created_at, run_object_id(data, source, offset)))
+        except (ValueError, TypeError, KeyError) as e:
+            failures.append({"offset": offset, "error": str(e)})
+    return runs, failures
+
+
+def pending_runs(runs_collection, run_ids):
+    """How many of these runs were inserted by a load that stopped before updating the indexes."""
+    return runs_collection.count_documents({"_id": {"$in": run_ids}, "indexes_pending": True})
+
+
+def insert_new(runs_collection, docs):
+    """insert_many that skips runs already loaded. Returns the positions of the docs inserted."""
+    try:
+        runs_collection.insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        if any(error.get("code") != DUPLICATE_KEY for error in errors):
+            raise
+        duplicates = {error["index"] for error in errors}
+        return [i for i in range(len(docs)) if i not in duplicates]
+    return list(range(len(docs)))
+
+
+class Throughput:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.runs = 0
+        self.logs = 0
+        self.bytes = 0
+        self.failed = 0
+        self.rejected_logs = 0
+        self.duplicates = 0
+        self.pending = 0  # Skipped runs whose index updates a previous load didn't finish
+
+    def line(self):
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        return (f"{self.runs:,} runs ({self.runs / elapsed:,.1f}/s), "
+                f"{self.logs:,} logs ({self.logs / elapsed:,.0f}/s), "
+                f"{self.bytes / 1e6:,.1f} MB ({self.bytes / 1e6 / elapsed:,.2f} MB/s), "
+                f"{self.failed} failed lines, {self.rejected_logs:,} rejected logs, "
+                f"{self.duplicates:,} runs already loaded")
+
+
+def load_archive(path, runs_collection, fleet_heatmap, spatial_index, playback_store, sensor_sketches,
+                 workers=None, offset=0, batch_runs=BATCH_RUNS, report=print):
+    """
+    Load an archive. Returns (Throughput, failures, end offset). On an error
+    the exception is re-raised with `resume_offset` set to the end of the
+    last committed batch. Indexes are rebuilt at the end if skipped runs
+    were missing from them.
+    """
+    workers = workers or os.cpu_count() or 1
+    # Offsets are in the uncompressed stream, so a gzipped copy gets the same ids
+    source = os.path.basename(path)
+    source = source[:-3] if source.endswith(".gz") else source
+    created_at = datetime.utcnow()
+    stats = Throughput()
+    failures = []
+    committed = offset
+    last_report = time.perf_counter()
+
+    def commit(result, end_offset):
+        runs, batch_failures = result
+        if runs:
+            inserted = insert_new(runs_collection, [run[0] for run in runs])
+            skipped = set(range(len(runs))) - set(inserted)
+            if skipped:
+                stats.duplicates += len(skipped)
+                stats.pending += pending_runs(runs_collection, [runs[i][0]["_id"] for i in skipped])
+            runs = [runs[i] for i in inserted]
+            for doc, counts, cells, chunks, sketches, rejected in runs:
+                fleet_heatmap.add_counts(doc["robot_id"], doc["created_at"], counts)
+                spatial_index.add_run(doc["_id"], doc["robot_id"], doc["created_at"], cells)
+                playback_store.add_run(doc["_id"], chunks)
+                sensor_sketches.add_run(doc["robot_id"], doc["created_at"], sketches)
+                stats.logs += len(doc["logs"])
+                stats.rejected_logs += rejected
+            if runs:
+                runs_collection.update_many({"_id": {"$in": [run[0]["_id"] for run in runs]}},
+                                            {"$unset": {"indexes_pending": ""}})
+        stats.runs += len(runs)
+        stats.failed += len(batch_failures)
+        failures.extend(batch_failures)
+        stats.bytes += end_offset - committed
+
+    try:
+        with open_archive(path) as f, ProcessPoolExecutor(workers) as pool:
+            in_flight = deque()
+            for lines, end in read_batches(f, offset, batch_runs):
+                in_flight.append((pool.submit(parse_batch, lines, created_at, source), end))
+                # Bounded read-ahead; batches are committed in file order
+                while len(in_flight) >= workers * 2:
+                    future, end_offset = in_flight.popleft()
+                    commit(future.result(), end_offset)
+                    committed = end_offset
+                if report and time.perf_counter() - last_report >= REPORT_INTERVAL_S:
+                    report(f"  offset {committed:,}: {stats.line()}")
+                    last_report = time.perf_counter()
+            while in_flight:
+                future, end_offset = in_flight.popleft()
+                commit(future.result(), end_offset)
+                committed = end_offset
+    except BaseException as e:
+        e.resume_offset = committed
+        raise
+
+    if stats.pending:
+        # Their updates may have been partly applied, so only a rebuild gets the counts right
+        if report:
+            report(f"  {stats.pending:,} runs from an interrupted load are missing from the indexes; rebuilding them")
+        for index in (fleet_heatmap, spatial_index, playback_store, sensor_sketches):
+            index.rebuild(runs_collection)
+        runs_collection.update_many({"indexes_pending": True}, {"$unset": {"indexes_pending": ""}})
+    return stats, failures, committed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load an NDJSON (optionally gzipped) run archive into MongoDB.")
+    parser.add_argument("archive")
+    parser.add_argument("--workers", type=int, help="parser processes (default: CPU count)")
+    parser.add_argument("--offset", type=int, default=0, help="resume at this byte offset of the uncompressed archive")
+    parser.add_argument("--batch-runs", type=int, default=BATCH_RUNS, help="runs per insert_many batch")
+    args = parser.parse_args()
+
+    import app
+
+    print(f"Loading {args.archive}" + (f" from offset {args.offset:,}" if args.offset else ""))
+    try:
+        stats, failures, end = load_archive(
+            args.archive, app.runs_collection, app.fleet_heatmap, app.spatial_index, app.playback_store,
+            app.sensor_sketches, args.workers, args.offset, args.batch_runs
+        )
+    except (Exception, KeyboardInterrupt) as e:
+        print(f"\nStopped: {e!r}")
+        print(f"Resume with: python bulk_load.py {args.archive} --offset {e.resume_offset}")
+        sys.exit(1)
+
+    for failure in failures[:20]:
+        print(f"  line at offset {failure['offset']:,}: {failure['error']}")
+    if len(failures) > 20:
+        print(f"  ... and {len(failures) - 20} more failed lines")
+    print(f"Done at offset {end:,}: {stats.line()}")
@@ -0,0 +1,150 @@
+"""
+Lazily created, fork-safe MongoDB and HTTP clients.
+
+A MongoClient starts monitor threads and opens sockets, and a requests
+Session holds pooled connections; neither may be shared with a forked child
+(Gunicorn with --preload, or a ProcessPoolExecutor on Linux). Nothing here
+connects at import. Each process creates its own client the first time one
+is used, and a child that inherits its parent's client after a fork
+replaces it instead of using it.
+
+Collections are handed out as LazyCollection objects, which resolve to the
+current process's client on every use, so modules can keep holding
+`runs_collection` and friends as plain globals.
+"""
+import os
+import threading
+import time
+
+import pymongo
+import requests
+from pymongo import MongoClient
+from pymongo.errors import ConfigurationError, PyMongoError
+from requests.adapters import HTTPAdapter
+
+DEFAULT_MONGODB_URI = "mongodb://localhost:27017/utra_da"
+DEFAULT_DB_NAME = "utra_da"
+# How long /ready waits for MongoDB to answer a ping
+READY_TIMEOUT_SECONDS = float(os.getenv("READY_TIMEOUT_SECONDS", 1.0))
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", 100))
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", 10))
+
+
+class ProcessLocal:
+    """A value built by `factory()` on first use in each process."""
+
+    def __init__(self, factory, close=None):
+        self.factory = factory
+        self.close = close
+        self._value = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def created(self):
+        return self._value is not None and self._pid == os.getpid()
+
+    def get(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    # A value inherited through fork belongs to the parent; drop it without closing
+                    self._value = self.factory()
+                    self._pid = os.getpid()
+        return self._value
+
+    def reset(self):
+        """Discard this process's value (closing it) so the next get() builds a new one."""
+        with self._lock:
+            if self._value is not None and self._pid == os.getpid() and self.close:
+                self.close(self._value)
+            self._value = None
+            self._pid = None
+
+
+class Mongo:
+    def __init__(self, uri=None):
+        self.uri = uri
+        self._client = ProcessLocal(self._connect, close=lambda state: state[0].close())
+
+    def configure(self, uri):
+        self.uri = uri
+        self._client.reset()
+
+    def _connect(self):
+        uri = self.uri or os.getenv("MONGODB_URI", DEFAULT_MONGODB_URI)
+        client = MongoClient(uri, connect=False, maxPoolSize=MONGO_MAX_POOL_SIZE)
+        # If the URI names a database use it, otherwise fall back to a known name
+        try:
+            db = client.get_default_database()
+        except ConfigurationError:
+            db = client[DEFAULT_DB_NAME]
+        return client, db, {}
+
+    @property
+    def client(self):
+        return self._client.get()[0]
+
+    @property
+    def db(self):
+        return self._client.get()[1]
+
+    def get_collection(self, name):
+        _, db, collections = self._client.get()
+        collection = collections.get(name)
+        if collection is None:
+            collection = collections[name] = db[name]
+        return collection
+
+    def collection(self, name):
+        return LazyCollection(self, name)
+
+    def check(self, timeout=READY_TIMEOUT_SECONDS):
+        """Readiness of this process's connection pool: {"ok", "latency_ms"} or {"ok", "error"}."""
+        start = time.perf_counter()
+        try:
+            with pymongo.timeout(timeout):
+                self.client.admin.command("ping")
+        except PyMongoError as e:
+            return {"ok": False, "error": str(e)}
+        return {"ok": True, "latency_ms": round((time.perf_counter() - start) * 1000, 1)}
+
+
+class LazyCollection:
+    """Stands in for a pymongo Collection; every attribute is looked up on the current process's one."""
+
+    def __init__(self, mongo, name):
+        self._mongo = mongo
+        self.name = name
+
+    def __getattr__(self, attr):
+        return getattr(self._mongo.get_collection(self.name), attr)
+
+    def __repr__(self):
+        return f"LazyCollection({self.name!r})"
+
+
+def new_session(pool_size=HTTP_POOL_SIZE):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class HttpClient:
+    """requests.Session with a connection pool, one per process."""
+
+    def __init__(self, pool_size=HTTP_POOL_SIZE):
+        self._session = ProcessLocal(lambda: new_session(pool_size), close=lambda session: session.close())
+
+    @property
+    def session(self):
+        return self._session.get()
+
+    @property
+    def created(self):
+        return self._session.created
+
+    def reset(self):
+        self._session.reset()
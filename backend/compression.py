@@ -0,0 +1,76 @@
+"""
+Decoding of compressed request bodies.
+
+The bridge gzip- or zstd-compresses large uploads (Content-Encoding header) to
+save bandwidth on weak venue connections. Bodies are decompressed as a stream
+and capped at MAX_DECOMPRESSED_BYTES so a small malicious payload cannot
+expand into gigabytes of memory (a "decompression bomb").
+"""
+import gzip
+import json
+import os
+
+from werkzeug.exceptions import BadRequest
+
+try:
+    import zstandard
+except ImportError:  # zstd support is optional
+    zstandard = None
+
+MAX_DECOMPRESSED_BYTES = int(os.getenv("MAX_DECOMPRESSED_BYTES", 256 * 1024 * 1024))
+
+
+class PayloadTooLarge(Exception):
+    """The decompressed body exceeded MAX_DECOMPRESSED_BYTES."""
+
+
+class UnsupportedEncoding(Exception):
+    """The request used a Content-Encoding the server cannot decode."""
+
+
+class LimitedReader:
+    """File-like wrapper that raises PayloadTooLarge after `limit` bytes."""
+
+    def __init__(self, stream, limit):
+        self._stream = stream
+        self._limit = limit
+        self._read = 0
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return b"".join(iter(lambda: self.read(64 * 1024), b""))
+        try:
+            chunk = self._stream.read(min(size, self._limit + 1 - self._read))
+        except Exception as e:
+            # gzip/zstd raise assorted error types for corrupt or truncated input
+            raise ValueError(f"Invalid compressed body: {e}") from e
+        self._read += len(chunk)
+        if self._read > self._limit:
+            raise PayloadTooLarge(f"Decompressed body exceeds {self._limit} bytes")
+        return chunk
+
+
+def decoded_body_stream(request, limit=None):
+    """Return a readable stream over the request body with Content-Encoding removed."""
+    encoding = (request.headers.get("Content-Encoding") or "identity").strip().lower()
+    if encoding == "identity":
+        return request.stream
+    if encoding in ("gzip", "x-gzip"):
+        stream = gzip.GzipFile(fileobj=request.stream, mode="rb")
+    elif encoding == "zstd" and zstandard is not None:
+        stream = zstandard.ZstdDecompressor().stream_reader(request.stream)
+    else:
+        raise UnsupportedEncoding(f"Unsupported Content-Encoding: {encoding}")
+    return LimitedReader(stream, limit or MAX_DECOMPRESSED_BYTES)
+
+
+def get_json_body(request):
+    """Like request.get_json(), but aware of compressed bodies. Raises ValueError for malformed JSON."""
+    try:
+        if not request.headers.get("Content-Encoding"):
+            return request.get_json()
+        return json.loads(decoded_body_stream(request).read())
+    except BadRequest as e:
+        raise ValueError(f"Invalid JSON body: {e.description}") from e
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Invalid JSON body: {e}") from e
@@ -0,0 +1,228 @@
+"""
+Log format decoders for /ingest.
+
+Each robot log format (path, sensor, event) has a decoder that knows how to
+recognise its records, validate them against a schema and normalize them into
+the stored log shape. New formats - e.g. packed binary EEPROM records - are
+added by subclassing LogDecoder and decorating it with @register_decoder;
+nothing in app.py needs to change.
+"""
+
+# Event code mappings (from Arduino EEPROM)
+EVENT_CODES = {
+    1: "Start",
+    2: "SectionComplete",
+    3: "Checkpoint",
+    4: "UltrasonicDodge",
+    5: "IRToggle",
+    6: "ServoStateChange",
+    7: "Stop",
+    8: "Error"
+}
+
+# Legacy zone names (kept for compatibility)
+ZONE_NAMES = {
+    0: "Start",
+    1: "Red Zone",
+    2: "Blue Zone",
+    3: "Green Zone",
+    4: "Center",
+    5: "Unknown"
+}
+
+# Section names for new sensor data format
+SECTION_NAMES = {
+    1: "Red Path",
+    2: "Ramp",
+    3: "Green Path"
+}
+
+NUMBER = (int, float)
+
+# Number of records inspected when detecting the format of a dump
+DETECT_SAMPLE_SIZE = 32
+
+
+class LogDecoder:
+    """
+    Base class for a log format.
+
+    `schema` maps each input field to (allowed types, default). It is compiled
+    once per decoder into a flat tuple so validating a record is a single loop.
+    Fields listed in `required` must be present for a record to match.
+    """
+    name = None
+    schema = {}
+    required = ()
+
+    def __init__(self):
+        self._checks = tuple(
+            (field, types, default, " or ".join(t.__name__ for t in types))
+            for field, (types, default) in self.schema.items()
+        )
+
+    def matches(self, record):
+        """Whether `record` looks like this format (used for format detection)."""
+        return isinstance(record, dict) and all(field in record for field in self.required)
+
+    def validate(self, record):
+        """Return an error message for a malformed record, or None."""
+        if not isinstance(record, dict):
+            return f"expected an object, got {type(record).__name__}"
+        for field in self.required:
+            if record.get(field) is None:
+                return f"missing required field '{field}'"
+        for field, types, _, type_names in self._checks:
+            value = record.get(field)
+            if value is not None and not isinstance(value, types):
+                return f"'{field}' must be {type_names}, got {type(value).__name__}"
+        return None
+
+    def fields(self, record):
+        """Schema fields of a validated record, with defaults filled in."""
+        values = {}
+        for field, _, default, _ in self._checks:
+            value = record.get(field)
+            values[field] = default if value is None else value
+        return values
+
+    def normalize(self, record):
+        """Convert one validated record into the stored log shape."""
+        raise NotImplementedError
+
+    def decode_batch(self, records, start_index=0):
+        """
+        Validate and normalize a batch of records in one pass.
+        Returns (logs, errors) where errors are {"index", "error"} dicts
+        indexed from `start_index`.
+        """
+        logs = []
+        errors = []
+        validate = self.validate
+        normalize = self.normalize
+        for offset, record in enumerate(records):
+            error = validate(record)
+            if error:
+                errors.append({"index": start_index + offset, "error": error})
+            else:
+                logs.append(normalize(record))
+        return logs, errors
+
+
+# Registered decoders in detection priority order (most specific first)
+DECODERS = []
+
+
+def register_decoder(cls):
+    """Class decorator adding a decoder to the registry."""
+    DECODERS.append(cls())
+    return cls
+
+
+def get_decoder(name):
+    for decoder in DECODERS:
+        if decoder.name == name:
+            return decoder
+    raise KeyError(f"Unknown log format: {name}")
+
+
+def detect_decoder(records, sample_size=DETECT_SAMPLE_SIZE):
+    """
+    Pick the decoder for a dump from a sample spread across `records`.
+    Each sampled record votes for the first decoder that matches it; the
+    format with most votes wins. Falls back to the event format.
+    """
+    if not records:
+        return get_decoder("event")
+    step = max(1, len(records) // sample_size)
+    votes = {}
+    for record in records[::step][:sample_size]:
+        for decoder in DECODERS:
+            if decoder.matches(record):
+                votes[decoder.name] = votes.get(decoder.name, 0) + 1
+                break
+    if not votes:
+        return get_decoder("event")
+    best = max(votes.values())
+    return next(d for d in DECODERS if votes.get(d.name) == best)
+
+
+@register_decoder
+class PathDecoder(LogDecoder):
+    """New path format with x,y positions."""
+    name = "path"
+    required = ("x", "y")
+    schema = {
+        "x": (NUMBER, 0),
+        "y": (NUMBER, 0),
+        "segment_id": ((str,), ""),
+        "segment_index": ((int,), 0),
+        "section_id": ((int,), 0),
+        "timestamp": (NUMBER, 0),
+        "checkpoint_success": (NUMBER, 0),
+        "ultrasonic_distance": (NUMBER, 0),
+        "claw_status": (NUMBER, 0),
+    }
+
+    def normalize(self, record):
+        f = self.fields(record)
+        return {
+            "x": f["x"],
+            "y": f["y"],
+            "segment_id": f["segment_id"],
+            "segment_index": f["segment_index"],
+            "section_id": f["section_id"],
+            "section_name": SECTION_NAMES.get(f["section_id"], "Unknown"),
+            "timestamp_ms": f["timestamp"],
+            "checkpoint_success": f["checkpoint_success"],
+            "ultrasonic_distance": f["ultrasonic_distance"],
+            "claw_status": f["claw_status"],
+        }
+
+
+@register_decoder
+class SensorDecoder(LogDecoder):
+    """Sensor data format (section_id based, no positions)."""
+    name = "sensor"
+    required = ("section_id",)
+    schema = {
+        "section_id": ((int,), 0),
+        "timestamp": (NUMBER, 0),
+        "checkpoint_success": (NUMBER, 0),
+        "ultrasonic_distance": (NUMBER, 0),
+        "claw_status": (NUMBER, 0),
+    }
+
+    def normalize(self, record):
+        f = self.fields(record)
+        return {
+            "section_id": f["section_id"],
+            "section_name": SECTION_NAMES.get(f["section_id"], "Unknown"),
+            "timestamp_ms": f["timestamp"],
+            "checkpoint_success": f["checkpoint_success"],
+            "ultrasonic_distance": f["ultrasonic_distance"],
+            "claw_status": f["claw_status"],
+            "raw": record
+        }
+
+
+@register_decoder
+class EventDecoder(LogDecoder):
+    """Old event-based format from Arduino EEPROM. Matches any object."""
+    name = "event"
+    schema = {
+        "event": ((int,), 0),
+        "data": (NUMBER, 0),
+        "timestamp": (NUMBER, 0),
+    }
+
+    def normalize(self, record):
+        f = self.fields(record)
+        return {
+            "event_code": f["event"],
+            "event_name": EVENT_CODES.get(f["event"], "Unknown"),
+            "zone_id": f["data"],
+            "zone_name": ZONE_NAMES.get(f["data"], "Unknown"),
+            "timestamp_ms": f["timestamp"],
+            "raw": record
+        }
@@ -0,0 +1,65 @@
+"""
+Largest-Triangle-Three-Buckets downsampling for chart series.
+
+LTTB keeps the first and last points and, from each of `threshold - 2`
+equal-sized buckets in between, the point forming the largest triangle with
+the point kept from the previous bucket and the average of the next bucket.
+Unlike taking every n-th point it keeps the peaks and dips a chart shows.
+"""
+
+# Time series in an analysis and the field plotted on their y axis
+ANALYSIS_SERIES = {
+    "speed_over_time": "speed",
+    "acceleration_data": "acceleration",
+    "ultrasonic_over_time": "distance",
+    "claw_over_time": "angle",
+}
+
+MIN_POINTS = 3
+
+
+def lttb(points, threshold, x_key="time_ms", y_key="value"):
+    """Downsample a list of dicts to at most `threshold` points (input order kept)."""
+    n = len(points)
+    if threshold >= n or threshold < MIN_POINTS:
+        return list(points)
+
+    sampled = [points[0]]
+    bucket_size = (n - 2) / (threshold - 2)
+    a = 0  # Index of the previously selected point
+
+    for i in range(threshold - 2):
+        # Average of the next bucket (the last point for the final bucket)
+        next_start = int((i + 1) * bucket_size) + 1
+        next_end = min(int((i + 2) * bucket_size) + 1, n)
+        if next_start >= n - 1:
+            avg_x, avg_y = points[n - 1][x_key], points[n - 1][y_key]
+        else:
+            count = next_end - next_start
+            avg_x = sum(p[x_key] for p in points[next_start:next_end]) / count
+            avg_y = sum(p[y_key] for p in points[next_start:next_end]) / count
+
+        ax, ay = points[a][x_key], points[a][y_key]
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+        best, best_area = start, -1.0
+        for j in range(start, end):
+            area = abs((ax - avg_x) * (points[j][y_key] - ay) - (ax - points[j][x_key]) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+        sampled.append(points[best])
+        a = best
+
+    sampled.append(points[n - 1])
+    return sampled
+
+
+def downsample_analysis(analysis, points):
+    """Copy of `analysis` with every time series reduced to at most `points` points (None: unchanged)."""
+    if not analysis or not points:
+        return analysis
+    result = dict(analysis)
+    for key, y_key in ANALYSIS_SERIES.items():
+        if result.get(key):
+            result[key] = lttb(result[key], points, y_key=y_key)
+    return result
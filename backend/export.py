@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Columnar export of runs and telemetry to Parquet or Arrow IPC.
+
+Four tables can be exported, one row per:
+  logs       - log entry of a run (flattened, with the run's id/robot/number)
+  events     - event of a path-format run
+  segments   - path segment of a path-format run
+  telemetry  - live telemetry reading
+
+Documents are read through a MongoDB cursor and written as record batches
+of EXPORT_BATCH_ROWS rows, so memory stays bounded however many runs match.
+Requires pyarrow (optional dependency).
+
+Usage:
+  python export.py logs -o logs.parquet
+  python export.py telemetry --format arrow --robot robot_01 --from 2026-03-01 -o telemetry.arrow
+"""
+import argparse
+import json
+import os
+import sys
+from datetime import datetime, timedelta
+
+# pyarrow, imported by load_pyarrow() on the first export so it doesn't slow down app startup
+pa = None
+
+EXPORT_BATCH_ROWS = int(os.getenv("EXPORT_BATCH_ROWS", 50000))
+FORMATS = {"parquet": "application/vnd.apache.parquet", "arrow": "application/vnd.apache.arrow.stream"}
+
+RUN_COLUMNS = [("run_id", "string"), ("robot_id", "string"), ("run_number", "int64"), ("created_at", "timestamp")]
+
+TABLE_COLUMNS = {
+    "logs": RUN_COLUMNS + [
+        ("log_index", "int64"), ("timestamp_ms", "float64"), ("x", "float64"), ("y", "float64"),
+        ("section_id", "int64"), ("section_name", "string"), ("segment_id", "string"),
+        ("checkpoint_success", "float64"), ("ultrasonic_distance", "float64"), ("claw_status", "float64"),
+        ("event_code", "int64"), ("event_name", "string"), ("zone_name", "string"),
+    ],
+    "events": RUN_COLUMNS + [
+        ("event_index", "int64"), ("timestamp_ms", "float64"), ("event_type", "string"), ("message", "string"),
+        ("segment_id", "string"), ("x", "float64"), ("y", "float64"), ("pause_duration", "float64"),
+    ],
+    "segments": RUN_COLUMNS + [
+        ("segment_id", "string"), ("segment_index", "int64"), ("start_x", "float64"), ("start_y", "float64"),
+        ("end_x", "float64"), ("end_y", "float64"), ("start_time", "float64"), ("end_time", "float64"),
+        ("duration", "float64"), ("action", "string"),
+    ],
+    "telemetry": [
+        ("robot_id", "string"), ("run_id", "string"), ("received_at", "timestamp"),
+        ("zone", "string"), ("section_id", "int64"), ("x", "float64"), ("y", "float64"),
+        ("ultrasonic_distance", "float64"), ("checkpoint_success", "float64"), ("claw_status", "float64"),
+        ("sensors_json", "string"),
+    ],
+}
+TABLES = tuple(TABLE_COLUMNS)
+
+TELEMETRY_SENSOR_FIELDS = ("zone", "section_id", "x", "y", "ultrasonic_distance", "checkpoint_success", "claw_status")
+
+
+class ExportUnavailable(Exception):
+    """pyarrow is not installed."""
+
+
+def load_pyarrow():
+    """Import pyarrow on first use. Raises ExportUnavailable if it isn't installed."""
+    global pa
+    if pa is None:
+        try:
+            import pyarrow
+            import pyarrow.ipc
+            import pyarrow.parquet
+        except ImportError:
+            raise ExportUnavailable("Export requires pyarrow (pip install pyarrow)")
+        pa = pyarrow
+    return pa
+
+
+def arrow_schema(table):
+    types = {
+        "string": pa.string(),
+        "int64": pa.int64(),
+        "float64": pa.float64(),
+        "timestamp": pa.timestamp("ms"),
+    }
+    return pa.schema([(name, types[kind]) for name, kind in TABLE_COLUMNS[table]])
+
+
+def date_filter(field, date_from=None, date_to=None):
+    """Filter on `field` between date_from and the end of date_to's day."""
+    if not (date_from or date_to):
+        return {}
+    match = {}
+    if date_from:
+        match["$gte"] = date_from
+    if date_to:
+        match["$lt"] = datetime(date_to.year, date_to.month, date_to.day) + timedelta(days=1)
+    return {field: match}
+
+
+def run_fields(run):
+    return {
+        "run_id": str(run["_id"]),
+        "robot_id": text(run.get("robot_id")),
+        "run_number": integer(run.get("run_number")),
+        "created_at": run.get("created_at"),
+    }
+
+
+def number(value):
+    return value if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+
+def integer(value):
+    return value if isinstance(value, int) and not isinstance(value, bool) else None
+
+
+def text(value):
+    return None if value is None else str(value)
+
+
+def point(value):
+    """(x, y) from a {"x", "y"} dict or an [x, y] list."""
+    if isinstance(value, dict):
+        return number(value.get("x")), number(value.get("y"))
+    if isinstance(value, (list, tuple)) and len(value) >= 2:
+        return number(value[0]), number(value[1])
+    return None, None
+
+
+def run_rows(table, runs):
+    """Flatten the `table` array of each run document into rows."""
+    for run in runs:
+        base = run_fields(run)
+        for index, item in enumerate(run.get(table) or []):
+            if table == "logs":
+                yield {
+                    **base,
+                    "log_index": index,
+                    "timestamp_ms": number(item.get("timestamp_ms")),
+                    "x": number(item.get("x")),
+                    "y": number(item.get("y")),
+                    "section_id": item.get("section_id"),
+                    "section_name": item.get("section_name"),
+                    "segment_id": item.get("segment_id"),
+                    "checkpoint_success": number(item.get("checkpoint_success")),
+                    "ultrasonic_distance": number(item.get("ultrasonic_distance")),
+                    "claw_status": number(item.get("claw_status")),
+                    "event_code": item.get("event_code"),
+                    "event_name": item.get("event_name"),
+                    "zone_name": item.get("zone_name"),
+                }
+            elif table == "events":
+                x, y = point(item.get("position"))
+                yield {
+                    **base,
+                    "event_index": index,
+                    "timestamp_ms": number(item.get("timestamp")),
+                    "event_type": text(item.get("event_type")),
+                    "message": text(item.get("message")),
+                    "segment_id": text(item.get("segment_id")),
+                    "x": x,
+                    "y": y,
+                    "pause_duration": number(item.get("pause_duration")),
+                }
+            else:
+                start_x, start_y = point(item.get("start_pos"))
+                end_x, end_y = point(item.get("end_pos"))
+                yield {
+                    **base,
+                    "segment_id": text(item.get("segment_id")),
+                    "segment_index": integer(item.get("segment_index")),
+                    "start_x": start_x,
+                    "start_y": start_y,
+                    "end_x": end_x,
+                    "end_y": end_y,
+                    "start_time": number(item.get("start_time")),
+                    "end_time": number(item.get("end_time")),
+                    "duration": number(item.get("duration")),
+                    "action": text(item.get("action")),
+                }
+
+
+def telemetry_rows(docs):
+    for doc in docs:
+        sensors = doc.get("sensors") or {}
+        extra = {k: v for k, v in sensors.items() if k not in TELEMETRY_SENSOR_FIELDS}
+        yield {
+            "robot_id": text(doc.get("robot_id")),
+            "run_id": text(doc.get("run_id")),
+            "received_at": doc.get("timestamp"),
+            "zone": text(sensors.get("zone")),
+            "section_id": integer(sensors.get("section_id")),
+            "x": number(sensors.get("x")),
+            "y": number(sensors.get("y")),
+            "ultrasonic_distance": number(sensors.get("ultrasonic_distance", sensors.get("ultrasonic_cm"))),
+            "checkpoint_success": number(sensors.get("checkpoint_success")),
+            "claw_status": number(sensors.get("claw_status")),
+            "sensors_json": json.dumps(extra, default=str) if extra else None,
+        }
+
+
+def export_rows(table, runs_collection, telemetry_collection, robot_id=None, date_from=None, date_to=None):
+    """Rows of `table` matching the filters, read through a cursor."""
+    if table == "telemetry":
+        query = {"robot_id": robot_id} if robot_id else {}
+        query.update(date_filter("timestamp", date_from, date_to))
+        cursor = telemetry_collection.find(query).sort("timestamp", 1).batch_size(1000)
+        return telemetry_rows(cursor)
+
+    query = {"robot_id": robot_id} if robot_id else {}
+    query["ingesting"] = {"$ne": True}
+    query.update(date_filter("created_at", date_from, date_to))
+    projection = {"robot_id": 1, "run_number": 1, "created_at": 1, table: 1}
+    # Runs can be large, so fetch few at a time
+    cursor = runs_collection.find(query, projection).sort("created_at", 1).batch_size(8)
+    return run_rows(table, cursor)
+
+
+def record_batches(table, rows, batch_rows=EXPORT_BATCH_ROWS):
+    schema = arrow_schema(table)
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_rows:
+            yield pa.RecordBatch.from_pylist(batch, schema=schema)
+            batch = []
+    if batch:
+        yield pa.RecordBatch.from_pylist(batch, schema=schema)
+
+
+def open_writer(sink, table, fmt):
+    load_pyarrow()
+    if fmt == "parquet":
+        return pa.parquet.ParquetWriter(sink, arrow_schema(table), compression="zstd")
+    return pa.ipc.new_stream(sink, arrow_schema(table))
+
+
+def write_export(sink, table, rows, fmt="parquet", batch_rows=EXPORT_BATCH_ROWS):
+    """Write rows to a file path or writable file object. Returns the row count."""
+    writer = open_writer(sink, table, fmt)
+    count = 0
+    with writer:
+        for batch in record_batches(table, rows, batch_rows):
+            writer.write_batch(batch)
+            count += batch.num_rows
+    return count
+
+
+class ChunkSink:
+    """Write-only file object whose written bytes are collected by stream_export()."""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def writable(self):
+        return True
+
+    def take(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_export(table, rows, fmt="parquet", batch_rows=EXPORT_BATCH_ROWS):
+    """
+    Iterator of file bytes, yielding after every record batch (for a streaming
+    HTTP response). Raises ExportUnavailable up front without pyarrow.
+    """
+    load_pyarrow()
+    sink = ChunkSink()
+    writer = open_writer(pa.PythonFile(sink, mode="w"), table, fmt)
+    return _stream_batches(sink, writer, table, rows, batch_rows)
+
+
+def _stream_batches(sink, writer, table, rows, batch_rows):
+    for batch in record_batches(table, rows, batch_rows):
+        writer.write_batch(batch)
+        data = sink.take()
+        if data:
+            yield data
+    writer.close()
+    yield sink.take()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export runs or telemetry to Parquet / Arrow IPC.")
+    parser.add_argument("table", choices=TABLES)
+    parser.add_argument("-o", "--output", required=True, help="output file")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="parquet")
+    parser.add_argument("--robot", help="only this robot_id")
+    parser.add_argument("--from", dest="date_from", type=datetime.fromisoformat, help="ISO date, inclusive")
+    parser.add_argument("--to", dest="date_to", type=datetime.fromisoformat, help="ISO date, inclusive")
+    parser.add_argument("--batch-rows", type=int, default=EXPORT_BATCH_ROWS)
+    args = parser.parse_args()
+
+    try:
+        load_pyarrow()
+    except ExportUnavailable:
+        print("Export requires pyarrow: pip install pyarrow")
+        sys.exit(1)
+
+    import app
+
+    rows = export_rows(args.table, app.runs_collection, app.telemetry_collection, args.robot, args.date_from, args.date_to)
+    count = write_export(args.output, args.table, rows, args.format, args.batch_rows)
+    print(f"Wrote {count:,} {args.table} rows to {args.output}")
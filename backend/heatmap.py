@@ -0,0 +1,127 @@
+"""
+Fleet-wide position heatmap.
+
+Position counts are kept pre-aggregated in the `heatmap_cells` collection, one
+document per (zoom, cell, robot, day), and incremented at ingest time. Reading
+a season-wide heatmap is then an indexed range query over the cells in view
+instead of a scan over every run's logs.
+"""
+from datetime import datetime
+
+from pymongo import ASCENDING, UpdateOne
+
+# Cell size in course units for each zoom level. Zoom 4 matches the 50-unit
+# grid used by the per-run heatmap in /analyze.
+ZOOM_CELL_SIZES = {
+    0: 800,
+    1: 400,
+    2: 200,
+    3: 100,
+    4: 50,
+    5: 25,
+}
+DEFAULT_ZOOM = 4
+
+
+def count_cells(logs, counts=None):
+    """Add the positions in `logs` to a {(zoom, gx, gy): count} dict."""
+    if counts is None:
+        counts = {}
+    for log in logs:
+        x = log.get("x")
+        y = log.get("y")
+        if x is None or y is None:
+            continue
+        for zoom, size in ZOOM_CELL_SIZES.items():
+            key = (zoom, int(x // size), int(y // size))
+            counts[key] = counts.get(key, 0) + 1
+    return counts
+
+
+def start_of_day(when):
+    return datetime(when.year, when.month, when.day)
+
+
+class FleetHeatmap:
+    """Multi-resolution position-frequency grids across all runs."""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self._indexed = False
+
+    def _ensure_indexes(self):
+        if not self._indexed:
+            self.collection.create_index([
+                ("zoom", ASCENDING), ("gx", ASCENDING), ("gy", ASCENDING),
+                ("robot_id", ASCENDING), ("day", ASCENDING)
+            ], unique=True)
+            self._indexed = True
+
+    def add_counts(self, robot_id, when, counts):
+        """Increment stored cells by a count_cells() result."""
+        if not counts:
+            return
+        self._ensure_indexes()
+        day = start_of_day(when)
+        self.collection.bulk_write([
+            UpdateOne(
+                {"zoom": zoom, "gx": gx, "gy": gy, "robot_id": robot_id, "day": day},
+                {"$inc": {"count": count}},
+                upsert=True
+            )
+            for (zoom, gx, gy), count in counts.items()
+        ], ordered=False)
+
+    def add_run(self, run):
+        """Add every position of a stored run."""
+        counts = count_cells(run.get("logs", []))
+        self.add_counts(run.get("robot_id", "unknown"), run.get("created_at") or datetime.utcnow(), counts)
+
+    def query(self, zoom=DEFAULT_ZOOM, bbox=None, robot_id=None, date_from=None, date_to=None):
+        """
+        Return the summed cells at `zoom` inside bbox (min_x, min_y, max_x, max_y),
+        optionally filtered by robot and by an inclusive day range.
+        """
+        size = ZOOM_CELL_SIZES[zoom]
+        match = {"zoom": zoom}
+        if bbox:
+            min_x, min_y, max_x, max_y = bbox
+            match["gx"] = {"$gte": int(min_x // size), "$lte": int(max_x // size)}
+            match["gy"] = {"$gte": int(min_y // size), "$lte": int(max_y // size)}
+        if robot_id:
+            match["robot_id"] = robot_id
+        if date_from or date_to:
+            match["day"] = {}
+            if date_from:
+                match["day"]["$gte"] = start_of_day(date_from)
+            if date_to:
+                match["day"]["$lte"] = start_of_day(date_to)
+
+        cells = []
+        for row in self.collection.aggregate([
+            {"$match": match},
+            {"$group": {"_id": {"gx": "$gx", "gy": "$gy"}, "count": {"$sum": "$count"}}},
+            {"$sort": {"count": -1}}
+        ]):
+            gx, gy = row["_id"]["gx"], row["_id"]["gy"]
+            cells.append({
+                "grid_x": gx,
+                "grid_y": gy,
+                "x": gx * size + size // 2,
+                "y": gy * size + size // 2,
+                "count": row["count"]
+            })
+        return cells
+
+    def rebuild(self, runs_collection):
+        """Recompute all cells from the stored runs (e.g. for runs ingested before the heatmap existed)."""
+        self.clear()
+        rebuilt = 0
+        for run in runs_collection.find({"live": {"$ne": True}, "ingesting": {"$ne": True}},
+                                        {"robot_id": 1, "created_at": 1, "logs.x": 1, "logs.y": 1}):
+            self.add_run(run)
+            rebuilt += 1
+        return rebuilt
+
+    def clear(self):
+        self.collection.delete_many({})
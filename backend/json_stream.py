@@ -0,0 +1,124 @@
+"""
+Incremental JSON reading for large request bodies.
+
+`request.get_json()` parses the whole body into memory at once. For EEPROM
+dumps with hundreds of thousands of samples that is several times the size of
+the dump, so /ingest reads the top-level object field by field instead and
+walks the `logs` array one entry at a time.
+"""
+import codecs
+import json
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\n\r"
+
+
+class StreamingJSONObject:
+    """Read a top-level JSON object from a binary stream without buffering it all."""
+
+    def __init__(self, stream, chunk_size=64 * 1024):
+        self._stream = stream
+        self._chunk_size = chunk_size
+        self._text = codecs.getincrementaldecoder("utf-8")()
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self, size=None):
+        """Read more bytes into the buffer. Returns False at end of stream."""
+        if self._eof:
+            return False
+        chunk = self._stream.read(size or self._chunk_size)
+        if not chunk:
+            self._eof = True
+            self._buf += self._text.decode(b"", final=True)
+            return False
+        self._buf = self._buf[self._pos:] + self._text.decode(chunk)
+        self._pos = 0
+        return True
+
+    def _peek(self):
+        """Skip whitespace and return the next character ('' at end of stream)."""
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in _WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return ""
+
+    def _expect(self, char):
+        found = self._peek()
+        if found != char:
+            raise ValueError(f"Invalid JSON: expected '{char}' but found '{found or 'end of body'}'")
+        self._pos += 1
+
+    def _value(self):
+        """Decode the next complete JSON value from the stream."""
+        self._peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError as e:
+                # Incomplete value: read at least as much again as is pending so
+                # a large value is re-scanned a logarithmic number of times.
+                if not self._fill(max(self._chunk_size, len(self._buf) - self._pos)):
+                    raise ValueError(f"Invalid JSON: {e.msg}") from None
+                continue
+            # A number at the very end of the buffer may continue in the next chunk
+            if end == len(self._buf) and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    def is_empty(self):
+        return self._peek() == ""
+
+    def _iter_array(self, key):
+        if self._peek() != "[":
+            raise ValueError(f"'{key}' must be a list")
+        self._pos += 1
+        if self._peek() == "]":
+            self._pos += 1
+            return
+        while True:
+            yield self._value()
+            char = self._peek()
+            self._pos += 1
+            if char == "]":
+                return
+            if char != ",":
+                raise ValueError(f"Invalid JSON: expected ',' or ']' in '{key}'")
+
+    def items(self, stream_keys=()):
+        """
+        Yield (key, value) pairs of the top-level object in document order.
+
+        For keys in `stream_keys` the value is a generator over the array's
+        elements instead of a list. Anything left unconsumed is skipped before
+        the next pair is read.
+        """
+        self._expect("{")
+        if self._peek() == "}":
+            self._pos += 1
+            return
+        while True:
+            key = self._value()
+            if not isinstance(key, str):
+                raise ValueError("Invalid JSON: object keys must be strings")
+            self._expect(":")
+            if key in stream_keys:
+                entries = self._iter_array(key)
+                yield key, entries
+                for _ in entries:
+                    pass
+            else:
+                yield key, self._value()
+            char = self._peek()
+            self._pos += 1
+            if char == "}":
+                break
+            if char != ",":
+                raise ValueError("Invalid JSON: expected ',' or '}' in object")
+        if self._peek() != "":
+            raise ValueError("Invalid JSON: trailing data after object")
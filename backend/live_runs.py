@@ -0,0 +1,86 @@
+"""
+Incremental analysis of live runs assembled from /telemetry.
+
+Between a robot's start and stop markers every telemetry reading is appended
+to an open run document. LiveRunStats keeps the running metrics (section
+times, checkpoint counts, speed stats) and updates them in O(1) per reading,
+so the partial analysis on the run is always current without reprocessing
+the logs. Its whole state is the `live_analysis` dict stored on the run; the
+fold depends on the previous reading, so the app reads it back and writes it
+with a version check for every reading rather than keeping it in memory.
+"""
+from decoders import SECTION_NAMES
+
+SECTION_IDS = {name: section_id for section_id, name in SECTION_NAMES.items()}
+
+
+def reading_section(sensors):
+    """(section_id, section_name) of a telemetry sensors dict."""
+    section_id = sensors.get("section_id", SECTION_IDS.get(sensors.get("zone"), 0))
+    return section_id, SECTION_NAMES.get(section_id, sensors.get("zone", "Unknown"))
+
+
+def reading_to_log(sensors, timestamp_ms):
+    """Convert a telemetry sensors dict into a stored (sensor/path format) log entry."""
+    section_id, section_name = reading_section(sensors)
+    log = {
+        "section_id": section_id,
+        "section_name": section_name,
+        "timestamp_ms": timestamp_ms,
+        "checkpoint_success": sensors.get("checkpoint_success", 0),
+        "ultrasonic_distance": sensors.get("ultrasonic_distance", sensors.get("ultrasonic_cm", 0)),
+        "claw_status": sensors.get("claw_status", 0),
+    }
+    if sensors.get("x") is not None and sensors.get("y") is not None:
+        log["x"] = sensors["x"]
+        log["y"] = sensors["y"]
+    return log
+
+
+class LiveRunStats:
+    def __init__(self, state=None):
+        self.state = state or {
+            "readings": 0,
+            "duration_ms": 0,
+            "section_sequence": [],
+            "section_times": {},
+            "checkpoint_hits": 0,
+            "checkpoint_misses": 0,
+            "checkpoint_rate": None,
+            "speed_stats": {"samples": 0, "avg": 0, "max": 0},
+            "last": None
+        }
+
+    def add(self, log):
+        """Fold one log entry into the running metrics and return the state."""
+        s = self.state
+        last = s["last"]
+        t = log["timestamp_ms"]
+        section = log["section_name"]
+
+        s["readings"] += 1
+        if log.get("checkpoint_success") == 1:
+            s["checkpoint_hits"] += 1
+        else:
+            s["checkpoint_misses"] += 1
+        s["checkpoint_rate"] = s["checkpoint_hits"] / s["readings"] * 100
+
+        if last is None or section != last["section"]:
+            s["section_sequence"].append(section)
+
+        if last is not None:
+            dt_ms = t - last["timestamp_ms"]
+            if dt_ms > 0:
+                # Time since the previous reading counts towards the section it was in
+                s["section_times"][last["section"]] = s["section_times"].get(last["section"], 0) + dt_ms
+                s["duration_ms"] += dt_ms
+                if "x" in log and last.get("x") is not None:
+                    distance = ((log["x"] - last["x"]) ** 2 + (log["y"] - last["y"]) ** 2) ** 0.5
+                    speed = distance / (dt_ms / 1000.0)
+                    stats = s["speed_stats"]
+                    stats["samples"] += 1
+                    stats["avg"] = round(stats["avg"] + (speed - stats["avg"]) / stats["samples"], 2)
+                    stats["max"] = round(max(stats["max"], speed), 2)
+
+        s["last"] = {"timestamp_ms": t, "section": section, "x": log.get("x"), "y": log.get("y")}
+        return s
@@ -0,0 +1,149 @@
+"""
+Seekable trajectory playback.
+
+A run's positions are cut into fixed time windows of PLAYBACK_CHUNK_MS at
+ingest and stored one document per window in the `playback_chunks`
+collection. Each chunk is columnar and compact - sample times as offsets from
+the chunk start, x/y rounded to 0.01, section ids - and carries a keyframe
+(the first sample's absolute time, position and section) so a player can
+start drawing from any chunk without the ones before it.
+
+Seeking to `t` is an indexed lookup of chunk t // PLAYBACK_CHUNK_MS (plus a
+neighbour on each side), so bandwidth follows what is viewed rather than the
+length of the run.
+
+A run without positions gets a single marker document (index
+EMPTY_RUN_INDEX, no samples) instead, so it isn't re-chunked on every request.
+"""
+from pymongo import ASCENDING
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+PLAYBACK_CHUNK_MS = 10000
+# Chunks returned on each side of the one containing ?t=
+PREFETCH_CHUNKS = 1
+# Upper bound on chunks returned for one ?from=&to= window
+MAX_CHUNKS_PER_REQUEST = 60
+# Index of the marker stored for a run with no positions
+EMPTY_RUN_INDEX = -1
+
+
+class ChunkBuilder:
+    """Turn position logs, fed in order with add(), into playback chunks."""
+
+    def __init__(self, chunk_ms=PLAYBACK_CHUNK_MS):
+        self.chunk_ms = chunk_ms
+        self._chunks = {}  # index -> chunk
+
+    def add(self, logs):
+        for log in logs:
+            x = log.get("x")
+            y = log.get("y")
+            if x is None or y is None:
+                continue
+            t = log.get("timestamp_ms", 0)
+            section_id = log.get("section_id", 0)
+            index = int(t // self.chunk_ms)
+            chunk = self._chunks.get(index)
+            if chunk is None:
+                chunk = self._chunks[index] = {
+                    "index": index,
+                    "start_ms": index * self.chunk_ms,
+                    "end_ms": (index + 1) * self.chunk_ms,
+                    "keyframe": {"t": t, "x": x, "y": y, "section_id": section_id},
+                    "t": [],
+                    "x": [],
+                    "y": [],
+                    "section_id": [],
+                    "samples": 0,
+                    "last_ms": t
+                }
+            chunk["samples"] += 1
+            chunk["last_ms"] = max(chunk["last_ms"], t)
+            chunk["t"].append(t - chunk["start_ms"])
+            chunk["x"].append(round(x, 2))
+            chunk["y"].append(round(y, 2))
+            chunk["section_id"].append(section_id)
+        return self
+
+    def finish(self):
+        """Chunks in time order."""
+        return [self._chunks[index] for index in sorted(self._chunks)]
+
+
+def chunk_summary(chunk):
+    """Keyframe index entry for a chunk (everything but the sample arrays)."""
+    return {key: chunk[key] for key in ("index", "start_ms", "end_ms", "last_ms", "samples", "keyframe")}
+
+
+class PlaybackStore:
+    """Playback chunks of every run, stored in MongoDB."""
+
+    def __init__(self, collection, chunk_ms=PLAYBACK_CHUNK_MS):
+        self.collection = collection
+        self.chunk_ms = chunk_ms
+        self._indexed = False
+
+    def _ensure_indexes(self):
+        if not self._indexed:
+            self.collection.create_index([("run_id", ASCENDING), ("index", ASCENDING)], unique=True)
+            self._indexed = True
+
+    def builder(self):
+        return ChunkBuilder(self.chunk_ms)
+
+    def add_run(self, run_id, chunks):
+        """Store the chunks produced by ChunkBuilder.finish() for one run (a marker if there are none)."""
+        self._ensure_indexes()
+        if not chunks:
+            self.collection.insert_one({"run_id": run_id, "index": EMPTY_RUN_INDEX, "samples": 0})
+            return
+        self.collection.insert_many([{**chunk, "run_id": run_id} for chunk in chunks], ordered=False)
+
+    def has_run(self, run_id):
+        return self.collection.find_one({"run_id": run_id}, {"_id": 1}) is not None
+
+    def keyframes(self, run_id):
+        """Keyframe index of a run: one summary per chunk, in time order."""
+        self._ensure_indexes()
+        cursor = self.collection.find(
+            {"run_id": run_id, "samples": {"$gt": 0}},
+            {"_id": 0, "index": 1, "start_ms": 1, "end_ms": 1, "last_ms": 1, "samples": 1, "keyframe": 1}
+        ).sort("index", ASCENDING)
+        return [chunk_summary(doc) for doc in cursor]
+
+    def chunks(self, run_id, first_index, last_index):
+        """Stored chunks with first_index <= index <= last_index."""
+        self._ensure_indexes()
+        cursor = self.collection.find(
+            {"run_id": run_id, "index": {"$gte": first_index, "$lte": last_index}, "samples": {"$gt": 0}},
+            {"_id": 0, "run_id": 0}
+        ).sort("index", ASCENDING)
+        return list(cursor)
+
+    def ensure_run(self, run_id, runs_collection):
+        """Chunk a stored run on first request if it was ingested before playback existed."""
+        if self.has_run(run_id):
+            return
+        run = runs_collection.find_one({"_id": run_id}, {"logs.x": 1, "logs.y": 1, "logs.timestamp_ms": 1, "logs.section_id": 1})
+        try:
+            self.add_run(run_id, self.builder().add(run.get("logs", []) if run else []).finish())
+        except (BulkWriteError, DuplicateKeyError):
+            pass  # Another request chunked it first
+
+    def delete_run(self, run_id):
+        self.collection.delete_many({"run_id": run_id})
+
+    def delete_runs(self, run_ids):
+        self.collection.delete_many({"run_id": {"$in": list(run_ids)}})
+
+    def rebuild(self, runs_collection):
+        """Re-chunk every stored run."""
+        self.clear()
+        rebuilt = 0
+        for run in runs_collection.find({"ingesting": {"$ne": True}}, {"logs.x": 1, "logs.y": 1, "logs.timestamp_ms": 1, "logs.section_id": 1}):
+            self.add_run(run["_id"], self.builder().add(run.get("logs", [])).finish())
+            rebuilt += 1
+        return rebuilt
+
+    def clear(self):
+        self.collection.delete_many({})
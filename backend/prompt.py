@@ -0,0 +1,155 @@
+"""
+Compact prompt construction for the LLM critique.
+
+The run is summarised as plain text lines - per-section stats, detected
+issues, anomaly windows and a downsampled list of key events - instead of
+raw log dicts. Optional parts are trimmed until the prompt fits a token
+budget. The output depends only on the run data, so the same run always
+produces the same prompt (and prompt_hash) and critiques can be cached.
+"""
+import hashlib
+import os
+
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", 800))
+
+# Rough tokens-per-character ratio for English/JSON-ish text (~4 chars/token)
+CHARS_PER_TOKEN = 4
+
+HEADER = """You are an expert robotics coach analyzing a competition run.
+Analyze this robot's performance and provide actionable feedback."""
+
+INSTRUCTIONS = """Please provide:
+1. A brief performance summary
+2. Identified issues (e.g., oscillation, stuck behavior, inefficient pathing)
+3. Specific recommendations with actionable fixes
+4. An overall score out of 10"""
+
+
+def estimate_tokens(text):
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def fmt_seconds(ms):
+    return f"{ms / 1000:.1f}s"
+
+
+def downsample_events(events, count):
+    """Keep `count` events evenly spread over the run, always keeping the first and last."""
+    if count <= 0:
+        return []
+    if len(events) <= count:
+        return list(events)
+    if count == 1:
+        return [events[0]]
+    step = (len(events) - 1) / (count - 1)
+    return [events[round(i * step)] for i in range(count)]
+
+
+def section_stats(logs):
+    """Per-section sample count, checkpoint rate and closest obstacle (sensor/path logs)."""
+    stats = {}
+    for log in logs:
+        name = log.get("section_name")
+        if name is None:
+            continue
+        s = stats.setdefault(name, {"samples": 0, "hits": 0, "min_ultrasonic": None})
+        s["samples"] += 1
+        if log.get("checkpoint_success") == 1:
+            s["hits"] += 1
+        ultrasonic = log.get("ultrasonic_distance")
+        if ultrasonic is not None and (s["min_ultrasonic"] is None or ultrasonic < s["min_ultrasonic"]):
+            s["min_ultrasonic"] = ultrasonic
+    return stats
+
+
+def summary_lines(logs, analysis):
+    lines = [f"- Samples: {len(logs)}"]
+    if logs:
+        lines.append(f"- Duration: {fmt_seconds(logs[-1].get('timestamp_ms', 0))}")
+    sequence = analysis.get("section_sequence") or []
+    lines.append(f"- Section sequence: {' > '.join(sequence) if sequence else 'none recorded'}")
+    if analysis.get("checkpoint_rate") is not None:
+        lines.append(f"- Checkpoint rate: {analysis['checkpoint_rate']:.1f}%")
+    accel = analysis.get("acceleration_stats")
+    if accel:
+        lines.append(f"- Acceleration: min {accel['min']}, max {accel['max']}, jerky samples {accel['jerky_count']}")
+    return lines
+
+
+def section_lines(logs, analysis):
+    stats = section_stats(logs)
+    lines = []
+    for name in sorted(analysis.get("section_times", {})):
+        line = f"- {name}: {fmt_seconds(analysis['section_times'][name])}"
+        s = stats.get(name)
+        if s:
+            line += f", {s['samples']} samples, checkpoints {s['hits'] / s['samples'] * 100:.0f}%"
+            if s["min_ultrasonic"] is not None:
+                line += f", closest obstacle {s['min_ultrasonic']}cm"
+        lines.append(line)
+    return lines
+
+
+def anomaly_lines(episodes):
+    lines = []
+    for episode in sorted(episodes, key=lambda e: e["start_time"]):
+        lines.append(
+            f"- Stuck {fmt_seconds(episode['start_time'])}-"
+            f"{fmt_seconds(episode['start_time'] + episode['duration_ms'])} "
+            f"in {episode.get('section') or 'unknown'} at ({round(episode['x'])}, {round(episode['y'])})"
+        )
+    return lines
+
+
+def event_lines(analysis):
+    return [f"- {fmt_seconds(e['time_ms'])} {e['event']}" for e in analysis.get("timeline", [])]
+
+
+def render(summary, sections, issues, anomalies, events):
+    parts = [HEADER, "", "Run Summary:", *summary]
+    if sections:
+        parts += ["", "Time per Section:", *sections]
+    parts += ["", "Detected Issues:", *([f"- {i}" for i in issues] or ["- None detected"])]
+    if anomalies:
+        parts += ["", "Anomaly Windows:", *anomalies]
+    if events:
+        parts += ["", "Key Events:", *events]
+    parts += ["", INSTRUCTIONS]
+    return "\n".join(parts)
+
+
+def build_critique_prompt(logs, analysis, budget=None):
+    """
+    Build the critique prompt for a run from its logs and deterministic
+    analysis. Returns (prompt, estimated_tokens). Key events and then
+    anomaly windows are thinned out until the prompt fits `budget` tokens.
+    """
+    budget = budget or PROMPT_TOKEN_BUDGET
+    summary = summary_lines(logs, analysis)
+    sections = section_lines(logs, analysis)
+    issues = list(analysis.get("issues", []))
+    # Longest stuck episodes are kept first when trimming
+    episodes = sorted(analysis.get("stuck_events", []), key=lambda e: (-e["duration_ms"], e["start_time"]))
+    all_events = event_lines(analysis)
+
+    episode_count = len(episodes)
+    event_count = len(all_events)
+    while True:
+        anomalies = anomaly_lines(episodes[:episode_count])
+        events = downsample_events(all_events, event_count)
+        prompt = render(summary, sections, issues, anomalies, events)
+        tokens = estimate_tokens(prompt)
+        if tokens <= budget:
+            break
+        if event_count > 0:
+            event_count = min(event_count - 1, event_count * 3 // 4)
+        elif episode_count > 0:
+            episode_count //= 2
+        else:
+            break  # Only required parts left
+    return prompt, tokens
+
+
+def prompt_hash(prompt):
+    """Stable identifier for a prompt, usable as a cache key."""
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16]
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+Bulk re-analysis of stored runs.
+
+Finds runs whose stored analysis is missing or stale (made by another
+ANALYSIS_VERSION or with other thresholds, see analysis.py) and re-analyzes
+them as a resumable job. Deterministic metrics and prompts are
+computed on a process pool; LLM critiques go through a rate-limited thread
+pool. Each run's outcome is checkpointed on the job document in the
+`analysis_jobs` collection as soon as it finishes, so an interrupted job can
+be resumed and only redoes runs that have not completed.
+
+A job is claimed atomically before it runs: the claimer becomes its `owner`
+and holds a lease (`lease_until`) that a heartbeat renews every third of
+JOB_LEASE_SECONDS. A job is only claimable when it isn't running or its
+lease has expired, so two workers never run it at once, and one left
+"running" by a crashed process can be resumed once the lease runs out.
+
+Usage:
+  python reanalyze.py                      - analyze runs without a current analysis
+  python reanalyze.py --since 2026-03-01   - also redo runs analyzed before a date
+  python reanalyze.py --resume <job_id>    - continue an interrupted job
+"""
+import argparse
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+
+from pymongo import ReturnDocument
+
+from analysis import current_analysis_query, is_analysis_current, precomputed_base, prepare_analysis
+
+DEFAULT_LLM_WORKERS = 4
+DEFAULT_LLM_RATE = 2.0  # Critique requests per second
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", 60))
+
+
+class JobRunning(Exception):
+    """The job is held by another worker whose lease hasn't expired."""
+
+
+class RateLimiter:
+    """Space calls at least 1/rate seconds apart across threads."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def find_stale_runs(runs_collection, since=None):
+    """Ids of completed runs that need (re-)analysis, oldest first."""
+    query = {"$nor": [current_analysis_query()]}
+    if since:
+        query = {"$or": [query, {"analyzed_at": {"$lt": since}}]}
+    query = {"$and": [query, {"live": {"$ne": True}}, {"ingesting": {"$ne": True}}]}
+    return [run["_id"] for run in runs_collection.find(query, {"_id": 1}).sort("created_at", 1)]
+
+
+def analyzed_before(run, since):
+    """Whether the run was analyzed before `since` (the cutoff of a --since job; None for no cutoff)."""
+    analyzed_at = run.get("analyzed_at")
+    return since is not None and analyzed_at is not None and analyzed_at < since
+
+
+def create_job(jobs_collection, run_ids, options=None):
+    now = datetime.utcnow()
+    result = jobs_collection.insert_one({
+        "status": "pending",
+        "run_ids": run_ids,
+        "results": {},
+        "options": options or {},
+        "created_at": now,
+        "updated_at": now
+    })
+    return result.inserted_id
+
+
+def new_owner():
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def claim_job(jobs_collection, job_id, owner, lease_seconds=JOB_LEASE_SECONDS):
+    """
+    Mark the job running under `owner` if it isn't running or its lease has
+    expired. Returns the job document, or None if someone else holds it.
+    """
+    now = datetime.utcnow()
+    return jobs_collection.find_one_and_update(
+        {"_id": job_id, "$or": [
+            {"status": {"$ne": "running"}},
+            {"lease_until": {"$lt": now}},
+            {"lease_until": {"$exists": False}},  # Left running before jobs had leases
+        ]},
+        {"$set": {"status": "running", "owner": owner, "lease_until": now + timedelta(seconds=lease_seconds),
+                  "updated_at": now}},
+        return_document=ReturnDocument.AFTER
+    )
+
+
+class Lease(threading.Thread):
+    """Renews a claimed job's lease until stopped; sets `lost` if another owner took the job over."""
+
+    def __init__(self, jobs_collection, job_id, owner, seconds=JOB_LEASE_SECONDS):
+        super().__init__(daemon=True)
+        self.jobs = jobs_collection
+        self.job_id = job_id
+        self.owner = owner
+        self.seconds = seconds
+        self.stopped = threading.Event()
+        self.lost = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.seconds / 3):
+            renewed = self.jobs.update_one(
+                {"_id": self.job_id, "owner": self.owner},
+                {"$set": {"lease_until": datetime.utcnow() + timedelta(seconds=self.seconds)}}
+            )
+            if not renewed.matched_count:
+                self.lost.set()
+                return
+
+
+def job_status(job):
+    """JSON-serializable progress report for a job document."""
+    results = job.get("results", {})
+    done = sum(1 for r in results.values() if r["status"] in ("done", "skipped"))
+    skipped = sum(1 for r in results.values() if r["status"] == "skipped")
+    failed = sum(1 for r in results.values() if r["status"] == "error")
+    return {
+        "job_id": str(job["_id"]),
+        "status": job["status"],
+        "total": len(job["run_ids"]),
+        "done": done,
+        "skipped": skipped,
+        "failed": failed,
+        "pending": len(job["run_ids"]) - done - failed,
+        "results": results,
+        "owner": job.get("owner"),
+        "lease_until": job["lease_until"].isoformat() if job.get("lease_until") else None,
+        "created_at": job["created_at"].isoformat(),
+        "updated_at": job["updated_at"].isoformat()
+    }
+
+
+def run_job(job_id, runs_collection, jobs_collection, request_critique, save_analysis,
+            workers=None, llm_workers=DEFAULT_LLM_WORKERS, llm_rate=DEFAULT_LLM_RATE, on_progress=None,
+            owner=None):
+    """
+    Process every run of a job that hasn't completed yet (runs that failed
+    before are retried). Runs whose analysis became current in the meantime
+    (and, for a job created with `since`, was made at or after it) are
+    skipped without spending CPU or LLM time. `request_critique(prompt)` and
+    `save_analysis(run_id, analysis)` are the same functions /analyze uses.
+    Pass the `owner` a job was already claimed with; otherwise it is claimed
+    here, raising JobRunning if another worker holds it.
+    """
+    if owner is None:
+        owner = new_owner()
+        if claim_job(jobs_collection, job_id, owner) is None:
+            raise JobRunning(f"Job {job_id} is already running")
+    job = jobs_collection.find_one({"_id": job_id})
+    since = job.get("options", {}).get("since")
+    results = job.get("results", {})
+    pending = [rid for rid in job["run_ids"] if results.get(str(rid), {}).get("status") not in ("done", "skipped")]
+    workers = workers or os.cpu_count() or 1
+    limiter = RateLimiter(llm_rate)
+
+    def set_status(status):
+        # Only while we still hold the job; the lease is released so it can be resumed at once
+        jobs_collection.update_one({"_id": job_id, "owner": owner},
+                                   {"$set": {"status": status, "updated_at": datetime.utcnow()},
+                                    "$unset": {"lease_until": ""}})
+
+    def record(run_id, status, error=None):
+        result = {"status": status, "finished_at": datetime.utcnow().isoformat()}
+        if error:
+            result["error"] = error
+        jobs_collection.update_one({"_id": job_id}, {"$set": {
+            f"results.{run_id}": result,
+            "updated_at": datetime.utcnow()
+        }})
+        if on_progress:
+            on_progress(run_id, status, error)
+
+    def critique_and_save(run_id, base_analysis, prompt):
+        try:
+            limiter.wait()
+            save_analysis(run_id, {**base_analysis, **request_critique(prompt)})
+            record(run_id, "done")
+        except Exception as e:
+            record(run_id, "error", str(e))
+
+    # Imported here: it pulls in multiprocessing, which the API doesn't need until a job runs
+    from concurrent.futures import ProcessPoolExecutor
+
+    lease = Lease(jobs_collection, job_id, owner)
+    lease.start()
+    try:
+        with ProcessPoolExecutor(workers) as cpu_pool, ThreadPoolExecutor(llm_workers) as llm_pool:
+            queue = iter(pending)
+            in_flight = {}
+
+            def submit_next():
+                # Logs are loaded just in time so only a few runs are in memory at once
+                for run_id in queue:
+                    if lease.lost.is_set():
+                        return  # Another worker took the job over; let it continue
+                    run = runs_collection.find_one({"_id": run_id}, {"analysis": 0})
+                    if not run or not run.get("logs"):
+                        record(run_id, "error", "Run not found" if not run else "No logs to analyze")
+                        continue
+                    if is_analysis_current(run) and not analyzed_before(run, since):
+                        record(run_id, "skipped")
+                        continue
+                    in_flight[cpu_pool.submit(prepare_analysis, run["logs"], precomputed_base(run))] = run_id
+                    return
+
+            for _ in range(workers * 2):
+                submit_next()
+
+            while in_flight:
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    run_id = in_flight.pop(future)
+                    try:
+                        base_analysis, prompt = future.result()
+                        llm_pool.submit(critique_and_save, run_id, base_analysis, prompt)
+                    except Exception as e:
+                        record(run_id, "error", str(e))
+                    submit_next()
+    except BaseException:
+        set_status("interrupted")
+        raise
+    finally:
+        lease.stopped.set()
+
+    set_status("completed")  # A no-op if the lease was lost
+    return job_status(jobs_collection.find_one({"_id": job_id}))
+
+
+if __name__ == "__main__":
+    from bson import ObjectId
+
+    import app
+
+    parser = argparse.ArgumentParser(description="Re-analyze unanalyzed or stale runs.")
+    parser.add_argument("--since", type=datetime.fromisoformat,
+                        help="also re-analyze runs analyzed before this ISO date")
+    parser.add_argument("--resume", metavar="JOB_ID", help="continue an interrupted job")
+    parser.add_argument("--workers", type=int, help="processes for metric computation (default: CPU count)")
+    parser.add_argument("--llm-workers", type=int, default=DEFAULT_LLM_WORKERS)
+    parser.add_argument("--llm-rate", type=float, default=DEFAULT_LLM_RATE, help="max critique requests per second")
+    args = parser.parse_args()
+
+    if args.resume:
+        job_id = ObjectId(args.resume)
+    else:
+        run_ids = find_stale_runs(app.runs_collection, args.since)
+        if not run_ids:
+            print("No runs need analysis.")
+            raise SystemExit(0)
+        job_id = create_job(app.analysis_jobs_collection, run_ids, {"since": args.since})
+    print(f"Job {job_id}")
+
+    counter = {"n": 0}
+
+    def print_progress(run_id, status, error):
+        counter["n"] += 1
+        print(f"  [{counter['n']:4}] {run_id}: {status}{f' - {error}' if error else ''}")
+
+    try:
+        summary = run_job(job_id, app.runs_collection, app.analysis_jobs_collection,
+                          app.request_critique, app.save_analysis,
+                          args.workers, args.llm_workers, args.llm_rate, print_progress)
+    except JobRunning as e:
+        print(f"{e}; try again once its lease ({JOB_LEASE_SECONDS:g}s) has expired.")
+        raise SystemExit(1)
+    except KeyboardInterrupt:
+        print(f"\nInterrupted. Resume with: python reanalyze.py --resume {job_id}")
+        raise SystemExit(1)
+    print(f"Done: {summary['done'] - summary['skipped']} analyzed, {summary['skipped']} already current, "
+          f"{summary['failed']} failed, {summary['pending']} pending")
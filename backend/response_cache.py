@@ -0,0 +1,155 @@
+"""
+Read-through cache of serialized run responses.
+
+Run detail and path responses are rebuilt from the full run document (logs
+included) on every request, though a run only changes when it is analyzed,
+appended to live, or deleted. Those writes bump the run's `cache_version`
+field, and cache keys are (kind, run_id, cache_version, variant): a request
+first reads just that field - an _id lookup that doesn't ship the logs - and
+serves the stored bytes if a response for that version exists. Because the
+version lives on the run, a write from another worker process or from
+reanalyze.py is seen immediately; invalidate() only frees the memory early.
+
+Entries are kept in process in an LRU bounded by RESPONSE_CACHE_BYTES of
+response bodies. With RESPONSE_CACHE_URL set, responses are also shared
+between worker processes through redis://... (needs the redis package) or
+local:// (an in-process stand-in with the same interface, for tests).
+"""
+import os
+import threading
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+RESPONSE_CACHE_BYTES = int(os.getenv("RESPONSE_CACHE_BYTES", 64 * 1024 * 1024))
+RESPONSE_CACHE_URL = os.getenv("RESPONSE_CACHE_URL")
+# Shared entries of superseded versions are never read again; let them expire
+SHARED_TTL_SECONDS = int(os.getenv("RESPONSE_CACHE_SHARED_TTL", 3600))
+SHARED_PREFIX = "utra:response:"
+
+
+class LocalSharedStore:
+    """Stand-in for the Redis subset the cache uses (get / set with ex), held in memory."""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            return self._data.get(key)
+
+    def set(self, key, value, ex=None):
+        with self._lock:
+            self._data[key] = value
+        return True
+
+
+_local_shared_store = LocalSharedStore()
+
+
+def shared_store(url):
+    """Shared backend for a RESPONSE_CACHE_URL, or None."""
+    if not url:
+        return None
+    if url.startswith("local://"):
+        return _local_shared_store
+    if redis is None:
+        raise RuntimeError("RESPONSE_CACHE_URL needs the redis package (pip install redis)")
+    return redis.Redis.from_url(url)
+
+
+class ResponseCache:
+    def __init__(self, max_bytes=RESPONSE_CACHE_BYTES, shared=None):
+        self.max_bytes = max_bytes
+        self.shared = shared
+        self._entries = OrderedDict()  # key -> body, least recently used first
+        self._run_keys = {}  # run_id -> keys, for invalidate()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(kind, run_id, version, variant=""):
+        return f"{kind}:{run_id}:{version}:{variant}"
+
+    def get(self, key):
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return body
+        if self.shared is not None:
+            body = self.shared.get(SHARED_PREFIX + key)
+            if body is not None:
+                self._store(key, body)
+                with self._lock:
+                    self.shared_hits += 1
+                return body
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, body):
+        self._store(key, body)
+        if self.shared is not None:
+            self.shared.set(SHARED_PREFIX + key, body, ex=SHARED_TTL_SECONDS)
+
+    def _store(self, key, body):
+        if len(body) > self.max_bytes:
+            return
+        run_id = key.split(":", 2)[1]
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._entries[key] = body
+            self._bytes += len(body)
+            self._run_keys.setdefault(run_id, set()).add(key)
+            while self._bytes > self.max_bytes:
+                self._evict(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _evict(self, key):
+        body = self._entries.pop(key)
+        self._bytes -= len(body)
+        run_id = key.split(":", 2)[1]
+        keys = self._run_keys.get(run_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._run_keys[run_id]
+
+    def invalidate(self, run_id):
+        """Drop this process's entries for a run (older versions can no longer be hit anyway)."""
+        with self._lock:
+            for key in list(self._run_keys.get(str(run_id), ())):
+                self._evict(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._run_keys.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits + self.shared_hits) / lookups if lookups else 0.0,
+                "shared": self.shared is not None,
+            }
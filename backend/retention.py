@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+Background purges and retention policies.
+
+Deleting everything in one delete_many() holds the request (and the
+collection) for as long as MongoDB takes to remove every run and its logs.
+Purges instead run as jobs in the `purge_jobs` collection: documents are
+deleted PURGE_CHUNK_SIZE at a time by _id, with a PURGE_PAUSE_SECONDS pause
+between chunks so ingest and reads keep getting through, and the job
+document records progress after every chunk.
+
+Two kinds of job:
+- clear: every run that existed when the job started (runs ingested while
+  it runs are kept), and the derived indexes
+- retention: runs beyond the newest `keep_runs_per_robot` of each robot
+  (open live runs are never touched) and telemetry older than
+  `telemetry_days`
+
+With an archive directory set, each chunk is appended to gzip NDJSON files
+before it is deleted: runs-<job>.ndjson.gz in the /ingest format, but
+with the stored (normalized) logs plus created_at and data_format, which
+bulk_load.py loads back unchanged, and telemetry-<job>.ndjson.gz.
+
+Usage:
+  python retention.py                                  - apply the configured policy
+  python retention.py --keep-runs 50 --telemetry-days 14 --archive /backups
+  python retention.py --clear                          - delete every run
+"""
+import argparse
+import gzip
+import json
+import os
+import time
+from datetime import datetime, timedelta
+
+from pymongo import ASCENDING, DESCENDING
+
+
+def optional_int(value):
+    return int(value) if value not in (None, "") else None
+
+
+PURGE_CHUNK_SIZE = int(os.getenv("PURGE_CHUNK_SIZE", 500))
+PURGE_PAUSE_SECONDS = float(os.getenv("PURGE_PAUSE_SECONDS", 0.2))
+# Unset = keep everything
+KEEP_RUNS_PER_ROBOT = optional_int(os.getenv("KEEP_RUNS_PER_ROBOT"))
+TELEMETRY_RETENTION_DAYS = optional_int(os.getenv("TELEMETRY_RETENTION_DAYS"))
+RETENTION_ARCHIVE_DIR = os.getenv("RETENTION_ARCHIVE_DIR")
+
+CLEAR = "clear"
+RETENTION = "retention"
+# Runs still receiving telemetry
+OPEN_LIVE_RUN = {"live": True, "completed_at": {"$exists": False}}
+
+
+def default_policy():
+    return {
+        "keep_runs_per_robot": KEEP_RUNS_PER_ROBOT,
+        "telemetry_days": TELEMETRY_RETENTION_DAYS,
+        "archive_dir": RETENTION_ARCHIVE_DIR,
+    }
+
+
+def parse_policy(data):
+    """Retention policy from a request body, defaulting to the environment. Raises ValueError."""
+    policy = default_policy()
+    for key in ("keep_runs_per_robot", "telemetry_days"):
+        if key in data:
+            value = data[key]
+            if value is not None and (not isinstance(value, int) or isinstance(value, bool) or value < 0):
+                raise ValueError(f"{key} must be a non-negative integer or null")
+            policy[key] = value
+    if "archive" in data:
+        if data["archive"] and not RETENTION_ARCHIVE_DIR:
+            raise ValueError("archive needs RETENTION_ARCHIVE_DIR to be set")
+        policy["archive_dir"] = RETENTION_ARCHIVE_DIR if data["archive"] else None
+    return policy
+
+
+def newest_run_id(runs_collection):
+    newest = runs_collection.find_one({}, {"_id": 1}, sort=[("_id", DESCENDING)])
+    return newest["_id"] if newest else None
+
+
+def create_purge_job(jobs_collection, kind, policy=None, runs_collection=None):
+    """
+    Insert a pending job. A clear job is bounded by the newest run id in
+    `runs_collection` now, so runs uploaded after the request are kept.
+    """
+    now = datetime.utcnow()
+    fields = {"up_to_id": newest_run_id(runs_collection)} if kind == CLEAR and runs_collection is not None else {}
+    result = jobs_collection.insert_one({
+        **fields,
+        "kind": kind,
+        "status": "pending",
+        "policy": policy or {},
+        "deleted": {"runs": 0, "telemetry": 0},
+        "archives": [],
+        "created_at": now,
+        "updated_at": now
+    })
+    return result.inserted_id
+
+
+def purge_job_status(job):
+    """JSON-serializable progress report for a purge job document."""
+    return {
+        "job_id": str(job["_id"]),
+        "kind": job["kind"],
+        "status": job["status"],
+        "policy": job.get("policy", {}),
+        "deleted": job.get("deleted", {}),
+        "archives": job.get("archives", []),
+        "error": job.get("error"),
+        "created_at": job["created_at"].isoformat(),
+        "updated_at": job["updated_at"].isoformat()
+    }
+
+
+def json_default(value):
+    return value.isoformat() if isinstance(value, datetime) else str(value)
+
+
+class Archive:
+    """Gzip NDJSON file that chunks are appended to; created on first write."""
+
+    def __init__(self, directory, name):
+        self.path = os.path.join(directory, name)
+        self.written = 0
+
+    def write(self, records):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with gzip.open(self.path, "at", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, default=json_default) + "\n")
+        self.written += len(records)
+
+
+def run_record(run):
+    """A stored run in the format bulk_load.py reads (its logs are already normalized)."""
+    record = {key: run[key] for key in ("robot_id", "run_number", "logs", "events", "segments", "metadata", "data_format")
+              if key in run}
+    record["created_at"] = run.get("created_at")
+    record["run_id"] = run["_id"]
+    return record
+
+
+def telemetry_record(doc):
+    return {key: doc.get(key) for key in ("robot_id", "run_id", "timestamp", "sensors")}
+
+
+class PurgeJob:
+    """
+    Runs one purge job. `on_runs_deleted(run_ids)` is called after each chunk
+    of runs is deleted so derived data can follow; `on_cleared(up_to_id)`
+    after a clear job has deleted every run with _id <= up_to_id.
+    """
+
+    def __init__(self, job_id, jobs_collection, runs_collection, telemetry_collection,
+                 on_runs_deleted=None, on_cleared=None, chunk_size=PURGE_CHUNK_SIZE,
+                 pause=PURGE_PAUSE_SECONDS, on_progress=None):
+        self.job_id = job_id
+        self.jobs = jobs_collection
+        self.runs = runs_collection
+        self.telemetry = telemetry_collection
+        self.on_runs_deleted = on_runs_deleted
+        self.on_cleared = on_cleared
+        self.chunk_size = chunk_size
+        self.pause = pause
+        self.on_progress = on_progress
+        self.archives = {}
+
+    def set_status(self, status, **fields):
+        self.jobs.update_one({"_id": self.job_id},
+                             {"$set": {"status": status, "updated_at": datetime.utcnow(), **fields}})
+
+    def record(self, target, count):
+        self.jobs.update_one({"_id": self.job_id},
+                             {"$inc": {f"deleted.{target}": count}, "$set": {"updated_at": datetime.utcnow()}})
+        if self.on_progress:
+            self.on_progress(target, count)
+
+    def archive(self, target, records, archive_dir):
+        if not archive_dir:
+            return
+        archive = self.archives.get(target)
+        if archive is None:
+            archive = self.archives[target] = Archive(archive_dir, f"{target}-{self.job_id}.ndjson.gz")
+            self.jobs.update_one({"_id": self.job_id}, {"$addToSet": {"archives": archive.path}})
+        archive.write(records)
+
+    def purge(self, target, collection, next_chunk, to_record, archive_dir):
+        """Delete chunks returned by next_chunk(projection, limit) until it comes back empty."""
+        projection = None if archive_dir else {"_id": 1}
+        while True:
+            docs = next_chunk(projection, self.chunk_size)
+            if not docs:
+                return
+            self.archive(target, [to_record(doc) for doc in docs], archive_dir)
+            ids = [doc["_id"] for doc in docs]
+            deleted = collection.delete_many({"_id": {"$in": ids}}).deleted_count
+            if target == "runs" and self.on_runs_deleted:
+                self.on_runs_deleted(ids)
+            self.record(target, deleted)
+            if self.pause:
+                time.sleep(self.pause)
+
+    def clear_runs(self, job, archive_dir):
+        # Only runs that existed when the clear was requested; new uploads may arrive meanwhile
+        if "up_to_id" in job:
+            up_to_id = job["up_to_id"]
+        else:
+            up_to_id = newest_run_id(self.runs)
+            self.jobs.update_one({"_id": self.job_id}, {"$set": {"up_to_id": up_to_id}})
+
+        def next_chunk(projection, limit):
+            query = {"_id": {"$lte": up_to_id}}
+            return list(self.runs.find(query, projection).sort("_id", ASCENDING).limit(limit))
+
+        if up_to_id is not None:
+            self.purge("runs", self.runs, next_chunk, run_record, archive_dir)
+        if self.on_cleared:
+            self.on_cleared(up_to_id)
+
+    def expire_runs(self, keep, archive_dir):
+        self.runs.create_index([("robot_id", ASCENDING), ("created_at", DESCENDING)])
+        for robot_id in self.runs.distinct("robot_id"):
+            query = {"robot_id": robot_id, "$nor": [OPEN_LIVE_RUN]}
+
+            def next_chunk(projection, limit, query=query):
+                # The newest `keep` runs are skipped every time, so each pass gets the next oldest
+                cursor = self.runs.find(query, projection).sort([("created_at", DESCENDING), ("_id", DESCENDING)])
+                return list(cursor.skip(keep).limit(limit))
+
+            self.purge("runs", self.runs, next_chunk, run_record, archive_dir)
+
+    def expire_telemetry(self, days, archive_dir):
+        self.telemetry.create_index([("timestamp", ASCENDING)])
+        cutoff = datetime.utcnow() - timedelta(days=days)
+
+        def next_chunk(projection, limit):
+            return list(self.telemetry.find({"timestamp": {"$lt": cutoff}}, projection).limit(limit))
+
+        self.purge("telemetry", self.telemetry, next_chunk, telemetry_record, archive_dir)
+
+    def run(self):
+        job = self.jobs.find_one({"_id": self.job_id})
+        policy = job.get("policy", {})
+        archive_dir = policy.get("archive_dir")
+        self.set_status("running")
+        try:
+            if job["kind"] == CLEAR:
+                self.clear_runs(job, archive_dir)
+            else:
+                if policy.get("keep_runs_per_robot") is not None:
+                    self.expire_runs(policy["keep_runs_per_robot"], archive_dir)
+                if policy.get("telemetry_days") is not None:
+                    self.expire_telemetry(policy["telemetry_days"], archive_dir)
+        except BaseException as e:
+            self.set_status("failed" if isinstance(e, Exception) else "interrupted", error=str(e))
+            raise
+        self.set_status("completed")
+        return purge_job_status(self.jobs.find_one({"_id": self.job_id}))
+
+
+if __name__ == "__main__":
+    import app
+
+    parser = argparse.ArgumentParser(description="Apply run and telemetry retention, or delete every run.")
+    parser.add_argument("--clear", action="store_true", help="delete every run instead")
+    parser.add_argument("--keep-runs", type=int, default=KEEP_RUNS_PER_ROBOT, help="runs to keep per robot")
+    parser.add_argument("--telemetry-days", type=int, default=TELEMETRY_RETENTION_DAYS,
+                        help="delete telemetry older than this")
+    parser.add_argument("--archive", default=RETENTION_ARCHIVE_DIR, metavar="DIR",
+                        help="write deleted documents to gzip NDJSON files here first")
+    parser.add_argument("--chunk-size", type=int, default=PURGE_CHUNK_SIZE)
+    parser.add_argument("--pause", type=float, default=PURGE_PAUSE_SECONDS, help="seconds between chunks")
+    args = parser.parse_args()
+
+    if args.clear:
+        kind, policy = CLEAR, {"archive_dir": args.archive}
+    else:
+        if args.keep_runs is None and args.telemetry_days is None:
+            print("No retention configured (set --keep-runs and/or --telemetry-days).")
+            raise SystemExit(0)
+        kind = RETENTION
+        policy = {"keep_runs_per_robot": args.keep_runs, "telemetry_days": args.telemetry_days,
+                  "archive_dir": args.archive}
+    job_id = create_purge_job(app.purge_jobs_collection, kind, policy, app.runs_collection)
+    print(f"Job {job_id}")
+
+    try:
+        summary = app.purge_job(job_id, args.chunk_size, args.pause,
+                                on_progress=lambda target, count: print(f"  deleted {count} {target}"))
+    except KeyboardInterrupt:
+        print("\nInterrupted. Run again to continue; deleted chunks stay deleted.")
+        raise SystemExit(1)
+    print(f"Done: {summary['deleted']['runs']} runs, {summary['deleted']['telemetry']} telemetry readings deleted")
+    for path in summary["archives"]:
+        print(f"  archived to {path}")
@@ -0,0 +1,117 @@
+"""
+Indexed metric summaries of analyzed runs.
+
+The analysis is a large nested document, so its headline metrics are copied
+to top-level fields of the run when it is saved (SUMMARY_FIELDS). Every sort
+field has an index (field, _id) and one (robot_id, field, _id), and /runs
+breaks ties on _id in the direction of the last sort key, so filters on
+ranges (?min_score=7&max_stuck_time_ms=5000) and sorts
+(?sort=-checkpoint_rate) are answered from an index in either direction
+instead of loading analyses.
+"""
+import re
+
+from pymongo import ASCENDING, DESCENDING
+
+SUMMARY_FIELDS = ("score", "checkpoint_rate", "duration_ms", "stuck_time_ms")
+SORT_FIELDS = SUMMARY_FIELDS + ("created_at", "run_number")
+DEFAULT_SORT = [("created_at", DESCENDING)]
+
+# "Score: 7/10", "7.5 out of 10", "Overall score - 8"
+SCORE_PATTERNS = (
+    re.compile(r"(\d+(?:\.\d+)?)\s*(?:/|out of)\s*10\b", re.IGNORECASE),
+    re.compile(r"score\W{0,5}(\d+(?:\.\d+)?)", re.IGNORECASE),
+)
+
+
+def parse_score(text):
+    """Score out of 10 mentioned in a critique, or None."""
+    if not isinstance(text, str):
+        return None
+    for pattern in SCORE_PATTERNS:
+        match = pattern.search(text)
+        if match and float(match.group(1)) <= 10:
+            return float(match.group(1))
+    return None
+
+
+def number(value):
+    return value if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+
+def run_summary(analysis):
+    """Top-level summary fields for a run with this analysis (None where unknown)."""
+    analysis = analysis or {}
+    score = None
+    if not analysis.get("mock"):  # A mock critique's score is a placeholder
+        score = number(analysis.get("score"))
+        if score is None:
+            score = parse_score(analysis.get("summary"))
+    times = [event.get("time_ms") for event in analysis.get("timeline") or [] if number(event.get("time_ms")) is not None]
+    stuck = analysis.get("stuck_frequency") or {}
+    return {
+        "score": score,
+        "checkpoint_rate": number(analysis.get("checkpoint_rate")),
+        "duration_ms": max(times) if times else None,
+        "stuck_time_ms": number(stuck.get("total_stuck_time_ms")),
+    }
+
+
+def parse_run_filters(args):
+    """
+    (query, sort) for /runs from min_<field> / max_<field> and sort=[-]field[,...].
+    Sorting on a metric skips runs that don't have it. Raises ValueError.
+    """
+    query = {}
+    for field in SUMMARY_FIELDS:
+        bounds = {}
+        for prefix, operator in (("min_", "$gte"), ("max_", "$lte")):
+            value = args.get(prefix + field)
+            if value not in (None, ""):
+                try:
+                    bounds[operator] = float(value)
+                except ValueError:
+                    raise ValueError(f"{prefix}{field} must be a number")
+        if bounds:
+            query[field] = bounds
+
+    sort = []
+    for key in filter(None, (args.get("sort") or "").split(",")):
+        field = key.lstrip("-+")
+        if field not in SORT_FIELDS:
+            raise ValueError(f"sort must be one of {', '.join(SORT_FIELDS)} (prefix - for descending)")
+        sort.append((field, DESCENDING if key.startswith("-") else ASCENDING))
+        if field in SUMMARY_FIELDS and field not in query:
+            query[field] = {"$type": "number"}
+    sort = sort or DEFAULT_SORT
+    # Same direction as the last key, so one (field, _id) index serves both directions
+    return query, sort + [("_id", sort[-1][1])]
+
+
+class RunSummaries:
+    """Maintains the summary fields and their indexes on the runs collection."""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self._indexed = False
+
+    def ensure_indexes(self):
+        if not self._indexed:
+            for field in SORT_FIELDS:
+                self.collection.create_index([(field, ASCENDING), ("_id", ASCENDING)])
+                self.collection.create_index([("robot_id", ASCENDING), (field, ASCENDING), ("_id", ASCENDING)])
+            self._indexed = True
+
+    def rebuild(self):
+        """Recompute the summary fields of every analyzed run from its stored analysis."""
+        self.ensure_indexes()
+        projection = {
+            "analysis.score": 1, "analysis.summary": 1, "analysis.mock": 1, "analysis.checkpoint_rate": 1,
+            "analysis.timeline.time_ms": 1, "analysis.stuck_frequency.total_stuck_time_ms": 1
+        }
+        rebuilt = 0
+        for run in self.collection.find({"analyzed": True}, projection):
+            self.collection.update_one({"_id": run["_id"]},
+                                       {"$set": run_summary(run.get("analysis")), "$inc": {"cache_version": 1}})
+            rebuilt += 1
+        return rebuilt
@@ -0,0 +1,265 @@
+"""
+Fleet-wide sensor distributions as mergeable quantile sketches.
+
+For every (metric, robot, section, day) the `sensor_sketches` collection
+holds a log-bucketed histogram (the DDSketch scheme): a value v > 0 is
+counted in bin ceil(log(v) / log(gamma)), gamma = (1 + a) / (1 - a), so a
+quantile read back from the bins is within relative error a
+(SKETCH_RELATIVE_ACCURACY) of an actual value. Bins are plain counts, so
+sketches merge by adding them: ingest $incs a run's bins into its day's
+document and a query sums the bins of the matching documents. Reading fleet
+p5/p50/p95 costs one pass over a few hundred bins per matching document,
+however many readings went in.
+
+Metrics (as /analyze computes them):
+  ultrasonic_distance  - every reading
+  speed                - between consecutive readings, course units per second
+  section_duration_ms  - each stretch the robot stays in one section, from its
+                         first reading to the first reading in the next section;
+                         the run's last stretch (no end) and stretches of a
+                         single reading aren't measured
+
+Live runs are added when they close, so open ones are left out of rebuilds.
+"""
+import math
+import os
+from datetime import datetime
+
+from pymongo import ASCENDING, UpdateOne
+
+from heatmap import start_of_day
+
+SKETCH_RELATIVE_ACCURACY = float(os.getenv("SKETCH_RELATIVE_ACCURACY", 0.01))
+METRICS = ("ultrasonic_distance", "speed", "section_duration_ms")
+DEFAULT_QUANTILES = (0.05, 0.5, 0.95)
+GROUP_BY = ("robot", "section")
+# Values at or below this are counted as zero rather than given ever smaller bins
+MIN_POSITIVE = 1e-3
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def quantile_label(q):
+    return f"p{q * 100:g}"
+
+
+class Sketch:
+    """Relative-error quantile sketch of non-negative values."""
+
+    def __init__(self, accuracy=SKETCH_RELATIVE_ACCURACY):
+        self.accuracy = accuracy
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.bins = {}
+        self.zero = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        if value < 0:
+            return
+        if value <= MIN_POSITIVE:
+            self.zero += 1
+        else:
+            index = math.ceil(math.log(value) / self._log_gamma)
+            self.bins[index] = self.bins.get(index, 0) + 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, doc):
+        """Add a stored sketch document (or another Sketch's to_doc())."""
+        for index, count in (doc.get("bins") or {}).items():
+            index = int(index)
+            self.bins[index] = self.bins.get(index, 0) + count
+        self.zero += doc.get("zero", 0)
+        self.count += doc.get("count", 0)
+        self.sum += doc.get("sum", 0.0)
+        for key, pick in (("min", min), ("max", max)):
+            value = doc.get(key)
+            if value is not None:
+                current = getattr(self, key)
+                setattr(self, key, value if current is None else pick(current, value))
+        return self
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        if rank < self.zero:
+            return 0.0
+        seen = self.zero
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if seen > rank:
+                # Midpoint of (gamma^(i-1), gamma^i] in relative terms
+                value = 2 * self.gamma ** index / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def summary(self, quantiles=DEFAULT_QUANTILES):
+        return {
+            "count": self.count,
+            "mean": self.sum / self.count if self.count else None,
+            "min": self.min,
+            "max": self.max,
+            "quantiles": {quantile_label(q): self.quantile(q) for q in quantiles},
+        }
+
+
+class SketchBuilder:
+    """
+    Turn a run's logs into sketches. Feed batches in order with add(); the
+    result is {(metric, section_id): Sketch}.
+    """
+
+    def __init__(self, accuracy=SKETCH_RELATIVE_ACCURACY):
+        self.accuracy = accuracy
+        self.sketches = {}
+        self._prev = None  # (timestamp_ms, x, y) of the last positioned reading
+        self._section = None
+        self._section_start = None
+        self._section_readings = 0
+
+    def _add(self, metric, section_id, value):
+        sketch = self.sketches.get((metric, section_id))
+        if sketch is None:
+            sketch = self.sketches[(metric, section_id)] = Sketch(self.accuracy)
+        sketch.add(value)
+
+    def add(self, logs):
+        for log in logs:
+            section_id = log.get("section_id")
+            distance = log.get("ultrasonic_distance")
+            if is_number(distance):
+                self._add("ultrasonic_distance", section_id, distance)
+
+            t = log.get("timestamp_ms")
+            if not is_number(t):
+                continue
+            x, y = log.get("x"), log.get("y")
+            if is_number(x) and is_number(y):
+                if self._prev is not None and t > self._prev[0]:
+                    speed = math.hypot(x - self._prev[1], y - self._prev[2]) / ((t - self._prev[0]) / 1000.0)
+                    self._add("speed", section_id, speed)
+                self._prev = (t, x, y)
+
+            if section_id != self._section:
+                # A stretch lasts until the first reading in the next section
+                self._close(t)
+                self._section = section_id
+                self._section_start = t
+                self._section_readings = 0
+            self._section_readings += 1
+        return self
+
+    def _close(self, end):
+        if self._section is not None and self._section_readings > 1:
+            self._add("section_duration_ms", self._section, end - self._section_start)
+
+    def finish(self):
+        # The last stretch has no end boundary, so its duration is unknown
+        self._section = None
+        return self.sketches
+
+
+class SensorSketches:
+    """Per robot, section and day sketches of each metric, merged at query time."""
+
+    def __init__(self, collection, accuracy=SKETCH_RELATIVE_ACCURACY):
+        self.collection = collection
+        self.accuracy = accuracy
+        self._indexed = False
+
+    def _ensure_indexes(self):
+        if not self._indexed:
+            self.collection.create_index([
+                ("metric", ASCENDING), ("robot_id", ASCENDING), ("section_id", ASCENDING),
+                ("day", ASCENDING), ("accuracy", ASCENDING)
+            ], unique=True)
+            self._indexed = True
+
+    def builder(self):
+        return SketchBuilder(self.accuracy)
+
+    def add_run(self, robot_id, when, sketches):
+        """Merge a SketchBuilder.finish() result into the stored day sketches."""
+        sketches = {key: sketch for key, sketch in sketches.items() if sketch.count}
+        if not sketches:
+            return
+        self._ensure_indexes()
+        day = start_of_day(when)
+        self.collection.bulk_write([
+            UpdateOne(
+                {"metric": metric, "robot_id": robot_id, "section_id": section_id, "day": day,
+                 "accuracy": self.accuracy},
+                {
+                    "$inc": {
+                        "count": sketch.count, "zero": sketch.zero, "sum": sketch.sum,
+                        **{f"bins.{index}": count for index, count in sketch.bins.items()}
+                    },
+                    "$min": {"min": sketch.min},
+                    "$max": {"max": sketch.max},
+                },
+                upsert=True
+            )
+            for (metric, section_id), sketch in sketches.items()
+        ], ordered=False)
+
+    def add_stored_run(self, run):
+        sketches = self.builder().add(run.get("logs", [])).finish()
+        self.add_run(run.get("robot_id", "unknown"), run.get("created_at") or datetime.utcnow(), sketches)
+
+    def query(self, metric, robot_id=None, section_id=None, date_from=None, date_to=None,
+              group_by=None, quantiles=DEFAULT_QUANTILES):
+        """
+        Merged summaries of a metric, one per robot or section with group_by
+        ("robot" / "section"), else one for everything that matches.
+        """
+        match = {"metric": metric, "accuracy": self.accuracy}
+        if robot_id:
+            match["robot_id"] = robot_id
+        if section_id is not None:
+            match["section_id"] = section_id
+        if date_from or date_to:
+            match["day"] = {}
+            if date_from:
+                match["day"]["$gte"] = start_of_day(date_from)
+            if date_to:
+                match["day"]["$lte"] = start_of_day(date_to)
+
+        group_key = {"robot": "robot_id", "section": "section_id"}.get(group_by)
+        merged = {}
+        for doc in self.collection.find(match, {"_id": 0, "metric": 0, "day": 0}):
+            key = doc.get(group_key) if group_key else None
+            sketch = merged.get(key)
+            if sketch is None:
+                sketch = merged[key] = Sketch(self.accuracy)
+            sketch.merge(doc)
+
+        groups = []
+        for key, sketch in merged.items():
+            group = {group_key: key} if group_key else {}
+            group.update(sketch.summary(quantiles))
+            groups.append(group)
+        groups.sort(key=lambda g: (str(g.get(group_key)) if group_key else ""))
+        return groups
+
+    def rebuild(self, runs_collection):
+        """Recompute all sketches from the stored runs."""
+        self.clear()
+        rebuilt = 0
+        projection = {"robot_id": 1, "created_at": 1, "logs.section_id": 1, "logs.timestamp_ms": 1,
+                      "logs.x": 1, "logs.y": 1, "logs.ultrasonic_distance": 1}
+        for run in runs_collection.find({"live": {"$ne": True}, "ingesting": {"$ne": True}}, projection):
+            self.add_stored_run(run)
+            rebuilt += 1
+        return rebuilt
+
+    def clear(self):
+        self.collection.delete_many({})
@@ -0,0 +1,168 @@
+"""
+Spatial index over logged positions for cross-run region queries.
+
+Each run's trajectory is bucketed into a fixed grid at ingest. For every cell
+a run passes through, the `position_index` collection holds one document with
+the time windows the run spent in that cell. "Which runs went through (or sat
+in) this area?" is then an indexed lookup of the cells overlapping a bounding
+box, without loading any run's logs.
+"""
+from datetime import timedelta
+
+from pymongo import ASCENDING
+
+from heatmap import start_of_day
+
+# Grid cell size in course units
+CELL_SIZE = 50
+# Windows from neighbouring cells closer than this are merged into one visit
+MERGE_GAP_MS = 250
+
+
+class WindowTracker:
+    """
+    Turn a stream of position logs into per-cell visit windows.
+    Feed batches in order with add(); the result is {(gx, gy): [[start_ms, end_ms], ...]}.
+    """
+
+    def __init__(self, cell_size=CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells = {}
+        self._cell = None
+        self._start = None
+        self._last = None
+
+    def add(self, logs):
+        size = self.cell_size
+        for log in logs:
+            x = log.get("x")
+            y = log.get("y")
+            if x is None or y is None:
+                continue
+            t = log.get("timestamp_ms", 0)
+            cell = (int(x // size), int(y // size))
+            if cell != self._cell:
+                # Leaving a cell: the visit lasts until the first sample outside it
+                self._close(t)
+                self._cell = cell
+                self._start = t
+            self._last = t
+        return self
+
+    def _close(self, end):
+        if self._cell is not None:
+            self.cells.setdefault(self._cell, []).append([self._start, end])
+
+    def finish(self):
+        self._close(self._last)
+        self._cell = None
+        return self.cells
+
+
+def merge_windows(windows, gap_ms=MERGE_GAP_MS):
+    """Merge overlapping or nearly touching [start, end] windows."""
+    merged = []
+    for start, end in sorted(windows):
+        if merged and start <= merged[-1][1] + gap_ms:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+class SpatialIndex:
+    """Grid index of (cell, run, time window) stored in MongoDB."""
+
+    def __init__(self, collection, cell_size=CELL_SIZE):
+        self.collection = collection
+        self.cell_size = cell_size
+        self._indexed = False
+
+    def _ensure_indexes(self):
+        if not self._indexed:
+            self.collection.create_index([("gx", ASCENDING), ("gy", ASCENDING), ("created_at", ASCENDING)])
+            self.collection.create_index("run_id")
+            self._indexed = True
+
+    def tracker(self):
+        return WindowTracker(self.cell_size)
+
+    def add_run(self, run_id, robot_id, created_at, cells):
+        """Store the windows produced by WindowTracker.finish() for one run."""
+        if not cells:
+            return
+        self._ensure_indexes()
+        self.collection.insert_many([
+            {
+                "run_id": run_id,
+                "robot_id": robot_id,
+                "created_at": created_at,
+                "gx": gx,
+                "gy": gy,
+                "windows": windows
+            }
+            for (gx, gy), windows in cells.items()
+        ], ordered=False)
+
+    def query(self, bbox, date_from=None, date_to=None, robot_id=None, min_duration_ms=0):
+        """
+        Runs with positions inside bbox (min_x, min_y, max_x, max_y), with the
+        merged time windows they spent there. Results are at grid resolution.
+        date_to is inclusive: runs from any time on that day match.
+        """
+        min_x, min_y, max_x, max_y = bbox
+        size = self.cell_size
+        match = {
+            "gx": {"$gte": int(min_x // size), "$lte": int(max_x // size)},
+            "gy": {"$gte": int(min_y // size), "$lte": int(max_y // size)},
+        }
+        if date_from or date_to:
+            match["created_at"] = {}
+            if date_from:
+                match["created_at"]["$gte"] = date_from
+            if date_to:
+                match["created_at"]["$lt"] = start_of_day(date_to) + timedelta(days=1)
+        if robot_id:
+            match["robot_id"] = robot_id
+
+        runs = {}
+        for doc in self.collection.find(match, {"_id": 0, "gx": 0, "gy": 0}):
+            run = runs.setdefault(doc["run_id"], {
+                "run_id": str(doc["run_id"]),
+                "robot_id": doc.get("robot_id"),
+                "created_at": doc["created_at"].isoformat() if doc.get("created_at") else None,
+                "windows": []
+            })
+            run["windows"].extend(doc["windows"])
+
+        results = []
+        for run in runs.values():
+            windows = [
+                {"start_ms": start, "end_ms": end, "duration_ms": end - start}
+                for start, end in merge_windows(run["windows"])
+                if end - start >= min_duration_ms
+            ]
+            if not windows:
+                continue
+            run["windows"] = windows
+            run["time_in_region_ms"] = sum(w["duration_ms"] for w in windows)
+            results.append(run)
+        results.sort(key=lambda r: r["created_at"] or "", reverse=True)
+        return results
+
+    def rebuild(self, runs_collection):
+        """Re-index every stored run."""
+        self.clear()
+        rebuilt = 0
+        for run in runs_collection.find({"live": {"$ne": True}, "ingesting": {"$ne": True}},
+                                        {"robot_id": 1, "created_at": 1, "logs.x": 1, "logs.y": 1, "logs.timestamp_ms": 1}):
+            cells = self.tracker().add(run.get("logs", [])).finish()
+            self.add_run(run["_id"], run.get("robot_id", "unknown"), run.get("created_at"), cells)
+            rebuilt += 1
+        return rebuilt
+
+    def delete_runs(self, run_ids):
+        self.collection.delete_many({"run_id": {"$in": list(run_ids)}})
+
+    def clear(self):
+        self.collection.delete_many({})
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Static serving of the built frontend (frontend/dist).
+
+The dist directory is indexed on the first request - file paths, sizes, MIME types, ETags
+and any precompressed .br/.gz siblings - and re-indexed only when
+index.html or the directory itself changes (checked at most every
+STATIC_RESCAN_SECONDS). Requests are then answered from the index without
+touching the filesystem beyond opening the file.
+
+- Vite's content-hashed files (assets/index-3f9a1c2e.js) never change, so
+  they get a one-year immutable Cache-Control; everything else is revalidated
+  with its ETag.
+- A .br or .gz next to a file is served when the client accepts it. Without
+  one, compressible text assets are gzipped once on first request and kept
+  in memory. Run `python static_assets.py` after `npm run build` to write
+  the .gz (and, with the brotli package, .br) variants ahead of time.
+- index.html, the SPA fallback for client-side routes, is held in memory.
+"""
+import gzip
+import mimetypes
+import os
+import re
+import sys
+import threading
+import time
+
+from flask import Response, send_file
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_RESCAN_SECONDS = float(os.getenv("STATIC_RESCAN_SECONDS", 2))
+
+# Vite appends an 8 character base64url content hash: name-[hash].ext. Requiring a
+# digit keeps ordinary hyphenated names (robot-overview.png) from being cached forever;
+# a hash without one is only revalidated, which is safe.
+HASHED_NAME = re.compile(r"-(?=[A-Za-z0-9_-]{0,7}[0-9])[A-Za-z0-9_-]{8}\.[A-Za-z0-9]+$")
+
+# Already-compressed formats (.webp, .png, .glb, ...) gain nothing from gzip
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml",
+                      "application/xml", "model/gltf+json")
+COMPRESSIBLE_EXTENSIONS = (".js", ".mjs", ".css", ".html", ".svg", ".json", ".map", ".txt", ".gltf", ".obj")
+MIN_COMPRESS_BYTES = 1024
+MAX_MEMORY_COMPRESS_BYTES = 8 * 1024 * 1024
+
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE = "no-cache"
+
+ENCODING_SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+
+def is_compressible(path, mimetype):
+    return path.endswith(COMPRESSIBLE_EXTENSIONS) or mimetype.startswith(COMPRESSIBLE_TYPES)
+
+
+class StaticAssets:
+    def __init__(self, root, rescan_seconds=STATIC_RESCAN_SECONDS):
+        self.root = root
+        self.rescan_seconds = rescan_seconds
+        self._lock = threading.Lock()
+        self._assets = {}
+        self._index_html = None  # (bytes, gzipped bytes, etag)
+        self._gzip_cache = {}
+        self._signature = None
+        self._checked_at = 0.0
+
+    @property
+    def available(self):
+        self._refresh()
+        return self._index_html is not None
+
+    def _current_signature(self):
+        try:
+            root = os.stat(self.root)
+            index = os.stat(os.path.join(self.root, "index.html"))
+        except OSError:
+            return None
+        return root.st_mtime_ns, index.st_mtime_ns, index.st_size
+
+    def _refresh(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.rescan_seconds:
+            return
+        with self._lock:
+            self._checked_at = now
+            signature = self._current_signature()
+            if force or signature != self._signature:
+                self._scan()
+                self._signature = signature
+
+    def _scan(self):
+        assets = {}
+        index_html = None
+        if os.path.isdir(self.root):
+            files = set()
+            for dirpath, _, filenames in os.walk(self.root):
+                for filename in filenames:
+                    files.add(os.path.relpath(os.path.join(dirpath, filename), self.root).replace(os.sep, "/"))
+
+            for rel in files:
+                if rel.endswith((".br", ".gz")) and rel[:-3] in files:
+                    continue  # Precompressed variant, attached to its original below
+                full = os.path.join(self.root, rel)
+                stat = os.stat(full)
+                mimetype = mimetypes.guess_type(rel)[0] or "application/octet-stream"
+                assets[rel] = {
+                    "path": full,
+                    "mimetype": mimetype,
+                    "size": stat.st_size,
+                    "etag": f"{stat.st_mtime_ns:x}-{stat.st_size:x}",
+                    "immutable": bool(HASHED_NAME.search(rel)),
+                    "compressible": is_compressible(rel, mimetype) and stat.st_size >= MIN_COMPRESS_BYTES,
+                    "variants": {
+                        encoding: full + suffix
+                        for encoding, suffix in ENCODING_SUFFIXES.items()
+                        if rel + suffix in files
+                    }
+                }
+
+            if "index.html" in assets:
+                with open(assets["index.html"]["path"], "rb") as f:
+                    body = f.read()
+                index_html = (body, gzip.compress(body), assets["index.html"]["etag"])
+
+        self._assets = assets
+        self._index_html = index_html
+        self._gzip_cache = {}
+
+    def _gzipped(self, rel, asset):
+        body = self._gzip_cache.get(rel)
+        if body is None:
+            with open(asset["path"], "rb") as f:
+                body = gzip.compress(f.read())
+            self._gzip_cache[rel] = body
+        return body
+
+    def response(self, path, request):
+        """Response for `path` (SPA fallback to index.html for unknown paths), or None without a build."""
+        self._refresh()
+        if self._index_html is None:
+            return None
+
+        accepted = request.accept_encodings
+        asset = self._assets.get(path) if path != "index.html" else None
+        if asset is None:
+            body, gzipped, etag = self._index_html
+            encoding = "gzip" if "gzip" in accepted else None
+            response = Response(gzipped if encoding else body, mimetype="text/html")
+            return self._finish(response, request, etag, REVALIDATE_CACHE, encoding)
+
+        cache_control = IMMUTABLE_CACHE if asset["immutable"] else REVALIDATE_CACHE
+        for encoding, variant in asset["variants"].items():
+            if encoding in accepted:
+                response = send_file(variant, mimetype=asset["mimetype"], conditional=False, etag=False)
+                return self._finish(response, request, asset["etag"], cache_control, encoding)
+
+        if asset["compressible"] and asset["size"] <= MAX_MEMORY_COMPRESS_BYTES and "gzip" in accepted:
+            response = Response(self._gzipped(path, asset), mimetype=asset["mimetype"])
+            return self._finish(response, request, asset["etag"], cache_control, "gzip")
+
+        response = send_file(asset["path"], mimetype=asset["mimetype"], conditional=True, etag=asset["etag"])
+        return self._finish(response, request, None, cache_control, None, vary=asset["compressible"])
+
+    @staticmethod
+    def _finish(response, request, etag, cache_control, encoding, vary=True):
+        response.headers["Cache-Control"] = cache_control
+        if vary:
+            response.vary.add("Accept-Encoding")
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+        if etag:
+            response.set_etag(f"{etag}-{encoding}" if encoding else etag)
+            response = response.make_conditional(request)
+        return response
+
+
+def precompress(root):
+    """Write .gz (and .br with the brotli package) next to every compressible file in `root`."""
+    written = 0
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            if filename.endswith((".br", ".gz")):
+                continue
+            full = os.path.join(dirpath, filename)
+            mimetype = mimetypes.guess_type(filename)[0] or ""
+            if not is_compressible(filename, mimetype) or os.path.getsize(full) < MIN_COMPRESS_BYTES:
+                continue
+            with open(full, "rb") as f:
+                body = f.read()
+            with open(full + ".gz", "wb") as f:
+                f.write(gzip.compress(body, compresslevel=9))
+            written += 1
+            if brotli is not None:
+                with open(full + ".br", "wb") as f:
+                    f.write(brotli.compress(body))
+                written += 1
+    return written
+
+
+if __name__ == "__main__":
+    target = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(__file__), "..", "frontend", "dist")
+    if not os.path.isdir(target):
+        print(f"{target} not found - run `npm run build` in frontend/ first.")
+        sys.exit(1)
+    count = precompress(target)
+    print(f"Wrote {count} precompressed files in {os.path.abspath(target)}"
+          + ("" if brotli is not None else " (install brotli for .br variants)"))
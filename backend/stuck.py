@@ -0,0 +1,101 @@
+"""
+Single-pass stuck detection.
+
+StuckDetector is a small state machine fed one position sample at a time, so
+the same code runs over a stored run in /analyze and online over the live
+/telemetry stream. A robot is stationary while its speed is below
+`speed_threshold` or it stays within `position_threshold` units of where it
+stopped; a stationary stretch becomes a stuck episode once it has lasted
+`stuck_threshold_ms`.
+"""
+
+STUCK_THRESHOLD_MS = 500  # Consider stuck if no movement for 500ms
+POSITION_THRESHOLD = 3  # Consider stuck if moved less than 3 units
+SPEED_THRESHOLD = 5  # Very low speed threshold (units per second)
+
+STUCK_STARTED = "stuck_started"
+STUCK_ENDED = "stuck_ended"
+
+
+class StuckDetector:
+    def __init__(self, stuck_threshold_ms=STUCK_THRESHOLD_MS, position_threshold=POSITION_THRESHOLD,
+                 speed_threshold=SPEED_THRESHOLD):
+        self.stuck_threshold_ms = stuck_threshold_ms
+        self.position_threshold = position_threshold
+        self.speed_threshold = speed_threshold
+        self.episodes = []  # Confirmed stuck episodes, in order
+        self._prev = None  # (timestamp_ms, x, y) of the previous sample
+        self._candidate = None  # Current stationary stretch, confirmed or not
+        self._confirmed = False
+
+    @property
+    def is_stuck(self):
+        return self._confirmed
+
+    def live_state(self):
+        """State between samples (without the episode list), for storing a live detector."""
+        return {"prev": list(self._prev) if self._prev else None, "candidate": self._candidate,
+                "confirmed": self._confirmed}
+
+    @classmethod
+    def from_state(cls, state, **thresholds):
+        """A detector continuing from a live_state() result (or a fresh one for None)."""
+        detector = cls(**thresholds)
+        if state:
+            detector._prev = tuple(state["prev"]) if state.get("prev") else None
+            detector._candidate = state.get("candidate")
+            detector._confirmed = state.get("confirmed", False)
+        return detector
+
+    def update(self, timestamp_ms, x, y, section=None):
+        """
+        Feed one sample. Returns (STUCK_STARTED, episode) when an episode is
+        confirmed, (STUCK_ENDED, episode) when the robot moves again, else None.
+        """
+        prev = self._prev
+        self._prev = (timestamp_ms, x, y)
+        if prev is None:
+            return None
+        dt = (timestamp_ms - prev[0]) / 1000.0
+        if dt <= 0:
+            return None
+
+        speed = ((x - prev[1]) ** 2 + (y - prev[2]) ** 2) ** 0.5 / dt
+        stationary = speed < self.speed_threshold
+        if not stationary and self._candidate is not None:
+            anchor_distance = ((x - self._candidate["x"]) ** 2 + (y - self._candidate["y"]) ** 2) ** 0.5
+            stationary = anchor_distance <= self.position_threshold
+
+        if stationary:
+            if self._candidate is None:
+                self._candidate = {
+                    "start_time": timestamp_ms,
+                    "end_time": None,
+                    "duration_ms": 0,
+                    "x": x,
+                    "y": y,
+                    "section": section
+                }
+                return None
+            self._candidate["duration_ms"] = timestamp_ms - self._candidate["start_time"]
+            if not self._confirmed and self._candidate["duration_ms"] >= self.stuck_threshold_ms:
+                self._confirmed = True
+                self.episodes.append(self._candidate)
+                return STUCK_STARTED, self._candidate
+            return None
+
+        # Moving again: close the current stretch
+        episode, confirmed = self._candidate, self._confirmed
+        self._candidate = None
+        self._confirmed = False
+        if confirmed:
+            episode["end_time"] = timestamp_ms
+            episode["duration_ms"] = timestamp_ms - episode["start_time"]
+            return STUCK_ENDED, episode
+        return None
+
+    def run(self, logs):
+        """Feed a whole stored run and return its stuck episodes."""
+        for log in logs:
+            self.update(log.get("timestamp_ms", 0), log.get("x", 0), log.get("y", 0), log.get("section_name", "Unknown"))
+        return self.episodes
@@ -7,6 +7,7 @@ and events (pickup, dropoff, obstacle avoidance).
 import requests
 import random
 import math
+import time
 
 API_URL = "http://localhost:5001"
 
@@ -301,13 +302,23 @@ ROBOTS = [
 PERFORMANCE_CYCLE = ["excellent", "good", "poor", "good"]
 
 
-def clear_runs():
-    """Clear all runs from the database."""
+def clear_runs(timeout=300):
+    """Clear all runs from the database and wait for the background job to finish."""
     try:
         response = requests.delete(f"{API_URL}/runs/clear")
         response.raise_for_status()
-        result = response.json()
-        print(f"Cleared {result['deleted_count']} existing runs from database")
+        status_url = f"{API_URL}{response.json()['status_url']}"
+        deadline = time.monotonic() + timeout
+        while True:
+            job = requests.get(status_url).json()
+            if job["status"] == "completed":
+                break
+            if job["status"] in ("failed", "interrupted"):
+                raise RuntimeError(f"clear job {job['status']}: {job.get('error')}")
+            if time.monotonic() > deadline:
+                raise TimeoutError("clear job did not finish in time")
+            time.sleep(0.5)
+        print(f"Cleared {job['deleted']['runs']} existing runs from database")
         return True
     except Exception as e:
         print(f"Error clearing runs: {e}")
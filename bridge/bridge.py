@@ -1,88 +1,296 @@
 import serial
 import serial.tools.list_ports
 import requests
+import argparse
 import json
-import time
+import gzip
+import os
+import queue
 import sys
+import threading
+import time
+import zlib
+
+from framing import StreamDecoder
+
+try:
+    import zstandard
+except ImportError:  # Optional: faster/smaller compression when installed
+    zstandard = None
 
 # CONFIGURATION
 # If running locally, use localhost. If on DigitalOcean, use your Droplet IP.
-SERVER_URL = "http://127.0.0.1:5000" 
+SERVER_URL = "http://127.0.0.1:5000"
 BAUD_RATE = 9600
+# Uploads larger than this many bytes are compressed before sending
+COMPRESS_THRESHOLD = 1024
+# How often to look for newly plugged-in robots
+PORT_SCAN_SECONDS = 2
+# How long to wait for a robot to answer the ID? handshake
+HANDSHAKE_SECONDS = 3
+# How often each port prints its binary frame loss
+LINK_REPORT_SECONDS = 30
+# Edge mode imports the backend's analysis code from here
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend")
+# Upload threads shared by all robots (each robot always uses the same one, so its data stays in order)
+UPLOAD_WORKERS = 4
+
+def encode_payload(data, use_zstd=True):
+    """Serialize a payload to JSON and compress it if it is large. Returns (body, headers)."""
+    body = json.dumps(data, separators=(",", ":")).encode("utf-8")
+    headers = {"Content-Type": "application/json"}
+    if len(body) < COMPRESS_THRESHOLD:
+        return body, headers
+    if use_zstd and zstandard is not None:
+        headers["Content-Encoding"] = "zstd"
+        return zstandard.ZstdCompressor(level=3).compress(body), headers
+    headers["Content-Encoding"] = "gzip"
+    return gzip.compress(body, compresslevel=6), headers
 
-def find_arduino():
-    """Auto-detect the Arduino UNO port."""
+def post_json(path, data, session=requests):
+    """POST a JSON payload to the server, compressed when worthwhile."""
+    body, headers = encode_payload(data)
+    resp = session.post(f"{SERVER_URL}{path}", data=body, headers=headers)
+    if resp.status_code == 415 and headers.get("Content-Encoding") == "zstd":
+        # Server was built without zstd support; gzip is always available
+        body, headers = encode_payload(data, use_zstd=False)
+        resp = session.post(f"{SERVER_URL}{path}", data=body, headers=headers)
+    return resp
+
+def edge_analysis(records):
+    """
+    Edge mode: decode a log dump and compute its deterministic metrics here,
+    with the backend's own analysis code, so the server only has to check
+    them (see /ingest) instead of recomputing. Returns None for no valid logs.
+    """
+    if BACKEND_DIR not in sys.path:
+        sys.path.append(BACKEND_DIR)
+    from analysis import precompute_analysis
+    from decoders import detect_decoder
+
+    logs, _ = detect_decoder(records).decode_batch(records)
+    return precompute_analysis(logs) if logs else None
+
+def find_arduinos():
+    """Auto-detect every connected Arduino UNO port."""
     ports = list(serial.tools.list_ports.comports())
-    for p in ports:
-        # Arduino Uno usually shows up with "Arduino" or "USB Serial" in the description
-        if "Arduino" in p.description or "USB" in p.description:
-            return p.device
-    return None
-
-def main():
-    print("--- UTRA DATA BRIDGE ---")
-    
-    # 1. Connect to Arduino
-    port = find_arduino()
-    if not port:
-        print("❌ Arduino not found. Please plug it in.")
-        # Optional: Ask user to manually enter port if auto-detect fails
-        # port = input("Enter port manually (e.g., COM3): ")
-        sys.exit(1)
-        
-    print(f"✅ Connecting to {port}...")
+    # Arduino Uno usually shows up with "Arduino" or "USB Serial" in the description
+    return [p.device for p in ports if "Arduino" in p.description or "USB" in p.description]
+
+class Uploader:
+    """
+    Pooled uploads shared by every port. Requests go through one keep-alive
+    session; each robot is pinned to one worker thread so its telemetry
+    reaches the server in the order it was read.
+    """
+
+    def __init__(self, workers=UPLOAD_WORKERS, on_response=None, verbose=True, edge=False):
+        # on_response(robot_id, data, response) is called after each upload (used by replay.py)
+        self.on_response = on_response
+        self.verbose = verbose
+        self.edge = edge
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.queues = [queue.Queue() for _ in range(workers)]
+        for q in self.queues:
+            threading.Thread(target=self._work, args=(q,), daemon=True).start()
+
+    @property
+    def pending(self):
+        return sum(q.qsize() for q in self.queues)
+
+    def submit(self, robot_id, data):
+        self.queues[zlib.crc32(robot_id.encode()) % len(self.queues)].put((robot_id, data))
+
+    def _work(self, q):
+        while True:
+            robot_id, data = q.get()
+            try:
+                self._upload(robot_id, data)
+            except (requests.RequestException, ValueError) as e:
+                print(f"[{robot_id}] ❌ Server Error: {e}")
+            except Exception as e:  # Drop the item; the worker must survive for the robot's later readings
+                print(f"[{robot_id}] ❌ Upload failed, dropped {'log dump' if 'logs' in data else 'reading'}: {e!r}")
+
+    def _upload(self, robot_id, data):
+        # MODE A: Live Telemetry (Sensor Readings)
+        if "sensors" in data:
+            # Forward to /telemetry endpoint
+            resp = post_json("/telemetry", data, self.session)
+            if self.on_response:
+                self.on_response(robot_id, data, resp)
+            if self.verbose:
+                sensors = data["sensors"]
+                print(f"[{robot_id}] 📡 Telemetry sent: {data.get('marker') or sensors.get('zone', sensors.get('section_id'))}")
+
+        # MODE B: Bulk Log Dump (EEPROM Download)
+        elif "logs" in data:
+            print(f"[{robot_id}] 💾 Log dump detected! ({len(data['logs'])} events)")
+            if self.edge:
+                try:
+                    analysis = edge_analysis(data["logs"])
+                except Exception as e:  # The server can always compute the metrics itself
+                    print(f"[{robot_id}] ⚠️ Edge metrics failed: {e}")
+                    analysis = None
+                if analysis is not None:
+                    data = {**data, "precomputed_analysis": analysis}
+                    print(f"[{robot_id}] 🧮 Metrics computed at the edge ({len(analysis['issues'])} issues)")
+            # Forward to /ingest endpoint
+            resp = post_json("/ingest", data, self.session)
+            if self.on_response:
+                self.on_response(robot_id, data, resp)
+            result = resp.json()
+            run_id = result.get('run_id')
+            print(f"[{robot_id}] ✅ Run saved! ID: {run_id}")
+            if result.get("precomputed") == "rejected":
+                print(f"[{robot_id}] ⚠️ Server rejected edge metrics: {result.get('precomputed_error')}")
+
+            # Auto-trigger analysis
+            print(f"[{robot_id}] 🧠 Triggering AI Analysis...")
+            self.session.post(f"{SERVER_URL}/analyze", json={"run_id": run_id})
+            print(f"[{robot_id}] ✅ Analysis Complete.")
+
+class PortReader(threading.Thread):
+    """
+    Reads one serial port, which carries JSON lines and/or binary telemetry
+    frames (see framing.py). On connect the robot is asked for its id
+    ("ID?\\n"); it answers with a JSON line such as {"robot_id": "robot_01"}.
+    Robots that don't answer are named after the first robot_id in their
+    data, or else after their port. Every telemetry or log-dump line is
+    tagged with the id and handed to the shared uploader.
+    """
+
+    def __init__(self, port, uploader):
+        super().__init__(daemon=True)
+        self.port = port
+        self.uploader = uploader
+        self.robot_id = f"port-{os.path.basename(port)}"
+        self.identified = False
+        self.decoder = StreamDecoder()
+        self._reported_at = time.monotonic()
+        self.stop_event = threading.Event()
+
+    def run(self):
+        print(f"✅ Connecting to {self.port}...")
+        try:
+            ser = serial.Serial(self.port, BAUD_RATE, timeout=1)
+            time.sleep(2) # Wait for Arduino reboot
+        except Exception as e:
+            print(f"❌ Connection to {self.port} failed: {e}")
+            return
+
+        try:
+            pending = self.handshake(ser)
+            print(f"🚀 {self.port} is {self.robot_id}. Listening for telemetry...")
+            for item in pending:
+                self.handle_item(*item)
+            while not self.stop_event.is_set():
+                for item in self.read_items(ser):
+                    self.handle_item(*item)
+                self.report_link()
+        except (serial.SerialException, OSError) as e:
+            print(f"🔌 {self.port} ({self.robot_id}) disconnected: {e}")
+        finally:
+            ser.close()
+
+    def read_items(self, ser):
+        """Lines and binary frames received since the last call (waits up to the port timeout)."""
+        return self.decoder.feed(ser.read(ser.in_waiting or 1))
+
+    def handshake(self, ser):
+        """Ask the robot for its id. Returns items read meanwhile that still need handling."""
+        ser.write(b"ID?\n")
+        pending = []
+        deadline = time.monotonic() + HANDSHAKE_SECONDS
+        while time.monotonic() < deadline:
+            for kind, value in self.read_items(ser):
+                data = parse_json_line(value) if kind == "line" else None
+                if data and data.get("robot_id") and not self.identified:
+                    self.robot_id = str(data["robot_id"])
+                    self.identified = True
+                    if "sensors" in data or "logs" in data:
+                        pending.append((kind, value))
+                else:
+                    pending.append((kind, value))
+            if self.identified:
+                break
+        return pending
+
+    def handle_item(self, kind, value):
+        if kind == "line":
+            self.handle_line(value)
+        elif kind == "reading":
+            self.uploader.submit(self.robot_id, {"robot_id": self.robot_id, "sensors": value})
+        elif kind == "marker":
+            self.uploader.submit(self.robot_id, {"robot_id": self.robot_id, "marker": value, "sensors": {}})
+
+    def report_link(self):
+        """Print binary frame loss every LINK_REPORT_SECONDS while frames are arriving."""
+        stats = self.decoder.stats
+        now = time.monotonic()
+        if stats.frames and now - self._reported_at >= LINK_REPORT_SECONDS:
+            print(f"[{self.robot_id}] 📶 Link: {stats.summary()}")
+            self._reported_at = now
+
+    def handle_line(self, line):
+        # Check for JSON start/end to filter out debug text
+        if not (line.startswith("{") and line.endswith("}")):
+            # Just debug text from Arduino (Serial.println)
+            print(f"[{self.robot_id}] 🤖 Robot: {line}")
+            return
+        data = parse_json_line(line)
+        if data is None:
+            print(f"[{self.robot_id}] ⚠️ Invalid JSON: {line}")
+            return
+        if "sensors" in data or "logs" in data:
+            if not self.identified and data.get("robot_id"):
+                # No handshake answer, but the robot names itself in its data
+                self.robot_id = str(data["robot_id"])
+                self.identified = True
+            data["robot_id"] = self.robot_id
+            self.uploader.submit(self.robot_id, data)
+
+def parse_json_line(line):
+    if not (line.startswith("{") and line.endswith("}")):
+        return None
     try:
-        ser = serial.Serial(port, BAUD_RATE, timeout=1)
-        time.sleep(2) # Wait for Arduino reboot
-    except Exception as e:
-        print(f"❌ Connection failed: {e}")
-        sys.exit(1)
+        data = json.loads(line)
+    except json.JSONDecodeError:
+        return None
+    return data if isinstance(data, dict) else None
 
-    print("🚀 Bridge Active. Listening for telemetry...")
+def main(edge=False):
+    print("--- UTRA DATA BRIDGE ---" + (" (edge mode)" if edge else ""))
+
+    uploader = Uploader(edge=edge)
+    readers = {}
+    announced = False
 
-    buffer = ""
-    
     while True:
         try:
-            if ser.in_waiting > 0:
-                line = ser.readline().decode('utf-8', errors='ignore').strip()
-                
-                # Check for JSON start/end to filter out debug text
-                if line.startswith("{") and line.endswith("}"):
-                    try:
-                        data = json.loads(line)
-                        
-                        # MODE A: Live Telemetry (Sensor Readings)
-                        if "sensors" in data:
-                            # Forward to /telemetry endpoint
-                            requests.post(f"{SERVER_URL}/telemetry", json=data)
-                            print(f"📡 Telemetry sent: {data['sensors']['zone']}")
-                            
-                        # MODE B: Bulk Log Dump (EEPROM Download)
-                        elif "logs" in data:
-                            print(f"💾 Log dump detected! ({len(data['logs'])} events)")
-                            # Forward to /ingest endpoint
-                            resp = requests.post(f"{SERVER_URL}/ingest", json=data)
-                            run_id = resp.json().get('run_id')
-                            print(f"✅ Run saved! ID: {run_id}")
-                            
-                            # Auto-trigger analysis
-                            print("🧠 Triggering AI Analysis...")
-                            requests.post(f"{SERVER_URL}/analyze", json={"run_id": run_id})
-                            print("✅ Analysis Complete.")
-                            
-                    except json.JSONDecodeError:
-                        print(f"⚠️ Invalid JSON: {line}")
-                    except requests.RequestException as e:
-                        print(f"❌ Server Error: {e}")
-                else:
-                    # Just debug text from Arduino (Serial.println)
-                    print(f"🤖 Robot: {line}")
-                    
+            # Attach to new ports; a reader that exited (unplugged) is retried when its port reappears
+            for port in find_arduinos():
+                reader = readers.get(port)
+                if reader is None or not reader.is_alive():
+                    readers[port] = PortReader(port, uploader)
+                    readers[port].start()
+            if not readers and not announced:
+                print("⌛ No Arduino found. Plug one in (new robots are picked up automatically).")
+                announced = True
+            time.sleep(PORT_SCAN_SECONDS)
+
         except KeyboardInterrupt:
             print("\nStopping Bridge...")
-            ser.close()
+            for reader in readers.values():
+                reader.stop_event.set()
+            for reader in readers.values():
+                reader.join(timeout=2)
             break
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Forward robot telemetry and log dumps from serial to the backend.")
+    parser.add_argument("--edge", action="store_true",
+                        help="compute run metrics locally and upload them with each log dump")
+    main(parser.parse_args().edge)
@@ -0,0 +1,246 @@
+"""
+Framed binary telemetry.
+
+JSON telemetry costs ~120 bytes a reading, which caps a 9600 baud link at
+under ten readings a second. Framed readings are ~15 bytes:
+
+  AA 55 | LEN | TYPE | SEQ | payload (LEN bytes) | CRC16 (big-endian)
+
+- AA 55 marks the start of a frame; the decoder rescans for it after noise.
+- TYPE is KEYFRAME (absolute values), DELTA (changes since the previous
+  reading) or MARKER (payload 1 = run start, 2 = run stop).
+- SEQ counts frames modulo 256, so gaps show how many frames were lost.
+- CRC is CRC-16/CCITT-FALSE over LEN, TYPE, SEQ and the payload.
+
+A reading's payload is one zigzag varint per FIELDS entry, in order, scaled
+to integers by FIELD_SCALES. Unchanged fields in a DELTA frame cost one byte.
+A DELTA can only be applied on top of the reading before it, so after a lost
+or corrupt frame the decoder drops deltas until the next KEYFRAME; senders
+should emit one every KEYFRAME_INTERVAL frames.
+
+Frames share the serial link with newline-terminated text (JSON log dumps,
+the ID handshake, debug prints), which StreamDecoder passes through as lines.
+"""
+import binascii
+
+SYNC = b"\xaa\x55"
+KEYFRAME = 0x01
+DELTA = 0x02
+MARKER = 0x03
+MARKERS = {1: "start", 2: "stop"}
+
+FIELDS = ("timestamp", "section_id", "x", "y", "ultrasonic_distance", "checkpoint_success", "claw_status")
+# Sent as round(value * scale)
+FIELD_SCALES = {"x": 10, "y": 10, "ultrasonic_distance": 10}
+
+HEADER_SIZE = 5  # sync, length, type, seq
+CRC_SIZE = 2
+MAX_PAYLOAD = 64
+# Text longer than this without a newline is treated as noise...
+MAX_LINE = 4096
+# ...unless it starts like a JSON object: EEPROM log dumps are single lines far longer than MAX_LINE
+MAX_JSON_LINE = 16 * 1024 * 1024
+KEYFRAME_INTERVAL = 20
+
+
+def crc16(data):
+    return binascii.crc_hqx(data, 0xFFFF)
+
+
+def put_varint(out, value):
+    value = (value << 1) ^ (value >> 63)  # zigzag
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def get_varints(payload, count):
+    values = []
+    value = shift = 0
+    for byte in payload:
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            values.append((value >> 1) ^ -(value & 1))
+            value = shift = 0
+    if len(values) != count or shift:
+        raise ValueError("malformed payload")
+    return values
+
+
+def to_ints(sensors):
+    return [round((sensors.get(field) or 0) * FIELD_SCALES.get(field, 1)) for field in FIELDS]
+
+
+def from_ints(values):
+    return {
+        field: value / FIELD_SCALES[field] if field in FIELD_SCALES else value
+        for field, value in zip(FIELDS, values)
+    }
+
+
+def frame(frame_type, seq, payload):
+    body = bytes([len(payload), frame_type, seq & 0xFF]) + bytes(payload)
+    return SYNC + body + crc16(body).to_bytes(2, "big")
+
+
+class FrameEncoder:
+    """Encode readings (sensor dicts with FIELDS keys) as frames, as the firmware would."""
+
+    def __init__(self, keyframe_interval=KEYFRAME_INTERVAL):
+        self.keyframe_interval = keyframe_interval
+        self.seq = 0
+        self._previous = None
+        self._since_keyframe = 0
+
+    def _next(self, frame_type, payload):
+        data = frame(frame_type, self.seq, payload)
+        self.seq = (self.seq + 1) & 0xFF
+        return data
+
+    def reading(self, sensors):
+        values = to_ints(sensors)
+        payload = bytearray()
+        if self._previous is None or self._since_keyframe >= self.keyframe_interval:
+            frame_type = KEYFRAME
+            self._since_keyframe = 0
+            for value in values:
+                put_varint(payload, value)
+        else:
+            frame_type = DELTA
+            for value, previous in zip(values, self._previous):
+                put_varint(payload, value - previous)
+        self._previous = values
+        self._since_keyframe += 1
+        return self._next(frame_type, payload)
+
+    def marker(self, name):
+        code = next(code for code, marker in MARKERS.items() if marker == name)
+        return self._next(MARKER, bytes([code]))
+
+
+class LinkStats:
+    def __init__(self):
+        self.frames = 0
+        self.lost = 0
+        self.crc_errors = 0
+        self.dropped_deltas = 0
+        self.noise_bytes = 0
+
+    @property
+    def loss_rate(self):
+        expected = self.frames + self.lost
+        return self.lost / expected if expected else 0.0
+
+    def summary(self):
+        return (f"{self.frames} frames, {self.lost} lost ({self.loss_rate:.2%}), "
+                f"{self.crc_errors} CRC errors, {self.dropped_deltas} deltas dropped, "
+                f"{self.noise_bytes} noise bytes")
+
+
+class StreamDecoder:
+    """
+    Split raw serial bytes into frames and text lines. feed() returns a list
+    of ("reading", sensors), ("marker", "start" | "stop") and ("line", str)
+    items in arrival order.
+    """
+
+    def __init__(self):
+        self.stats = LinkStats()
+        self._buffer = bytearray()
+        self._text = bytearray()
+        self._previous = None  # Last reading's integer values; None until a keyframe
+        self._seq = None
+
+    def feed(self, data):
+        self._buffer += data
+        items = []
+        buffer = self._buffer
+        while buffer:
+            sync = buffer.find(SYNC)
+            newline = buffer.find(b"\n")
+            if sync != 0:
+                # Text (or noise) up to the next frame or line end
+                end = len(buffer) if sync < 0 else sync
+                if 0 <= newline < end:
+                    self._text += buffer[:newline]
+                    del buffer[:newline + 1]
+                    self._emit_line(items)
+                    continue
+                if sync < 0 and buffer.endswith(SYNC[:1]):
+                    end -= 1  # Possibly the first half of a sync marker
+                self._text += buffer[:end]
+                del buffer[:end]
+                if len(self._text) > self._line_limit():
+                    self.stats.noise_bytes += len(self._text)
+                    self._text.clear()
+                if sync < 0:
+                    break
+                continue
+
+            if self._text:
+                # Unterminated text before a frame is line noise
+                self.stats.noise_bytes += len(self._text)
+                self._text.clear()
+            if len(buffer) < HEADER_SIZE:
+                break
+            length = buffer[2]
+            if length > MAX_PAYLOAD:
+                self._resync(buffer)
+                continue
+            size = HEADER_SIZE + length + CRC_SIZE
+            if len(buffer) < size:
+                break
+            body = bytes(buffer[2:HEADER_SIZE + length])
+            if crc16(body) != int.from_bytes(buffer[size - CRC_SIZE:size], "big"):
+                self.stats.crc_errors += 1
+                self._resync(buffer)
+                continue
+            del buffer[:size]
+            self._frame(body[1], body[2], body[3:], items)
+        return items
+
+    def _line_limit(self):
+        return MAX_JSON_LINE if self._text.lstrip()[:1] == b"{" else MAX_LINE
+
+    def _resync(self, buffer):
+        # Skip this sync marker and look for the next one
+        self.stats.noise_bytes += 1
+        del buffer[:1]
+        self._previous = None
+
+    def _emit_line(self, items):
+        line = self._text.decode("utf-8", errors="ignore").strip()
+        self._text.clear()
+        if line:
+            items.append(("line", line))
+
+    def _frame(self, frame_type, seq, payload, items):
+        self.stats.frames += 1
+        if self._seq is not None:
+            lost = (seq - self._seq - 1) & 0xFF
+            if lost:
+                self.stats.lost += lost
+                self._previous = None
+        self._seq = seq
+
+        if frame_type == MARKER:
+            if payload and payload[0] in MARKERS:
+                items.append(("marker", MARKERS[payload[0]]))
+            return
+        try:
+            values = get_varints(payload, len(FIELDS))
+        except ValueError:
+            self.stats.crc_errors += 1
+            self._previous = None
+            return
+        if frame_type == DELTA:
+            if self._previous is None:
+                self.stats.dropped_deltas += 1
+                return
+            values = [previous + delta for previous, delta in zip(self._previous, values)]
+        elif frame_type != KEYFRAME:
+            return
+        self._previous = values
+        items.append(("reading", from_ints(values)))
@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""
+Virtual serial replay harness.
+
+Creates a pseudo-terminal, attaches a bridge PortReader to it as if it were
+an Arduino, and writes a byte stream into the other end at a simulated baud
+rate (bytes arrive at baud / 10 per second, times --speed). Readings travel
+the real path - serial, decoder, uploader, HTTP, backend, MongoDB - and each
+one is timed from the moment its last byte is written to the moment the
+backend confirms it was stored.
+
+The stream is either synthetic (JSON telemetry lines or binary frames, with
+debug lines and optional garbage bytes mixed in, and optionally an EEPROM
+log dump - one JSON line, far longer than framing.MAX_LINE - after the run)
+or a recorded capture of raw serial bytes (--file). Like a UART, the pty drops bytes when nobody
+reads them fast enough; those are counted as overrun.
+
+A backend must be running at --server.
+
+Usage:
+  python replay.py                               # 500 JSON readings at 9600 baud
+  python replay.py --format frames --speed 8     # binary frames at 8x 9600 baud
+  python replay.py --format frames --dump-logs 2000     # plus a 2000-event log dump line
+  python replay.py --sweep                       # double --speed until readings are lost
+  python replay.py --file capture.bin            # replay a recorded serial capture
+  python replay.py --format frames --save capture.bin   # write the synthetic stream instead
+"""
+import argparse
+import json
+import math
+import os
+import pty
+import random
+import threading
+import time
+import tty
+
+import bridge
+from framing import FrameEncoder, StreamDecoder
+
+TICK_SECONDS = 0.01
+HANDSHAKE_TIMEOUT = 10
+# Time allowed after the last byte for uploads to finish
+DRAIN_SECONDS = 10
+# A speed is sustainable if at least this fraction of readings is stored...
+MIN_DELIVERY = 0.99
+# ...and p95 latency stays under this
+MAX_P95_LATENCY_MS = 1000
+MAX_SWEEP_SPEED = 1024
+# Long pieces (log dumps) are written in paced slices of this many bytes
+WRITE_CHUNK = 256
+
+
+def dump_line(count, rng, dump_id):
+    """An EEPROM log dump of `count` event-format records as one JSON line."""
+    logs = [{"event": rng.randint(1, 4), "data": rng.randint(0, 3), "timestamp": (i + 1) * 250}
+            for i in range(count)]
+    return json.dumps({"logs": logs, "metadata": {"replay_dump": dump_id}}).encode() + b"\n"
+
+
+def upload_id(data):
+    """The id synthetic_stream gave an upload: sensors.timestamp, or the dump id of a log dump."""
+    return (data.get("sensors") or {}).get("timestamp", (data.get("metadata") or {}).get("replay_dump"))
+
+
+def synthetic_stream(count, fmt="json", noise_every=50, garbage=0.0, seed=0, dump_logs=0):
+    """
+    Pieces of a synthetic session: [(bytes, reading_id or None)]. Each
+    reading's id is its sensors.timestamp, which comes back in the upload.
+    With dump_logs, a log dump of that many events follows the run; its id
+    is the string "dump".
+    """
+    rng = random.Random(seed)
+    encoder = FrameEncoder()
+    pieces = []
+
+    def marker(name):
+        if fmt == "frames":
+            return encoder.marker(name)
+        return json.dumps({"marker": name, "sensors": {}}).encode() + b"\n"
+
+    pieces.append((marker("start"), None))
+    x, y = 0.0, 0.0
+    for i in range(count):
+        x += rng.uniform(0, 2)
+        y += rng.uniform(-1, 1)
+        sensors = {
+            "timestamp": (i + 1) * 10,
+            "section_id": 1 + 3 * i // count,
+            "x": round(x, 1),
+            "y": round(y, 1),
+            "ultrasonic_distance": round(rng.uniform(10, 60), 1),
+            "checkpoint_success": int(i % 40 == 0),
+            "claw_status": 90,
+        }
+        if fmt == "frames":
+            data = encoder.reading(sensors)
+        else:
+            data = json.dumps({"sensors": sensors}).encode() + b"\n"
+        if garbage and rng.random() < garbage:
+            data = bytes(rng.randrange(256) for _ in range(rng.randint(1, 8))) + data
+        pieces.append((data, sensors["timestamp"]))
+        if noise_every and i % noise_every == noise_every - 1:
+            pieces.append((f"DBG loop={i} free_ram=1234\n".encode(), None))
+    pieces.append((marker("stop"), None))
+    if dump_logs:
+        pieces.append((dump_line(dump_logs, rng, "dump"), "dump"))
+    return pieces
+
+
+def recorded_stream(path, chunk=64):
+    """A capture file as pieces; readings in it are counted but not timed."""
+    with open(path, "rb") as f:
+        data = f.read()
+    return [(data[i:i + chunk], None) for i in range(0, len(data), chunk)]
+
+
+def count_readings(pieces):
+    decoder = StreamDecoder()
+    count = 0
+    for data, _ in pieces:
+        for kind, value in decoder.feed(data):
+            if kind == "reading":
+                count += 1
+            elif kind == "line":
+                parsed = bridge.parse_json_line(value)
+                count += bool(parsed and (parsed.get("sensors") or "logs" in parsed))
+    return count
+
+
+class VirtualSerial:
+    """A pty pair; the bridge opens `port`, the harness writes to the master end."""
+
+    def __init__(self):
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        os.set_blocking(self.master, False)
+        self.overrun = 0
+
+    def wait_for(self, token, timeout):
+        received = b""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                received += os.read(self.master, 1024)
+            except (BlockingIOError, OSError):
+                time.sleep(0.05)
+            if token in received:
+                return True
+        return False
+
+    def write(self, data):
+        """Write without blocking; whatever doesn't fit is lost, as on a UART."""
+        try:
+            written = os.write(self.master, data)
+        except BlockingIOError:
+            written = 0
+        self.overrun += len(data) - written
+
+    def play(self, pieces, bytes_per_second, on_written):
+        """Write pieces paced at bytes_per_second, calling on_written(reading_id) after each reading."""
+        started = time.perf_counter()
+        sent = 0
+        for data, reading_id in pieces:
+            for i in range(0, len(data), WRITE_CHUNK):
+                piece = data[i:i + WRITE_CHUNK]
+                sent += len(piece)
+                # Don't let this slice finish before the link could have carried it
+                delay = started + sent / bytes_per_second - time.perf_counter()
+                if delay > TICK_SECONDS:
+                    time.sleep(delay)
+                self.write(piece)
+            if reading_id is not None:
+                on_written(reading_id)
+
+    def close(self):
+        os.close(self.master)
+        os.close(self.slave)
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, math.ceil(fraction * len(values)) - 1)]
+
+
+def run_replay(pieces, baud=bridge.BAUD_RATE, speed=1.0, robot_id="replay-01", total_readings=None):
+    """Play `pieces` through a bridge PortReader into the backend. Returns a result dict."""
+    written_at = {}
+    latencies = []
+    counts = {"stored": 0, "errors": 0}
+    lock = threading.Lock()
+    last_stored = [None]
+
+    def on_response(_, data, response):
+        now = time.perf_counter()
+        reading_id = upload_id(data)
+        with lock:
+            if response.status_code != 201:
+                counts["errors"] += 1
+                return
+            if "marker" in data and not data["sensors"]:
+                return
+            counts["stored"] += 1
+            last_stored[0] = now
+            if reading_id in written_at:
+                latencies.append((now - written_at.pop(reading_id)) * 1000)
+
+    def on_written(reading_id):
+        with lock:
+            written_at[reading_id] = time.perf_counter()
+
+    uploader = bridge.Uploader(on_response=on_response, verbose=False)
+    serial_port = VirtualSerial()
+    reader = bridge.PortReader(serial_port.port, uploader)
+    reader.start()
+    try:
+        if not serial_port.wait_for(b"ID?", HANDSHAKE_TIMEOUT):
+            raise RuntimeError("bridge did not open the virtual port")
+        serial_port.write(json.dumps({"robot_id": robot_id}).encode() + b"\n")
+        time.sleep(0.2)
+
+        bytes_per_second = baud / 10 * speed
+        started = time.perf_counter()
+        serial_port.play(pieces, bytes_per_second, on_written)
+        finished = time.perf_counter()
+
+        expected = total_readings if total_readings is not None else sum(1 for _, rid in pieces if rid is not None)
+        deadline = finished + DRAIN_SECONDS
+        while time.perf_counter() < deadline:
+            with lock:
+                done = counts["stored"] + counts["errors"] >= expected
+            if done or (uploader.pending == 0 and time.perf_counter() - finished > 1):
+                break
+            time.sleep(0.05)
+    finally:
+        reader.stop_event.set()
+        reader.join(timeout=3)
+        serial_port.close()
+
+    elapsed = (last_stored[0] or finished) - started
+    stored = counts["stored"]
+    return {
+        "speed": speed,
+        "bytes_per_second": bytes_per_second,
+        "readings": expected,
+        "stored": stored,
+        "errors": counts["errors"],
+        "delivery": stored / expected if expected else 1.0,
+        "stored_per_second": stored / elapsed if elapsed > 0 else 0.0,
+        "overrun_bytes": serial_port.overrun,
+        "latency_ms": {
+            "p50": percentile(latencies, 0.5),
+            "p95": percentile(latencies, 0.95),
+            "max": max(latencies) if latencies else None,
+        },
+        "link": reader.decoder.stats.summary(),
+        "backlog": uploader.pending,
+    }
+
+
+def sustainable(result):
+    p95 = result["latency_ms"]["p95"]
+    return result["delivery"] >= MIN_DELIVERY and (p95 is None or p95 <= MAX_P95_LATENCY_MS)
+
+
+def print_result(result):
+    latency = result["latency_ms"]
+    timing = (f"latency p50 {latency['p50']:.1f} / p95 {latency['p95']:.1f} / max {latency['max']:.1f} ms"
+              if latency["p50"] is not None else "latency n/a")
+    print(f"  speed x{result['speed']:g} ({result['bytes_per_second']:,.0f} B/s): "
+          f"{result['stored']}/{result['readings']} stored ({result['delivery']:.1%}), "
+          f"{result['stored_per_second']:,.1f} readings/s, {timing}")
+    print(f"    overrun {result['overrun_bytes']} bytes, {result['errors']} upload errors, "
+          f"backlog {result['backlog']}; link: {result['link']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a serial byte stream through the bridge into a local backend.")
+    parser.add_argument("--server", default=bridge.SERVER_URL, help="backend URL")
+    parser.add_argument("--format", choices=("json", "frames"), default="json", help="synthetic telemetry encoding")
+    parser.add_argument("--readings", type=int, default=500, help="synthetic readings per run")
+    parser.add_argument("--noise-every", type=int, default=50, help="debug line every N readings (0 = none)")
+    parser.add_argument("--garbage", type=float, default=0.0, help="fraction of readings preceded by random bytes")
+    parser.add_argument("--dump-logs", type=int, default=0, help="log dump of N events after the run (0 = none)")
+    parser.add_argument("--file", help="replay this recorded byte stream instead")
+    parser.add_argument("--save", help="write the synthetic stream to this file and exit")
+    parser.add_argument("--baud", type=int, default=bridge.BAUD_RATE)
+    parser.add_argument("--speed", type=float, default=1.0, help="multiple of the baud rate")
+    parser.add_argument("--sweep", action="store_true", help="double the speed until delivery or latency degrades")
+    args = parser.parse_args()
+
+    if args.file:
+        pieces = recorded_stream(args.file)
+    else:
+        pieces = synthetic_stream(args.readings, args.format, args.noise_every, args.garbage,
+                                  dump_logs=args.dump_logs)
+    if args.save:
+        with open(args.save, "wb") as f:
+            f.write(b"".join(data for data, _ in pieces))
+        print(f"Wrote {sum(len(data) for data, _ in pieces):,} bytes to {args.save}")
+        raise SystemExit
+
+    bridge.SERVER_URL = args.server
+    total = count_readings(pieces)
+    print(f"--- REPLAY: {total} readings, {sum(len(data) for data, _ in pieces):,} bytes -> {args.server} ---")
+    if not args.sweep:
+        print_result(run_replay(pieces, args.baud, args.speed, total_readings=total))
+        raise SystemExit
+
+    best = None
+    speed = args.speed
+    while True:
+        result = run_replay(pieces, args.baud, speed, total_readings=total)
+        print_result(result)
+        if not sustainable(result):
+            break
+        best = result
+        if speed * 2 > MAX_SWEEP_SPEED:
+            break
+        speed *= 2
+    if best:
+        print(f"Max sustainable: x{best['speed']:g} of {args.baud} baud, "
+              f"{best['stored_per_second']:,.1f} readings/s")
+    else:
+        print(f"Not sustainable even at x{args.speed:g}")
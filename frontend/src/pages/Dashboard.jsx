@@ -7,6 +7,8 @@ import '../App.css';
 
 // CONFIG
 const API_URL = "http://localhost:5001";
+// Max points per chart series requested from the API (charts are ~270px wide)
+const CHART_POINTS = 300;
 
 function Dashboard() {
   const navigate = useNavigate();
@@ -44,7 +46,7 @@ function Dashboard() {
 
   const fetchRunDetail = async (runId) => {
     try {
-      const res = await fetch(`${API_URL}/runs/${runId}`);
+      const res = await fetch(`${API_URL}/runs/${runId}?points=${CHART_POINTS}`);
       const data = await res.json();
       if (data.analysis) {
         setAnalysis(data.analysis);
@@ -66,7 +68,7 @@ function Dashboard() {
     if (!selectedRun) return;
     setAnalyzing(true);
     try {
-      const res = await fetch(`${API_URL}/analyze`, {
+      const res = await fetch(`${API_URL}/analyze?points=${CHART_POINTS}`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({ run_id: selectedRun._id })